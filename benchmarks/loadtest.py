@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Load test the app under gunicorn with different worker models.
+
+For every worker model, gunicorn is started with the app polling a fake haproxy (a unix
+socket in this process answering 'show stat' for a synthetic fleet, see
+haproxy_status.simulate), and /ping and /status are requested over HTTP with the given
+concurrency, one connection per request like haproxy's health checks.
+
+Reported per worker model and path: requests per second, p50/p99/p99.9 latency, the
+number of 'show stat' commands haproxy got during the run and the RSS of every worker.
+
+Usage:
+
+    PYTHONPATH=src python benchmarks/loadtest.py [--models sync:4 gthread:2x8 gevent:4]
+                                                 [--concurrency N] [--seconds S]
+
+A model is WORKER_CLASS:WORKERS or WORKER_CLASS:WORKERSxTHREADS, as used for
+worker_class, workers and worker_threads in docker/start.sh. Models whose worker class
+can't be imported (e.g. gevent when it isn't installed) are skipped.
+"""
+
+import argparse
+import http.client
+import importlib.util
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from haproxy_status.simulate import Fleet
+
+# worker class -> module that has to be importable
+WORKER_CLASS_MODULES = {"gevent": "gevent", "eventlet": "eventlet"}
+
+
+class FakeHAProxy(object):
+    """A haproxy stats socket answering 'show stat' for a synthetic fleet."""
+
+    def __init__(self, path, fleet, delay=0.0):
+        self.path = path
+        self.fleet = fleet
+        self.delay = delay
+        self.commands = 0
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(path)
+        self._sock.listen(128)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                conn, _addr = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            conn.recv(1024)
+            with self._lock:
+                self.commands += 1
+                data = self.fleet.show_stat(time.time())
+            time.sleep(self.delay)
+            try:
+                conn.sendall(data.encode("utf-8"))
+            except OSError:
+                pass
+
+    def close(self):
+        self._sock.close()
+
+
+def parse_model(model):
+    worker_class, _sep, size = model.partition(":")
+    workers, _sep, threads = (size or "1").partition("x")
+    return worker_class, int(workers), int(threads or 1)
+
+
+def worker_pids(master_pid):
+    """The pids of the children of gunicorn's master process (Linux only)."""
+    path = "/proc/{0}/task/{0}/children".format(master_pid)
+    try:
+        with open(path) as fd:
+            return [int(x) for x in fd.read().split()]
+    except OSError:
+        return []
+
+
+def rss_kb(pid):
+    try:
+        with open("/proc/{}/status".format(pid)) as fd:
+            for line in fd:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/ping")
+            conn.getresponse().read()
+            conn.close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def drive(port, path, concurrency, seconds):
+    """Request path as fast as possible from concurrency threads for seconds."""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def client():
+        mine = []
+        failed = 0
+        while time.monotonic() < deadline:
+            t0 = time.perf_counter()
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+                conn.request("GET", path)
+                response = conn.getresponse()
+                response.read()
+                conn.close()
+                if response.status >= 500:
+                    failed += 1
+                    continue
+            except OSError:
+                failed += 1
+                continue
+            mine.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    t0 = time.monotonic()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sorted(latencies), sum(errors), time.monotonic() - t0
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run_model(model, args, tmpdir, haproxy):
+    worker_class, workers, threads = parse_model(model)
+    port = args.port
+    env = dict(os.environ)
+    env.update(
+        {
+            "STATS_URL": haproxy.path,
+            "STATUS_OUTPUT_FILENAME": os.path.join(tmpdir, "status.txt"),
+            "SIGNAL_DIRECTORY": tmpdir,
+            "LOG_LEVEL": "WARNING",
+        }
+    )
+    cmd = [
+        args.gunicorn,
+        "--bind",
+        "127.0.0.1:{}".format(port),
+        "--workers",
+        str(workers),
+        "--worker-class",
+        worker_class,
+        "--threads",
+        str(threads),
+        "--backlog",
+        "2048",
+        "haproxy_status.run:app",
+    ]
+    proc = subprocess.Popen(
+        cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        if not wait_for_port(port):
+            print("{:<14} failed to start".format(model))
+            return
+        # let the workers start and do their first fetch
+        time.sleep(1)
+        for path in args.paths:
+            commands = haproxy.commands
+            latencies, errors, elapsed = drive(
+                port, path, args.concurrency, args.seconds
+            )
+            rss = [rss_kb(pid) // 1024 for pid in worker_pids(proc.pid)]
+            print(
+                "{:<14} {:<8} {:>9.0f} {:>8.2f} {:>8.2f} {:>8.2f} {:>7} {:>8} {}".format(
+                    model,
+                    path,
+                    len(latencies) / elapsed,
+                    percentile(latencies, 50) * 1000,
+                    percentile(latencies, 99) * 1000,
+                    percentile(latencies, 99.9) * 1000,
+                    errors,
+                    haproxy.commands - commands,
+                    ",".join(str(x) for x in rss),
+                )
+            )
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=["sync:1", "sync:4", "gthread:1x8", "gthread:4x4", "gevent:4"],
+    )
+    parser.add_argument("--paths", nargs="+", default=["/ping", "/status"])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--backends", type=int, default=20)
+    parser.add_argument("--servers", type=int, default=4, help="servers per backend")
+    parser.add_argument(
+        "--haproxy-delay", type=float, default=0, help="delay of every haproxy reply"
+    )
+    parser.add_argument("--gunicorn", default=shutil.which("gunicorn"))
+    args = parser.parse_args()
+
+    if not args.gunicorn:
+        print("gunicorn not found, install it or use --gunicorn PATH")
+        return 1
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fleet = Fleet(time.time(), args.backends, args.servers, seed=1)
+        haproxy = FakeHAProxy(os.path.join(tmpdir, "stats"), fleet, args.haproxy_delay)
+        print(
+            "{:<14} {:<8} {:>9} {:>8} {:>8} {:>8} {:>7} {:>8} {}".format(
+                "model",
+                "path",
+                "req/s",
+                "p50/ms",
+                "p99/ms",
+                "p999/ms",
+                "errors",
+                "fetches",
+                "RSS/MB per worker",
+            )
+        )
+        try:
+            for model in args.models:
+                module = WORKER_CLASS_MODULES.get(parse_model(model)[0])
+                if module and importlib.util.find_spec(module) is None:
+                    print("{:<14} skipped, {} is not installed".format(model, module))
+                    continue
+                run_model(model, args, tmpdir, haproxy)
+        finally:
+            haproxy.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
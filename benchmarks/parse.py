@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Compare parsing 'show stat' serially and in a ParsePool, for growing responses.
+
+The responses have the ~100 columns of a haproxy 2.x 'show stat'. The pool is started
+(and warmed up) before the measurements, as it would be after the first large poll.
+The row count where parallel starts beating serial is a good PARSE_PARALLEL_MIN_LINES.
+With a single core it never does.
+
+Usage:
+
+    PYTHONPATH=src python benchmarks/parse.py [--workers N] [--rows 1000 10000 50000]
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import time
+
+from haproxy_status.status import ParsePool, parse_status
+
+FIELDS = (
+    "pxname,svname,qcur,qmax,scur,smax,slim,stot,bin,bout,dreq,dresp,ereq,econ,eresp,"
+    "wretr,wredis,status,weight,act,bck,chkfail,chkdown,lastchg,downtime,qlimit,pid,"
+    "iid,sid,throttle,lbtot,tracked,type,rate,rate_lim,rate_max,check_status,"
+    "check_code,check_duration,hrsp_1xx,hrsp_2xx,hrsp_3xx,hrsp_4xx,hrsp_5xx,"
+    "hrsp_other,hanafail,req_rate,req_rate_max,req_tot,cli_abrt,srv_abrt,comp_in,"
+    "comp_out,comp_byp,comp_rsp,lastsess,last_chk,last_agt,qtime,ctime,rtime,ttime,"
+    "agent_status,agent_code,agent_duration,check_desc,agent_desc,check_rise,"
+    "check_fall,check_health,agent_rise,agent_fall,agent_health,addr,cookie,mode,algo,"
+    "conn_rate,conn_rate_max,conn_tot,intercepted,dcon,dses,wrew,connect,reuse,"
+    "cache_lookups,cache_hits,srv_icur,src_ilim,qtime_max,ctime_max,rtime_max,"
+    "ttime_max,eint,idle_conn_cur,safe_conn_cur,used_conn_cur,need_conn_est,uweight,"
+    "agg_server_status,agg_server_check_status,agg_check_status"
+).split(",")
+
+
+def make_show_stat(rows, servers_per_backend=10):
+    values = {name: str(i * 7 % 1000) for i, name in enumerate(FIELDS)}
+    values.update(
+        {
+            "status": "UP",
+            "mode": "http",
+            "check_status": "L7OK",
+            "check_desc": "Layer7 check passed",
+            "last_chk": "200 OK",
+            "type": "2",
+        }
+    )
+    lines = ["# " + ",".join(FIELDS) + ","]
+    for i in range(rows):
+        backend, server = divmod(i, servers_per_backend + 1)
+        values["pxname"] = "site{}__default".format(backend)
+        values["svname"] = (
+            "BACKEND" if server == servers_per_backend else "server{}".format(server)
+        )
+        values["addr"] = "10.{}.{}.{}:443".format(i >> 16, (i >> 8) & 255, i & 255)
+        lines += [",".join(values[x] for x in FIELDS) + ","]
+    return "\n".join(lines) + "\n"
+
+
+def timed(func, runs):
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        func()
+        times += [time.perf_counter() - t0]
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=[1000, 5000, 10000, 20000, 50000]
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    logger = logging.getLogger("parse_benchmark")
+    pool = ParsePool(args.workers, min_lines=0)
+    # start the worker processes
+    parse_status(make_show_stat(100), logger, pool)
+
+    print("{} workers, {} cores".format(args.workers, os.cpu_count()))
+    print(
+        "{:>8} {:>11} {:>13} {:>8}".format(
+            "rows", "serial/ms", "parallel/ms", "speedup"
+        )
+    )
+    try:
+        for rows in args.rows:
+            data = make_show_stat(rows)
+            serial = timed(lambda: parse_status(data, logger), args.runs)
+            parallel = timed(lambda: parse_status(data, logger, pool), args.runs)
+            print(
+                "{:>8} {:>11.1f} {:>13.1f} {:>8.2f}".format(
+                    rows, serial * 1000, parallel * 1000, serial / parallel
+                )
+            )
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Measure the cost of a poll (parse, register and evaluate) at log level INFO and DEBUG.
+
+A synthetic fleet (see haproxy_status.simulate) is polled on a virtual clock, with the
+log output going to /dev/null through a regular formatter, so that the time spent
+formatting log messages is included.
+
+Usage:
+
+    PYTHONPATH=src python benchmarks/poll_logging.py [--polls N] [--backends N]
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+from unittest.mock import patch
+
+from haproxy_status import status
+from haproxy_status.app import MyState
+from haproxy_status.simulate import FakeClock, Fleet, make_config
+
+
+def run(level, args):
+    logger = logging.getLogger("poll_logging_{}".format(logging.getLevelName(level)))
+    logger.propagate = False
+    logger.setLevel(level)
+    devnull = open(os.devnull, "w")
+    handler = logging.StreamHandler(devnull)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(handler)
+
+    clock = FakeClock()
+    fleet = Fleet(clock(), args.backends, args.servers, args.flappy, seed=1)
+    mystate = MyState(make_config({}), logger, clock=clock)
+    times = []
+    try:
+        for _ in range(args.polls):
+            clock.advance(args.interval)
+            data = fleet.show_stat(clock())
+            with patch.object(status, "haproxy_execute", return_value=data):
+                t0 = time.perf_counter()
+                sites = status.get_status("/dev/null", logger)
+                assert sites is not None
+                mystate.register_hap_status(sites)
+                mystate.get_status()
+                times.append(time.perf_counter() - t0)
+    finally:
+        logger.removeHandler(handler)
+        devnull.close()
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--polls", type=int, default=500)
+    parser.add_argument("--backends", type=int, default=50)
+    parser.add_argument("--servers", type=int, default=4, help="servers per backend")
+    parser.add_argument("--flappy", type=float, default=0.1)
+    parser.add_argument("--interval", type=float, default=10)
+    args = parser.parse_args()
+
+    print("{:<6} {:>9} {:>9} {:>9}".format("level", "median", "min", "max"))
+    for level in (logging.INFO, logging.DEBUG):
+        values = [t * 1000 for t in run(level, args)]
+        print(
+            "{:<6} {:>7.3f}ms {:>7.3f}ms {:>7.3f}ms".format(
+                logging.getLevelName(level),
+                statistics.median(values),
+                min(values),
+                max(values),
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Measure the time from interpreter start to the first /status response.
+
+Every run starts a new Python interpreter that imports the app, calls init_app and
+requests /status (against a haproxy socket that does not exist, so that the time is
+spent in haproxy-status and not in haproxy).
+
+Usage:
+
+    PYTHONPATH=src python benchmarks/startup.py [--runs N] [--budget-ms MS]
+
+With --budget-ms, exit with status 1 if the median time to the first response is over
+budget, to guard against startup time regressions.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+from haproxy_status.app import init_app
+t1 = time.perf_counter()
+app = init_app("startup_benchmark")
+t2 = time.perf_counter()
+response = app.test_client().get("/status")
+t3 = time.perf_counter()
+assert response.status_code == 200, response
+heavy = [m for m in ("yaml", "requests") if m in sys.modules]
+print(json.dumps({"import": t1 - t0, "init_app": t2 - t1, "first_status": t3 - t2, "heavy": heavy}))
+"""
+
+
+def run_once(env):
+    t0 = time.perf_counter()
+    out = subprocess.check_output(
+        [sys.executable, "-c", CHILD], env=env, stderr=subprocess.DEVNULL
+    )
+    total = time.perf_counter() - t0
+    res = json.loads(out.decode().strip().splitlines()[-1])
+    res["total"] = total
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = dict(os.environ)
+        env.update(
+            {
+                "STATS_URL": os.path.join(tmpdir, "no-haproxy-here"),
+                "STATUS_OUTPUT_FILENAME": os.path.join(tmpdir, "status.txt"),
+                "SIGNAL_DIRECTORY": tmpdir,
+                "BACKGROUND_REFRESH": "false",
+                "LOG_LEVEL": "ERROR",
+            }
+        )
+        # warm up the bytecode cache
+        run_once(env)
+        results = [run_once(env) for _ in range(args.runs)]
+
+    print("{:<14} {:>9} {:>9} {:>9}".format("phase", "median", "min", "max"))
+    for phase in ("import", "init_app", "first_status", "total"):
+        values = [r[phase] * 1000 for r in results]
+        print(
+            "{:<14} {:>7.1f}ms {:>7.1f}ms {:>7.1f}ms".format(
+                phase, statistics.median(values), min(values), max(values)
+            )
+        )
+    heavy = sorted(set(m for r in results for m in r["heavy"]))
+    if heavy:
+        print(
+            "Modules that should have been imported lazily: {}".format(", ".join(heavy))
+        )
+
+    median_total = statistics.median(r["total"] * 1000 for r in results)
+    if args.budget_ms is not None and median_total > args.budget_ms:
+        print(
+            "Startup time {:.1f}ms is over budget ({:.1f}ms)".format(
+                median_total, args.budget_ms
+            )
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
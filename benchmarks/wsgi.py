@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Measure requests per second (on one core) for /ping and /status, with and without the
+FAST_PATH WSGI middleware in front of Flask.
+
+The WSGI app is called directly in a loop, without any HTTP server, so that only the
+time spent in haproxy-status is measured. MyState is loaded with a synthetic fleet (see
+haproxy_status.simulate) and never fetches from haproxy during the measurement.
+
+Usage:
+
+    PYTHONPATH=src python benchmarks/wsgi.py [--seconds S] [--backends N]
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+
+from werkzeug.test import EnvironBuilder
+
+from haproxy_status.app import init_app
+from haproxy_status.simulate import Fleet
+
+
+def make_app(fast_path, args, tmpdir):
+    app = init_app(
+        "wsgi_benchmark",
+        {
+            "FAST_PATH": fast_path,
+            "BACKGROUND_REFRESH": False,
+            "STATUS_OUTPUT_FILENAME": None,
+            "SIGNAL_DIRECTORY": tmpdir,
+            "LOG_LEVEL": "WARNING",
+        },
+    )
+    fleet = Fleet(time.time(), args.backends, args.servers, flappy=0, seed=1)
+    app.mystate.register_hap_status(fleet.poll(time.time()))
+    # don't fetch from haproxy during the measurement
+    app.mystate._next_fetch_hap_status = time.time() + 3600
+    return app
+
+
+def measure(app, path, seconds):
+    environ = EnvironBuilder(path=path, method="GET").get_environ()
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    count = 0
+    deadline = time.perf_counter() + seconds
+    t0 = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            body = app(dict(environ), start_response)
+            for _chunk in body:
+                pass
+            if hasattr(body, "close"):
+                body.close()
+        count += 100
+    return count / (time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--seconds", type=float, default=2)
+    parser.add_argument("--backends", type=int, default=20)
+    parser.add_argument("--servers", type=int, default=4, help="servers per backend")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        apps = {
+            "flask": make_app(False, args, tmpdir),
+            "fast_path": make_app(True, args, tmpdir),
+        }
+        print(
+            "{:<8} {:>12} {:>12} {:>8}".format("path", "flask", "fast_path", "speedup")
+        )
+        for path in ("/ping", "/status"):
+            rps = {name: measure(app, path, args.seconds) for name, app in apps.items()}
+            print(
+                "{:<8} {:>10.0f}/s {:>10.0f}/s {:>7.1f}x".format(
+                    path,
+                    rps["flask"],
+                    rps["fast_path"],
+                    rps["fast_path"] / rps["flask"],
+                )
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
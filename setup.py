@@ -54,5 +54,9 @@ setup(
         "testing": test_requires,
     },
     test_suite="haproxy_status",
-    entry_points={},
+    entry_points={
+        "console_scripts": [
+            "haproxy-status-check = haproxy_status.cli:main",
+        ],
+    },
 )
@@ -3,6 +3,19 @@ __organization__ = "SUNET"
 __license__ = "BSD"
 __authors__ = ["Fredrik Thulin"]
 
-from haproxy_status import app, status
+import importlib
+
+# Avoid importing typing here, see haproxy_status.cli
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from haproxy_status import app, status
 
 __all__ = ["app", "status"]
+
+
+def __getattr__(name: str) -> object:
+    # Import submodules on first access, so that e.g. the command line health check
+    # (haproxy_status.cli) does not have to pay for importing Flask.
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+A responder for haproxy's agent-check protocol.
+
+haproxy connects, reads one line such as "up", "down 50%" or "maint", and the
+connection is closed. This makes a health check cost a few bytes on a socket instead of
+a full HTTP request. Use it with e.g.
+
+    server web1 10.0.0.1:443 check agent-check agent-port 8081 agent-inter 2s
+
+The reply is based on the last status evaluated by MyState (get_status(), including
+ADMIN_DOWN), and is only recomputed when that, or the haproxy state, has changed.
+Answering a check never triggers a fetch from haproxy, so this relies on something
+else (normally the background refresh) to keep the status up to date.
+"""
+
+import logging
+import selectors
+import socket
+import threading
+from typing import TYPE_CHECKING, Optional
+
+from haproxy_status.rules import IGNORED
+
+if TYPE_CHECKING:
+    from haproxy_status.app import MyState
+
+# MyState status -> agent-check reply
+AGENT_REPLIES = {
+    "STATUS_UP": "up",
+    "STATUS_DOWN": "down",
+    "STATUS_ADMIN_DOWN": "maint",
+    # no usable data from haproxy, don't send new traffic here but keep what is here
+    "STATUS_UNKNOWN": "drain",
+}
+
+
+def agent_reply(status: str, weight: Optional[int] = None) -> bytes:
+    """
+    Build an agent-check reply.
+
+    :param status: A MyState status (STATUS_UP etc.)
+    :param weight: Optional weight in percent to include in the reply
+    """
+    reply = AGENT_REPLIES.get(status, "down")
+    if weight is not None:
+        reply = "{} {}%".format(reply, weight)
+    return (reply + "\n").encode("ascii")
+
+
+class AgentResponder(object):
+    """
+    Serve agent-check replies from a single background thread.
+
+    The listening socket has SO_REUSEPORT set (where available), so that every worker
+    process can bind the same port and the kernel spreads the checks between them.
+
+    :param weight: Include a weight in the replies, the percentage of the backends
+                   that are UP
+    """
+
+    def __init__(
+        self,
+        mystate: "MyState",
+        host: str,
+        port: int,
+        logger: logging.Logger,
+        weight: bool = False,
+    ):
+        self.mystate = mystate
+        self.host = host
+        self.port = port
+        self.logger = logger
+        self.weight = weight
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._sock: Optional[socket.socket] = None
+        self._cache_key: Optional[tuple] = None
+        self._cached_reply = b""
+
+    def start(self) -> None:
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(128)
+        sock.setblocking(False)
+        # in case port 0 was requested
+        self.port = sock.getsockname()[1]
+        self._sock = sock
+        self._thread = threading.Thread(
+            target=self._run, name="agent-responder", daemon=True
+        )
+        self._thread.start()
+        self.logger.info(
+            "Answering haproxy agent checks on %s:%d", self.host, self.port
+        )
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def reply(self) -> bytes:
+        """The reply to an agent check, recomputed only when the state has changed."""
+        status = self.mystate._last_status
+        snapshot = self.mystate._snapshot
+        # compare by identity, MyState publishes a new snapshot on every change
+        key = (status, snapshot if self.weight else None)
+        if self._cache_key is None or not all(
+            this is cached for this, cached in zip(key, self._cache_key)
+        ):
+            weight = None
+            if self.weight:
+                rules = self.mystate.rules
+                # the same backends as the aggregate status is based on
+                backends = [
+                    x["BACKEND"].get("status")
+                    for name, x in snapshot.servers.items()
+                    if "BACKEND" in x and rules.classify(name) != IGNORED
+                ]
+                up = sum(1 for x in backends if x == "UP")
+                weight = 100 * up // len(backends) if backends else 0
+            self._cached_reply = agent_reply(status, weight)
+            self._cache_key = key
+        return self._cached_reply
+
+    def _run(self) -> None:
+        assert self._sock is not None
+        with selectors.DefaultSelector() as sel:
+            sel.register(self._sock, selectors.EVENT_READ)
+            try:
+                while not self._stop.is_set():
+                    if sel.select(timeout=0.5):
+                        self._accept()
+            finally:
+                self._sock.close()
+
+    def _accept(self) -> None:
+        assert self._sock is not None
+        # answer everything that is waiting in the backlog
+        while True:
+            try:
+                conn, _addr = self._sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as exc:
+                self.logger.warning("Failed accepting agent check connection: %s", exc)
+                return
+            self.mystate.counters.incr("agent_checks")
+            try:
+                conn.setblocking(False)
+                # haproxy might send a line (agent-send), read it so that closing the
+                # connection doesn't reset it before haproxy has read the reply
+                try:
+                    conn.recv(1024)
+                except (BlockingIOError, InterruptedError):
+                    pass
+                # a reply this small always fits in an empty socket buffer
+                conn.send(self.reply())
+            except OSError as exc:
+                self.logger.debug("Failed answering agent check: %s", exc)
+            finally:
+                conn.close()
@@ -1,115 +1,581 @@
 # -*- coding: utf-8 -*-
+import json
 import logging
 import os
 import random
+import threading
 import time
 import warnings
-from typing import Any, Dict, List, Mapping, Optional
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
 
-import yaml
 from flask import Flask, has_request_context, request
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+from haproxy_status.agent import AgentResponder
+from haproxy_status.background import StatusFileWriter, StatusRefresher
+from haproxy_status.capture import CaptureWriter
 from haproxy_status.config import Settings
-from haproxy_status.status import Site, SiteInfo
-from haproxy_status.util import time_to_str
+from haproxy_status.events import EventExporter
+from haproxy_status.fastpath import FastPath
+from haproxy_status.history import (
+    HISTORY_LIMIT,
+    STATUS_NAMES,
+    History,
+    ServerHistory,
+    downsample,
+)
+from haproxy_status.rules import IGNORED, OPTIONAL, BackendRules
+from haproxy_status.status import (
+    CircuitBreaker,
+    HAProxyStatusError,
+    HAProxyTimeouts,
+    ParsePool,
+    Site,
+    SiteInfo,
+    get_status,
+)
+from haproxy_status.traffic import TrafficTracker
+from haproxy_status.util import (
+    AdmissionControl,
+    Counters,
+    SignalDirectory,
+    atomic_write,
+    time_to_str,
+)
 
 __author__ = "ft"
 
+# Per-server state, keyed on site name and then server name (or BACKEND)
+ServerStates = Dict[str, Dict[str, Dict[str, Any]]]
+
+# Version of the state snapshot file format
+SNAPSHOT_FILE_VERSION = 1
+
+
+@dataclass(frozen=True)
+class StateSnapshot(object):
+    """
+    The state built from one poll of haproxy.
+
+    A snapshot is never modified once it has been published in MyState. Instead, every
+    poll builds a new snapshot that replaces the previous one with a single (atomic)
+    assignment, so that readers in other threads never see a half-updated state.
+    """
+
+    update_time: Optional[int] = None
+    fetch_failed_since: Optional[int] = None
+    servers: ServerStates = field(default_factory=dict)
+    # the sites parsed from the 'show stat' response of this poll
+    sites: Tuple[Site, ...] = ()
+    # backends with too many failed or queued requests, and why (pxname -> reason)
+    degraded: Dict[str, str] = field(default_factory=dict)
+
+
+def _encode_snapshot(snapshot: StateSnapshot) -> str:
+    """The contents of a state snapshot file, see MyState.save_snapshot()."""
+    data = {
+        "version": SNAPSHOT_FILE_VERSION,
+        "update_time": snapshot.update_time,
+        "fetch_failed_since": snapshot.fetch_failed_since,
+        "servers": snapshot.servers,
+    }
+    return json.dumps(data, separators=(",", ":"))
+
+
+def _valid_snapshot(data: Any) -> bool:
+    """Check the structure of a state snapshot loaded from a file."""
+
+    def timestamp(value: Any) -> bool:
+        return value is None or (
+            isinstance(value, (int, float)) and not isinstance(value, bool)
+        )
+
+    if not isinstance(data, dict) or data.get("version") != SNAPSHOT_FILE_VERSION:
+        return False
+    if not all(k in data for k in ("update_time", "fetch_failed_since", "servers")):
+        return False
+    if not (timestamp(data["update_time"]) and timestamp(data["fetch_failed_since"])):
+        return False
+    servers = data["servers"]
+    return isinstance(servers, dict) and all(
+        isinstance(site, dict) and all(isinstance(x, dict) for x in site.values())
+        for site in servers.values()
+    )
+
 
 class MyState(object):
-    def __init__(self, config: Mapping[str, Any], logger: logging.Logger):
+    def __init__(
+        self,
+        config: Mapping[str, Any],
+        logger: logging.Logger,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        :param clock: Source of the current (wall clock) time. The time is read once per
+                      poll or request, and passed on to everything that needs it.
+        """
         self.config = config
         self.logger = logger
-        self._update_time: Optional[int] = None
-        self._hap_status: Dict[str, Dict[str, Any]] = {}
-        self._next_fetch_hap_status = 0
+        self.clock = clock
+        self._snapshot = StateSnapshot()
+        self._next_fetch_hap_status = 0.0
+        # the current (adaptive) interval between fetches from haproxy
+        self.poll_interval = float(config["FETCH_HAPROXY_STATUS_INTERVAL"])
+        self._fetch_in_flight: Optional[threading.Event] = None
         self._last_status = ""
+        # serialises the writers of new snapshots
+        self._write_lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._status_lock = threading.Lock()
+        self.counters = Counters()
+        self.recorder: Optional[CaptureWriter] = None
+        if config["CAPTURE_FILENAME"]:
+            self.recorder = CaptureWriter(
+                config["CAPTURE_FILENAME"], logger, config["CAPTURE_MAX_SIZE"]
+            )
+        self.history = History(
+            config["HISTORY_SIZE"], config["HISTORY_TRANSITIONS_SIZE"]
+        )
+        self.status_writer: Optional[StatusFileWriter] = None
+        if config["STATUS_OUTPUT_FILENAME"]:
+            self.status_writer = StatusFileWriter(
+                config["STATUS_OUTPUT_FILENAME"],
+                logger,
+                debounce=config["STATUS_OUTPUT_DEBOUNCE"],
+            )
+        self.snapshot_writer: Optional[StatusFileWriter] = None
+        if config["STATE_SNAPSHOT_FILENAME"]:
+            # serialized and written by the writer thread, not by whoever polled
+            self.snapshot_writer = StatusFileWriter(
+                config["STATE_SNAPSHOT_FILENAME"],
+                logger,
+                debounce=config["STATUS_OUTPUT_DEBOUNCE"],
+                render=_encode_snapshot,
+            )
+        self.events: Optional[EventExporter] = None
+        if config["EVENTS_TARGET"]:
+            self.events = EventExporter(
+                config["EVENTS_TARGET"],
+                logger,
+                self.counters,
+                queue_size=config["EVENTS_QUEUE_SIZE"],
+            )
+        self.rules = BackendRules(
+            include=config["BACKEND_INCLUDE"],
+            exclude=config["BACKEND_EXCLUDE"],
+            optional=config["BACKEND_OPTIONAL"],
+        )
+        # backend rules for every service in SERVICES, all evaluated from the same poll
+        self.service_rules = {
+            name: BackendRules(
+                include=rules.get("include"),
+                exclude=rules.get("exclude"),
+                optional=rules.get("optional"),
+            )
+            for name, rules in config["SERVICES"].items()
+        }
+        self.signals = SignalDirectory(config["SIGNAL_DIRECTORY"])
+        self._timeouts = HAProxyTimeouts(
+            connect=config["HAPROXY_CONNECT_TIMEOUT"], total=config["HAPROXY_TIMEOUT"]
+        )
+        self.traffic: Optional[TrafficTracker] = None
+        if (
+            config["DEGRADED_ERROR_RATE"] is not None
+            or config["DEGRADED_QUEUE"] is not None
+        ):
+            self.traffic = TrafficTracker(
+                error_rate=config["DEGRADED_ERROR_RATE"],
+                queue=config["DEGRADED_QUEUE"],
+                min_requests=config["DEGRADED_MIN_REQUESTS"],
+            )
+        self._parse_pool: Optional[ParsePool] = None
+        if config["PARSE_WORKERS"]:
+            self._parse_pool = ParsePool(
+                config["PARSE_WORKERS"], config["PARSE_PARALLEL_MIN_LINES"]
+            )
+        self._breaker = CircuitBreaker(
+            threshold=config["HAPROXY_FAILURE_THRESHOLD"],
+            backoff=config["HAPROXY_BACKOFF"],
+            backoff_max=config["HAPROXY_BACKOFF_MAX"],
+        )
 
-    def register_hap_status(self, hap_status: List[Site]):
-        self._update_time = int(time.time())
+    @property
+    def _hap_status(self) -> ServerStates:
+        return self._snapshot.servers
+
+    @property
+    def _update_time(self) -> Optional[int]:
+        return self._snapshot.update_time
+
+    @_update_time.setter
+    def _update_time(self, value: Optional[int]) -> None:
+        with self._write_lock:
+            self._snapshot = replace(self._snapshot, update_time=value)
+
+    def register_hap_status(self, hap_status: List[Site], now: Optional[float] = None):
+        if now is None:
+            now = self.clock()
+        with self._write_lock:
+            ts = int(now)
+            servers = self._copy_servers()
+
+            for this in hap_status:
+                for be in this.servers:
+                    self._register_server_state(this.name, be, servers, ts)
+                    self.history.record(this.name, be.svname, ts, be.status)
+                for be in this.backend:
+                    self._register_server_state(this.name, be, servers, ts)
+                    self.history.record(this.name, be.svname, ts, be.status)
+            self._forget_removed(servers, ts)
+            degraded = self._register_traffic(hap_status)
+
+            self._snapshot = StateSnapshot(
+                update_time=ts,
+                servers=servers,
+                sites=tuple(hap_status),
+                degraded=degraded,
+            )
+            if degraded:
+                self.poll_interval = self.config["FETCH_HAPROXY_STATUS_INTERVAL_MIN"]
+            else:
+                self.poll_interval = self._next_poll_interval(servers, ts)
+            with self._fetch_lock:
+                # the deadline was set using the previous interval when this fetch started
+                self._next_fetch_hap_status = now + self.poll_interval + random.random()
 
-        for this in hap_status:
-            for be in this.servers:
-                self._register_server_state(this.name, be)
-            for be in this.backend:
-                self._register_server_state(this.name, be)
+        self.logger.debug("State: %r", servers)
 
-        self.logger.debug("State: {!r}".format(self._hap_status))
+        if self.snapshot_writer:
+            self.snapshot_writer.submit(self._snapshot)
 
-    def is_admin_down(self) -> bool:
+    def _register_traffic(self, hap_status: List[Site]) -> Dict[str, str]:
         """
-        Check for a file signalling that we should set the status to ADMIN_DOWN.
+        Update the traffic counters, and find the backends that are degraded.
+
+        Call with _write_lock held.
 
-        Built in a way to support further enhancements such as automatic expiry
-        etc.
+        :return: Why backends are degraded, keyed on pxname
         """
+        if self.traffic is None:
+            return {}
+        degraded = self.traffic.degraded(self.traffic.update(hap_status))
+        previous = self._snapshot.degraded
+        for name in degraded.keys() - previous.keys():
+            self.logger.warning("Backend %s is DEGRADED: %s", name, degraded[name])
+        for name in previous.keys() - degraded.keys():
+            self.logger.info("Backend %s is no longer degraded", name)
+        return degraded
+
+    def _forget_removed(self, servers: ServerStates, now: int) -> None:
+        """
+        Forget servers that haproxy hasn't reported for FORGET_REMOVED_AFTER seconds.
 
-        def load_control_file(fn: str) -> Optional[Dict]:
-            path = os.path.join(self.config["SIGNAL_DIRECTORY"], fn)
-            try:
-                with open(path, "r") as fd:
-                    try:
-                        res = yaml.safe_load(fd)
-                        if res is None:
-                            return {}
-                        return res
-                    except yaml.YAMLError:
-                        # file exists, so err on the safe side and say ADMIN DOWN
-                        return {}
-            except FileNotFoundError:
-                return None
-
-        if self.config["SERVICE_NAME"]:
-            data = load_control_file(self.config["SERVICE_NAME"])
-            if data is not None:
-                return True
-
-        data = load_control_file("common")
-        if data is not None:
+        Backends come and go as the haproxy config changes, and without this the state,
+        history and rules caches of a long running instance would grow without bound.
+        Call with _write_lock held.
+        """
+        cutoff = now - self.config["FORGET_REMOVED_AFTER"]
+        for name in list(servers):
+            data = servers[name]
+            for srv_name in list(data):
+                # servers loaded from an older state snapshot file have no last_seen
+                if data[srv_name].setdefault("last_seen", now) < cutoff:
+                    del data[srv_name]
+                    self.history.forget(name, srv_name)
+            if not data:
+                del servers[name]
+                self.rules.forget(name)
+                for rules in self.service_rules.values():
+                    rules.forget(name)
+                self.logger.info(
+                    "Forgot site %s, not reported by haproxy for %s",
+                    name,
+                    time_to_str(now - cutoff),
+                )
+
+    def state_sizes(self) -> Dict[str, int]:
+        """The number of entries in the structures that grow with the haproxy config."""
+        snapshot = self._snapshot
+        with self._write_lock:
+            history = len(self.history)
+        return {
+            "sites": len(snapshot.servers),
+            "servers": sum(len(x) for x in snapshot.servers.values()),
+            "transitions": sum(
+                len(srv.get("transitions", ()))
+                for data in snapshot.servers.values()
+                for srv in data.values()
+            ),
+            "history_servers": history,
+            "rules_cache": self.rules.cache_size
+            + sum(x.cache_size for x in self.service_rules.values()),
+        }
+
+    def get_history(
+        self,
+        name: Optional[str] = None,
+        srv_name: Optional[str] = None,
+        since: Optional[int] = None,
+        step: Optional[int] = None,
+        offset: int = 0,
+        limit: int = HISTORY_LIMIT,
+    ) -> Tuple[Dict[str, Dict[str, Dict[str, List[Tuple[int, str]]]]], int]:
+        """
+        Get the recorded status history.
+
+        :param name: Only include this site
+        :param srv_name: Only include this server (or BACKEND)
+        :param since: Only include samples from the last `since' seconds
+        :param step: Downsample the samples into buckets of this many seconds
+        :param offset: Number of matching servers to skip
+        :param limit: Maximum number of servers to return
+
+        :return: The history of the servers, and the total number of matching servers
+        """
+        cutoff = int(self.clock()) - since if since else 0
+        selected: List[Tuple[str, str, ServerHistory]] = []
+        total = 0
+        # the history is modified by the writer, so hold the write lock while copying
+        # the ring buffers of the requested page, and build the response without it
+        with self._write_lock:
+            for this, srv_names in self.history.sites().items():
+                if name is not None and this != name:
+                    continue
+                for srv in srv_names:
+                    if srv_name is not None and srv != srv_name:
+                        continue
+                    total += 1
+                    if offset < total <= offset + limit:
+                        hist = self.history.get(this, srv)
+                        if hist is not None:
+                            selected += [(this, srv, hist.copy())]
+
+        res: Dict[str, Dict[str, Dict[str, List[Tuple[int, str]]]]] = {}
+        for this, srv, hist in selected:
+            samples = list(hist.samples.since(cutoff))
+            if step:
+                samples = downsample(iter(samples), step)
+            res.setdefault(this, {})[srv] = {
+                "samples": [(ts, STATUS_NAMES[code]) for ts, code in samples],
+                "transitions": [
+                    (ts, STATUS_NAMES[code])
+                    for ts, code in hist.transitions.since(cutoff)
+                ],
+            }
+        return res, total
+
+    def save_snapshot(self, filename: str) -> None:
+        """
+        Checkpoint the current state to a file, to be loaded by load_snapshot() at startup.
+        """
+        try:
+            atomic_write(filename, _encode_snapshot(self._snapshot).encode("utf-8"))
+        except OSError as exc:
+            self.logger.warning("Failed saving state snapshot to %s: %s", filename, exc)
+
+    def load_snapshot(self, filename: str) -> bool:
+        """
+        Load state previously saved with save_snapshot().
+
+        :return: True if a snapshot was loaded
+        """
+        try:
+            with open(filename, "rb") as fd:
+                data = json.load(fd)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as exc:
+            self.logger.warning(
+                "Failed loading state snapshot from %s: %s", filename, exc
+            )
+            return False
+        if not _valid_snapshot(data):
+            self.logger.warning(
+                "Ignoring state snapshot %s with unknown format", filename
+            )
+            return False
+
+        with self._write_lock:
+            self._snapshot = StateSnapshot(
+                update_time=data["update_time"],
+                fetch_failed_since=data["fetch_failed_since"],
+                servers=data["servers"],
+            )
+            # _last_status is deliberately not restored, so that the first status
+            # after a restart is exported (the status file may be gone) like any other
+        self.logger.info(
+            "Loaded state snapshot from %s (%d sites)", filename, len(data["servers"])
+        )
+        return True
+
+    def _next_poll_interval(self, servers: ServerStates, now: int) -> float:
+        """
+        Poll quickly while anything is unstable, and back off while everything is stable.
+        """
+        _min = self.config["FETCH_HAPROXY_STATUS_INTERVAL_MIN"]
+        _max = self.config["FETCH_HAPROXY_STATUS_INTERVAL_MAX"]
+        all_rules = [self.rules] + list(self.service_rules.values())
+        for name, data in servers.items():
+            # backends that don't count for any status can be as unstable as they like
+            if all(x.classify(name) == IGNORED for x in all_rules):
+                continue
+            for srv_name, srv_data in data.items():
+                status = srv_data.get("status", "")
+                if status.startswith("DOWN") or (
+                    srv_name == "BACKEND" and status != "UP"
+                ):
+                    return _min
+                if (
+                    now - srv_data.get("change_ts", 0)
+                    < self.config["HEALTHY_BACKEND_UPTIME"]
+                ):
+                    return _min
+                if srv_data.get("transitions"):
+                    # status changes within FLAPPING_WINDOW
+                    return _min
+        return max(_min, min(_max, self.poll_interval * 2))
+
+    def _copy_servers(self) -> ServerStates:
+        """
+        Copy the server states of the current snapshot, to be modified by a writer.
+        """
+        res: ServerStates = {}
+        for name, data in self._snapshot.servers.items():
+            res[name] = {}
+            for srv_name, srv_data in data.items():
+                res[name][srv_name] = dict(srv_data)
+                if "transitions" in srv_data:
+                    res[name][srv_name]["transitions"] = list(srv_data["transitions"])
+        return res
+
+    def register_hap_fetch_failure(self, now: Optional[float] = None) -> None:
+        """
+        Record that fetching status from haproxy failed.
+
+        The last registered state keeps being served (see get_status) until it is older
+        than MAX_STATUS_STALENESS, and the fetch is retried sooner than usual.
+        """
+        if now is None:
+            now = self.clock()
+        with self._write_lock:
+            if self._snapshot.fetch_failed_since is None:
+                self._snapshot = replace(self._snapshot, fetch_failed_since=int(now))
+                self.logger.warning(
+                    "Failed fetching status from haproxy, serving last known status"
+                )
+        with self._fetch_lock:
+            self._next_fetch_hap_status = (
+                now + self.config["FETCH_HAPROXY_STATUS_RETRY_INTERVAL"]
+            )
+            self.poll_interval = self.config["FETCH_HAPROXY_STATUS_INTERVAL_MIN"]
+
+    def is_admin_down(self, service: Optional[str] = None) -> bool:
+        """
+        Check for a file signalling that we should set the status to ADMIN_DOWN.
+
+        The file is either named after the service, or "common" for all services.
+        The directory is scanned once and the file names cached until it changes,
+        so this doesn't cost any open() calls.
+
+        :param service: The service to check, default SERVICE_NAME
+        """
+        if service is None:
+            service = self.config["SERVICE_NAME"]
+        if service and self.signals.exists(service):
             return True
+        return self.signals.exists("common")
 
-        return False
+    def get_status(self, now: Optional[float] = None) -> Dict[str, Any]:
+        return self._export_status(self._evaluate(self.rules, now))
 
-    def get_status(self):
+    def get_service_status(
+        self, service: str, now: Optional[float] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Get the status of one of the SERVICES, based on its own set of backends.
+
+        :return: None if there is no such service
+        """
+        rules = self.service_rules.get(service)
+        if rules is None:
+            return None
+        res = self._evaluate(rules, now)
+        if self.is_admin_down(service):
+            res["status"] = "STATUS_ADMIN_DOWN"
+        return res
+
+    def _evaluate(self, rules: BackendRules, now: Optional[float]) -> Dict[str, Any]:
+        """Evaluate the aggregate status of the backends selected by rules."""
+        if now is None:
+            now = self.clock()
+        # Only look at the snapshot once, a new one might be published while we work
+        snapshot = self._snapshot
         age: float = 0
-        if self._update_time is not None:
-            age = time.time() - self._update_time
-        res = {
+        if snapshot.update_time is not None:
+            age = now - snapshot.update_time
+        res: Dict[str, Any] = {
             "status": "STATUS_UNKNOWN",
             "reason": "No backend data received from haproxy",
-            "ttl": int(self.config["FETCH_HAPROXY_STATUS_INTERVAL"] - age),
+            "ttl": int(self.poll_interval - age),
         }
+        if snapshot.fetch_failed_since is not None and snapshot.update_time is not None:
+            # Stale-while-revalidate, let the client know how old the data is and for
+            # how much longer it will be served. Without any data there is nothing
+            # to serve, and the normal ttl says when to ask again.
+            res["ttl"] = max(0, self.config["MAX_STATUS_STALENESS"] - int(age))
+            res["stale"] = int(age)
+        if (
+            snapshot.update_time is not None
+            and age > self.config["MAX_STATUS_STALENESS"]
+        ):
+            res["reason"] = "Status from haproxy is stale ({} old)".format(
+                time_to_str(age)
+            )
+            return res
+
         count = 0
-        down_count = 0
-        msg = []
-        for this, data in self._hap_status.items():
+        msg: List[str] = []
+        optional_msg: List[str] = []
+        ts = int(now)
+        for this, data in snapshot.servers.items():
             if "BACKEND" not in data:
                 continue
+            kind = rules.classify(this)
+            if kind == IGNORED:
+                continue
             count += 1
+            # problems with optional backends are reported, but don't make us DOWN
+            problems = optional_msg if kind == OPTIONAL else msg
 
             # Check if any server in this backend is flapping
             flapping_servers = [
                 srv_name
                 for srv_name, srv_data in data.items()
-                if srv_name != "BACKEND" and self._is_server_flapping(this, srv_name)
+                if srv_name != "BACKEND" and self._is_flapping(srv_data, ts)
             ]
             if flapping_servers:
-                down_count += 1
-                msg += ["{} is FLAPPING ({})".format(this, ", ".join(flapping_servers))]
+                problems += [
+                    "{} is FLAPPING ({})".format(this, ", ".join(flapping_servers))
+                ]
                 continue
 
             be = data["BACKEND"]
             status = be["status"]
+            if status == "UP" and this in snapshot.degraded:
+                problems += [
+                    "{} is DEGRADED ({})".format(this, snapshot.degraded[this])
+                ]
+                continue
             if status == "UP":
-                uptime = int(time.time()) - be["change_ts"]
+                uptime = ts - be["change_ts"]
                 if uptime >= self.config["HEALTHY_BACKEND_UPTIME"]:
                     continue
                 status = "(RE)STARTING"
-            down_count += 1
-            downtime = time_to_str(int(time.time()) - be["change_ts"])
-            msg += ["{} is {} ({})".format(this, status, downtime)]
+            downtime = time_to_str(ts - be["change_ts"])
+            problems += ["{} is {} ({})".format(this, status, downtime)]
 
+        down_count = len(msg)
         plural = "" if count == 1 else "s"
         if down_count:
             res["status"] = "STATUS_DOWN"
@@ -117,35 +583,119 @@ class MyState(object):
                 down_count, count, plural, ", ".join(msg)
             )
         elif count:
+            up_count = count - len(optional_msg)
             res["status"] = "STATUS_UP"
-            res["reason"] = "{} backend{} UP".format(count, plural)
+            res["reason"] = "{} backend{} UP".format(
+                up_count, "" if up_count == 1 else "s"
+            )
+        if optional_msg:
+            res["reason"] += ", optional backends not UP: {}".format(
+                ", ".join(optional_msg)
+            )
+
+        return res
 
+    def _export_status(self, res: Dict[str, Any]) -> Dict[str, Any]:
         if self.is_admin_down():
             res["status"] = "STATUS_ADMIN_DOWN"
 
         if res["status"] != self._last_status:
-            self._last_status = str(res["status"])
-            self.logger.info(
-                "Status changed to {} {}".format(res["status"], res["reason"])
-            )
-            if self.config["STATUS_OUTPUT_FILENAME"]:
-                # export to docker health check
-                with open(self.config["STATUS_OUTPUT_FILENAME"], "w") as fd:
-                    fd.write("{} {}\n".format(res["status"], res["reason"]))
+            with self._status_lock:
+                # check again, another thread might have beaten us to it
+                if res["status"] != self._last_status:
+                    if self.events is not None:
+                        self.events.emit(
+                            "status_changed",
+                            self.clock(),
+                            old=self._last_status or None,
+                            new=res["status"],
+                            reason=res["reason"],
+                        )
+                    self._last_status = str(res["status"])
+                    self.logger.info(
+                        "Status changed to %s %s", res["status"], res["reason"]
+                    )
+                    if self.status_writer:
+                        # export to docker health check
+                        self.status_writer.submit(
+                            "{} {}\n".format(res["status"], res["reason"])
+                        )
 
         return res
 
     def should_fetch_hap_status(self) -> bool:
-        if time.time() >= self._next_fetch_hap_status:
+        with self._fetch_lock:
+            return self._fetch_due(self.clock())
+
+    def _fetch_due(self, now: float) -> bool:
+        """Check if it is time to fetch status from haproxy. Call with _fetch_lock held."""
+        if now >= self._next_fetch_hap_status:
             # move the next-fetch timestamp forward in time, and add a tiny bit of fuzzing
-            self._next_fetch_hap_status = (
-                time.time()
-                + self.config["FETCH_HAPROXY_STATUS_INTERVAL"]
-                + random.random()
-            )
+            self._next_fetch_hap_status = now + self.poll_interval + random.random()
             return True
         return False
 
+    def refresh_hap_status(self) -> None:
+        """
+        Fetch and register status from haproxy, if it is time to do so.
+
+        Concurrent callers are coalesced into a single fetch. The first caller fetches,
+        and the others are served the previous snapshot right away - or wait for the
+        fetch to finish if there is no previous snapshot to serve.
+        """
+        with self._fetch_lock:
+            flight = self._fetch_in_flight
+            leader = False
+            if flight is None and self._fetch_due(self.clock()):
+                flight = self._fetch_in_flight = threading.Event()
+                leader = True
+        if flight is None:
+            return
+
+        if not leader:
+            self.counters.incr("fetches_coalesced")
+            if self._snapshot.update_time is None:
+                flight.wait(self.config["HAPROXY_TIMEOUT"])
+            return
+
+        try:
+            if not self._breaker.allow():
+                # haproxy has been failing, leave it alone for a while
+                self.counters.incr("fetches_short_circuited")
+                self.register_hap_fetch_failure()
+                return
+
+            self.counters.incr("fetches")
+            try:
+                hap_status = get_status(
+                    self.config["STATS_URL"],
+                    self.logger,
+                    self._timeouts,
+                    self.recorder,
+                    self._parse_pool,
+                )
+            except HAProxyStatusError as exc:
+                self.logger.warning("%s", exc)
+                hap_status = None
+
+            if hap_status is None:
+                self.counters.incr("fetch_failures")
+                if self._breaker.record_failure():
+                    self.counters.incr("circuit_breaker_opened")
+                    self.logger.warning(
+                        "haproxy failed %d times in a row, backing off",
+                        self._breaker.failures,
+                    )
+                # keep serving the last known status while the fetch is retried
+                self.register_hap_fetch_failure()
+            else:
+                self._breaker.record_success()
+                self.register_hap_status(hap_status)
+        finally:
+            with self._fetch_lock:
+                self._fetch_in_flight = None
+            flight.set()
+
     def _is_server_flapping(self, name: str, srv_name: str) -> bool:
         """
         Check if a server is flapping based on recorded state transitions.
@@ -156,53 +706,77 @@ class MyState(object):
                  within FLAPPING_WINDOW seconds
         """
         srv_data = self._hap_status.get(name, {}).get(srv_name, {})
+        return self._is_flapping(srv_data, int(self.clock()))
+
+    def _is_flapping(self, srv_data: Mapping[str, Any], now: int) -> bool:
         transitions = srv_data.get("transitions", [])
         if not transitions:
             return False
         window = self.config["FLAPPING_WINDOW"]
         threshold = self.config["FLAPPING_THRESHOLD"]
-        cutoff = int(time.time()) - window
+        cutoff = now - window
         recent = [ts for ts in transitions if ts >= cutoff]
         return len(recent) >= threshold
 
-    def _register_server_state(self, name: str, server: SiteInfo) -> None:
+    def _register_server_state(
+        self,
+        name: str,
+        server: SiteInfo,
+        servers: ServerStates,
+        now: int,
+    ) -> None:
         """
         :param name: Site name
         :param server: Parsed site info
+        :param servers: Server states being built for a new snapshot, never the
+                        published one
+        :param now: Time of the poll
         """
         srv_name = server.svname
         srv_status = server.status
-        if name not in self._hap_status:
-            self._hap_status[name] = {}
-        if srv_name not in self._hap_status[name]:
-            self._hap_status[name][srv_name] = {}
-        srv_data = self._hap_status[name][srv_name]
+        if name not in servers:
+            servers[name] = {}
+        if srv_name not in servers[name]:
+            servers[name][srv_name] = {}
+        srv_data = servers[name][srv_name]
         old_status = srv_data.get("status")
 
         # Detect state transitions that happened between polls using HAProxy's
         # chkdown counter (cumulative UP->DOWN transitions) and lastchg
         # (seconds since last status change).
-        now = int(time.time())
         if srv_name != "BACKEND":
-            self._detect_flapping(name, srv_name, server, now)
+            self._detect_flapping(name, srv_name, server, now, srv_data)
 
         if old_status != srv_status:
+            if old_status is not None and self.events is not None:
+                self.events.emit(
+                    "server_status_changed",
+                    now,
+                    site=name,
+                    server=srv_name,
+                    old=old_status,
+                    new=srv_status,
+                    lastchg=int(server.lastchg or 0),
+                )
             if srv_name != "BACKEND":
                 if old_status is None:
                     self.logger.info(
-                        "Backend {} server {} initial status is {}".format(
-                            name, srv_name, srv_status
-                        )
+                        "Backend %s server %s initial status is %s",
+                        name,
+                        srv_name,
+                        srv_status,
                     )
                 else:
                     self.logger.info(
-                        "Backend {} server {} changed status to {}".format(
-                            name, srv_name, srv_status
-                        )
+                        "Backend %s server %s changed status to %s",
+                        name,
+                        srv_name,
+                        srv_status,
                     )
                 # Debug log all the info we got on server changes. We once saw haproxy end up with
                 # the wrong IP for a backend and had no way to know when or how it changed.
-                self.logger.debug("All server data: {}".format(server))
+                # ParsedLine.__str__ is expensive, and only called if this is emitted.
+                self.logger.debug("All server data: %s", server)
                 if srv_status == "DOWN":
                     srv_data["next_log_down"] = now + self.config["LOG_DOWN_INTERVAL"]
             srv_data["status"] = srv_status
@@ -213,13 +787,16 @@ class MyState(object):
                 and srv_status == "DOWN"
                 and now >= srv_data.get("next_log_down", 0)
             ):
-                downtime = time_to_str(int(time.time() - srv_data["change_ts"]))
-                self.logger.info(
-                    "Site {} server {} is still DOWN ({})".format(
-                        name, srv_name, downtime
+                srv_data["next_log_down"] = now + self.config["LOG_DOWN_INTERVAL"]
+                if self.logger.isEnabledFor(logging.INFO):
+                    self.logger.info(
+                        "Site %s server %s is still DOWN (%s)",
+                        name,
+                        srv_name,
+                        time_to_str(now - srv_data["change_ts"]),
                     )
-                )
 
+        srv_data["last_seen"] = now
         # Always update lastchg and chkdown for next poll comparison
         srv_data["lastchg"] = int(server.lastchg) if server.lastchg else 0
         try:
@@ -228,7 +805,12 @@ class MyState(object):
             pass
 
     def _detect_flapping(
-        self, name: str, srv_name: str, server: SiteInfo, now: int
+        self,
+        name: str,
+        srv_name: str,
+        server: SiteInfo,
+        now: int,
+        srv_data: Dict[str, Any],
     ) -> None:
         """
         Detect server flapping using two signals from HAProxy's CSV stats:
@@ -245,8 +827,6 @@ class MyState(object):
         Detected transitions are recorded with timestamps and pruned to
         stay within FLAPPING_WINDOW.
         """
-        srv_data = self._hap_status[name][srv_name]
-
         if "transitions" not in srv_data:
             srv_data["transitions"] = []
 
@@ -262,9 +842,12 @@ class MyState(object):
             delta = new_chkdown - old_chkdown
             transitions_detected = max(transitions_detected, delta)
             self.logger.warning(
-                "Backend {} server {} chkdown increased by {} ({}->{}), server may be flapping".format(
-                    name, srv_name, delta, old_chkdown, new_chkdown
-                )
+                "Backend %s server %s chkdown increased by %d (%d->%d), server may be flapping",
+                name,
+                srv_name,
+                delta,
+                old_chkdown,
+                new_chkdown,
             )
 
         # Signal 2: lastchg regression (got smaller since last poll)
@@ -276,9 +859,11 @@ class MyState(object):
             if transitions_detected == 0:
                 transitions_detected = 1
                 self.logger.warning(
-                    "Backend {} server {} lastchg regressed ({}->{}s), status change detected between polls".format(
-                        name, srv_name, old_lastchg, new_lastchg
-                    )
+                    "Backend %s server %s lastchg regressed (%d->%ds), status change detected between polls",
+                    name,
+                    srv_name,
+                    old_lastchg,
+                    new_lastchg,
                 )
 
         # Record detected transitions
@@ -290,12 +875,32 @@ class MyState(object):
         cutoff = now - window
         srv_data["transitions"] = [ts for ts in srv_data["transitions"] if ts >= cutoff]
 
-        if self._is_server_flapping(name, srv_name):
-            self.logger.warning(
-                "Backend {} server {} is FLAPPING ({} transitions in {}s window)".format(
-                    name, srv_name, len(srv_data["transitions"]), window
+        if self._is_flapping(srv_data, now):
+            if not srv_data.get("flapping"):
+                srv_data["flapping"] = True
+                if self.events is not None:
+                    self.events.emit(
+                        "server_flapping",
+                        now,
+                        site=name,
+                        server=srv_name,
+                        transitions=len(srv_data["transitions"]),
+                        window=window,
+                    )
+            # Logged when the server starts flapping, and then at most every
+            # LOG_DOWN_INTERVAL seconds for as long as it keeps flapping
+            if now >= srv_data.get("next_log_flapping", 0):
+                srv_data["next_log_flapping"] = now + self.config["LOG_DOWN_INTERVAL"]
+                self.logger.warning(
+                    "Backend %s server %s is FLAPPING (%d transitions in %ds window)",
+                    name,
+                    srv_name,
+                    len(srv_data["transitions"]),
+                    window,
                 )
-            )
+        else:
+            srv_data.pop("flapping", None)
+            srv_data.pop("next_log_flapping", None)
 
 
 # from http://stackoverflow.com/questions/27775026/provide-extra-information-to-flasks-app-logger
@@ -362,10 +967,39 @@ def init_app(name, config=None):
     app.logger.setLevel(app.config["LOG_LEVEL"])
 
     app.mystate = MyState(app.config, app.logger)  # type: ignore[attr-defined]
+    app.admission = AdmissionControl(app.config["MAX_CONCURRENT_REQUESTS"])  # type: ignore[attr-defined]
+    if app.config["FAST_PATH"]:
+        # outermost, so that the hot endpoints skip ProxyFix too
+        app.wsgi_app = FastPath(app, app.wsgi_app)  # type: ignore[method-assign]
+    if app.config["DEBUG_MEMORY"]:
+        # debug only, so don't make every startup pay for importing tracemalloc
+        from haproxy_status.memory import MemoryDiagnostics
+
+        app.memory = MemoryDiagnostics(  # type: ignore[attr-defined]
+            frames=app.config["DEBUG_MEMORY_FRAMES"],
+            types=(MyState, StateSnapshot, Site, ServerHistory),
+        )
+    if app.config["STATE_SNAPSHOT_FILENAME"]:
+        app.mystate.load_snapshot(app.config["STATE_SNAPSHOT_FILENAME"])  # type: ignore[attr-defined]
 
     # Get status to trigger writing the STATUS_OUTPUT_FILENAME file
-    # TODO: might need an internal mechanism to trigger status updating if nobody accesses the status endpoint
     _status = app.mystate.get_status()  # type: ignore[attr-defined]
 
-    app.logger.info(f"Application {name} initialised with initial status: {_status}")
+    if app.config["BACKGROUND_REFRESH"]:
+        # keep the status up to date even if nobody accesses the status endpoint
+        app.status_refresher = StatusRefresher(app.mystate)  # type: ignore[attr-defined]
+        app.status_refresher.start()  # type: ignore[attr-defined]
+
+    if app.config["AGENT_PORT"] is not None:
+        # answer haproxy agent checks without going through Flask
+        app.agent = AgentResponder(  # type: ignore[attr-defined]
+            app.mystate,  # type: ignore[attr-defined]
+            app.config["AGENT_HOST"],
+            app.config["AGENT_PORT"],
+            app.logger,
+            weight=app.config["AGENT_WEIGHT"],
+        )
+        app.agent.start()  # type: ignore[attr-defined]
+
+    app.logger.info("Application %s initialised with initial status: %s", name, _status)
     return app
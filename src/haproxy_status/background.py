@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Background threads, to keep slow work out of the request path."""
+
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from haproxy_status.util import atomic_write
+
+if TYPE_CHECKING:
+    from haproxy_status.app import MyState
+
+
+class StatusFileWriter(object):
+    """
+    Write the status file (for the Docker health check) from a background thread.
+
+    Changes submitted within `debounce' seconds of each other are coalesced, so that
+    only the latest status is written. The file is replaced atomically, so the health
+    check never reads a partially written file.
+
+    :param render: Turn what is submitted into the text to write, in the background
+                   thread. By default, the text itself is submitted.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        logger: logging.Logger,
+        debounce: float = 0.5,
+        render: Optional[Callable[[Any], str]] = None,
+    ):
+        self.filename = filename
+        self.logger = logger
+        self.debounce = debounce
+        self.render = render
+        self._cond = threading.Condition()
+        self._pending: Optional[Any] = None
+        self._busy = False
+        self._written: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, item: Any) -> None:
+        """Schedule item to be written to the file. Never blocks on I/O."""
+        with self._cond:
+            self._pending = item
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="status-file-writer", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for all submitted changes to be written.
+
+        :return: False if the timeout expired first
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._pending is None and not self._busy, timeout
+            )
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None)
+                self._busy = True
+            # let rapid changes coalesce, and only write the latest one
+            time.sleep(self.debounce)
+            with self._cond:
+                item, self._pending = self._pending, None
+            try:
+                text = self.render(item) if self.render is not None else item
+                if text is not None and text != self._written:
+                    atomic_write(self.filename, text.encode("utf-8"))
+                    self._written = text
+            except OSError as exc:
+                self.logger.error("Failed writing %s: %s", self.filename, exc)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+
+class StatusRefresher(object):
+    """
+    Refresh the status from haproxy periodically, even if nobody asks for it.
+
+    This keeps the status file, and everything else served from MyState, up to date.
+    MyState decides when it is actually time to fetch from haproxy, this thread only
+    gives it the opportunity to do so every `interval' seconds.
+    """
+
+    def __init__(self, mystate: "MyState", interval: float = 1.0):
+        self.mystate = mystate
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="status-refresher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.mystate.refresh_hap_status()
+                self.mystate.get_status()
+            except Exception as exc:
+                self.mystate.logger.exception(
+                    "Failed refreshing status in the background: %s", exc
+                )
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Record raw haproxy 'show stat' responses to a capture file, and replay them later.
+
+A capture file is a sequence of gzip members, one per recorded response, so that
+recording can be resumed after a restart and a crash loses at most the last record.
+Every record is a header with the monotonic and wall clock time of the recording and
+the length of the payload, followed by the UTF-8 encoded response.
+
+Replay a capture through the parser and MyState with
+
+    python -m haproxy_status.capture replay CAPTURE_FILE [--speed N]
+"""
+
+import gzip
+import logging
+import os
+import struct
+import sys
+import time
+from typing import Iterator, NamedTuple, Optional
+
+# monotonic time, wall clock time, payload length
+_HEADER = struct.Struct("!ddI")
+
+
+class CaptureRecord(NamedTuple):
+    monotonic: float
+    wall: float
+    data: str
+
+
+class CaptureWriter(object):
+    """
+    Append haproxy responses to a capture file.
+
+    Recording stops (with a warning) when the file reaches max_size bytes, to not fill
+    up the disk.
+    """
+
+    def __init__(self, filename: str, logger: logging.Logger, max_size: int = 0):
+        self.filename = filename
+        self.logger = logger
+        self.max_size = max_size
+        self.records = 0
+        self._full = False
+
+    def record(self, data: str) -> None:
+        if self._full:
+            return
+        payload = data.encode("utf-8")
+        header = _HEADER.pack(time.monotonic(), time.time(), len(payload))
+        try:
+            if self.max_size and os.path.exists(self.filename):
+                if os.path.getsize(self.filename) >= self.max_size:
+                    self._full = True
+                    self.logger.warning(
+                        "Capture file %s is full, not recording any more", self.filename
+                    )
+                    return
+            with open(self.filename, "ab") as fd:
+                fd.write(gzip.compress(header + payload))
+            self.records += 1
+        except OSError as exc:
+            self.logger.error(
+                "Failed recording haproxy response to %s: %s", self.filename, exc
+            )
+
+
+def read_capture(filename: str) -> Iterator[CaptureRecord]:
+    """Read the records from a capture file, in the order they were recorded."""
+    with gzip.open(filename, "rb") as fd:
+        while True:
+            header = fd.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            monotonic, wall, length = _HEADER.unpack(header)
+            payload = fd.read(length)
+            if len(payload) < length:
+                return
+            yield CaptureRecord(monotonic, wall, payload.decode("utf-8"))
+
+
+class ReplayStats(NamedTuple):
+    polls: int
+    status_changes: int
+    parse_time: float
+    register_time: float
+    evaluate_time: float
+    wall_time: float
+
+
+def replay(
+    filename: str, mystate, logger: logging.Logger, speed: Optional[float] = None
+) -> ReplayStats:
+    """
+    Feed the responses in a capture file through the parser and MyState.
+
+    MyState is evaluated at the wall clock time each response was recorded, so
+    uptimes and flapping come out the same regardless of the replay speed.
+
+    :param mystate: The MyState instance to replay into
+    :param speed: Replay at this multiple of real time. None means as fast as possible.
+    """
+    from haproxy_status.status import parse_status
+
+    polls = changes = 0
+    parse_time = register_time = evaluate_time = 0.0
+    last_status = None
+    first: Optional[float] = None
+    t_start = time.perf_counter()
+    for record in read_capture(filename):
+        if speed:
+            if first is None:
+                first = record.monotonic
+            delay = (record.monotonic - first) / speed - (time.perf_counter() - t_start)
+            if delay > 0:
+                time.sleep(delay)
+        t0 = time.perf_counter()
+        sites = parse_status(record.data, logger)
+        t1 = time.perf_counter()
+        if sites is None:
+            mystate.register_hap_fetch_failure(now=record.wall)
+        else:
+            mystate.register_hap_status(sites, now=record.wall)
+        t2 = time.perf_counter()
+        status = mystate.get_status(now=record.wall)
+        t3 = time.perf_counter()
+        parse_time += t1 - t0
+        register_time += t2 - t1
+        evaluate_time += t3 - t2
+        polls += 1
+        if status["status"] != last_status:
+            changes += 1
+            last_status = status["status"]
+    return ReplayStats(
+        polls=polls,
+        status_changes=changes,
+        parse_time=parse_time,
+        register_time=register_time,
+        evaluate_time=evaluate_time,
+        wall_time=time.perf_counter() - t_start,
+    )
+
+
+def main() -> int:
+    import argparse
+
+    from haproxy_status.app import MyState
+    from haproxy_status.config import Settings
+
+    parser = argparse.ArgumentParser(description="Replay a haproxy capture file")
+    parser.add_argument("command", choices=["replay"])
+    parser.add_argument("filename")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=None,
+        help="multiple of real time (default: as fast as possible)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING"))
+    logger = logging.getLogger("haproxy_status.capture")
+    config = {k.upper(): v for k, v in Settings().model_dump().items()}
+    # don't touch any files or sockets belonging to a running instance
+    config.update(
+        {
+            "STATUS_OUTPUT_FILENAME": None,
+            "STATE_SNAPSHOT_FILENAME": None,
+            "CAPTURE_FILENAME": None,
+            "EVENTS_TARGET": None,
+            "AGENT_PORT": None,
+        }
+    )
+    stats = replay(args.filename, MyState(config, logger), logger, speed=args.speed)
+    polls = max(stats.polls, 1)
+    print("Replayed {} polls in {:.3f}s".format(stats.polls, stats.wall_time))
+    print("Status changes: {}".format(stats.status_changes))
+    for name, value in [
+        ("parse", stats.parse_time),
+        ("register", stats.register_time),
+        ("evaluate", stats.evaluate_time),
+    ]:
+        print(
+            "{:<9} {:>9.3f}s total {:>9.3f}ms/poll".format(
+                name, value, value / polls * 1000
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Command line health check, for use in e.g. a Docker HEALTHCHECK.
+
+Answers from the status file written by the haproxy-status app (STATUS_OUTPUT_FILENAME),
+or by asking haproxy directly with --socket. Exits with 0 if the status is UP, and 1
+otherwise.
+
+With --socket, the status is UP when every backend (BACKEND row) is UP, and no ADMIN_DOWN
+signal file ('common' or SERVICE_NAME in SIGNAL_DIRECTORY) exists. The rest of the app's
+rules (flapping, HEALTHY_BACKEND_UPTIME, BACKEND_INCLUDE etc.) are not applied, use the
+status file for those.
+
+This has to start fast, so only import what is needed, when it is needed. In particular,
+never import Flask, pydantic or yaml from here. The --file path even avoids importing
+typing, since it is a significant part of the startup time. --socket has to import
+haproxy_status.status (and with it typing, and requests for an HTTP STATS_URL).
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+
+DEFAULT_STATUS_OUTPUT_FILENAME = "/dev/shm/haproxy-status.txt"
+DEFAULT_STATS_URL = "/var/run/haproxy-control/stats"
+DEFAULT_SIGNAL_DIRECTORY = "/var/haproxy-status"
+
+USAGE = """usage: haproxy-status-check [--file FILENAME | --socket [STATS_URL]] [--quiet]
+
+  --file FILENAME      read status from FILENAME (default: $STATUS_OUTPUT_FILENAME or
+                       {file})
+  --socket [STATS_URL] ask haproxy directly (default: $STATS_URL or {url}),
+                       UP if all backends are UP and there is no ADMIN_DOWN signal
+                       file in $SIGNAL_DIRECTORY (default {signals})
+  --quiet              don't print the status
+""".format(
+    file=DEFAULT_STATUS_OUTPUT_FILENAME,
+    url=DEFAULT_STATS_URL,
+    signals=DEFAULT_SIGNAL_DIRECTORY,
+)
+
+
+def check_file(filename: str) -> tuple[bool, str]:
+    try:
+        with open(filename, "r") as fd:
+            line = fd.readline().strip()
+    except OSError as exc:
+        return False, "STATUS_UNKNOWN Failed reading {}: {}".format(
+            filename, exc.strerror
+        )
+    return line.startswith("STATUS_UP"), line
+
+
+def check_admin_down(signal_directory: str, service_name: str | None) -> str | None:
+    """
+    Look for a file signalling ADMIN_DOWN, the same way as the app does.
+
+    :return: The path of the signal file, if there is one
+    """
+    for name in (service_name, "common"):
+        if name:
+            path = os.path.join(signal_directory, name)
+            if os.path.exists(path):
+                return path
+    return None
+
+
+def check_socket(stats_url: str) -> tuple[bool, str]:
+    import logging
+
+    from haproxy_status.status import HAProxyStatusError, get_status
+
+    logger = logging.getLogger("haproxy_status.cli")
+    # a health check should say what is wrong in one line, not log tracebacks of
+    # connection errors to the health log on every failed probe
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    try:
+        sites = get_status(stats_url, logger)
+    except HAProxyStatusError as exc:
+        return False, "STATUS_UNKNOWN {}".format(exc)
+    if not sites:
+        return False, "STATUS_UNKNOWN No backend data received from haproxy"
+    count = sum(len(site.backend) for site in sites)
+    down = [
+        "{} is {}".format(be.pxname, be.status)
+        for site in sites
+        for be in site.backends_down
+    ]
+    plural = "" if count == 1 else "s"
+    if down:
+        return False, "STATUS_DOWN {}/{} backend{} not UP: {}".format(
+            len(down), count, plural, ", ".join(down)
+        )
+    return True, "STATUS_UP {} backend{} UP".format(count, plural)
+
+
+def main(args: list[str] | None = None) -> int:
+    if args is None:
+        args = sys.argv[1:]
+    filename = os.environ.get("STATUS_OUTPUT_FILENAME", DEFAULT_STATUS_OUTPUT_FILENAME)
+    stats_url: str | None = None
+    quiet = False
+    while args:
+        arg = args.pop(0)
+        if arg == "--file" and args:
+            filename = args.pop(0)
+        elif arg == "--socket":
+            stats_url = os.environ.get("STATS_URL", DEFAULT_STATS_URL)
+            if args and not args[0].startswith("-"):
+                stats_url = args.pop(0)
+        elif arg in ("-q", "--quiet"):
+            quiet = True
+        else:
+            sys.stderr.write(USAGE)
+            return 1
+
+    if stats_url is not None:
+        signal_file = check_admin_down(
+            os.environ.get("SIGNAL_DIRECTORY", DEFAULT_SIGNAL_DIRECTORY),
+            os.environ.get("SERVICE_NAME"),
+        )
+        if signal_file is not None:
+            ok, msg = (
+                False,
+                "STATUS_ADMIN_DOWN Signal file {} exists".format(signal_file),
+            )
+        else:
+            ok, msg = check_socket(stats_url)
+    else:
+        ok, msg = check_file(filename)
+    if not quiet:
+        print(msg)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
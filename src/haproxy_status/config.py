@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 """Pydantic-settings based configuration for haproxy-status."""
 
-from typing import Optional
+from typing import Dict, Optional
 
 from pydantic_settings import BaseSettings
 
@@ -12,8 +12,16 @@ class Settings(BaseSettings):
     stats_url: str = "/var/run/haproxy-control/stats"
     log_down_interval: int = 180
     fetch_haproxy_status_interval: int = 15
+    # Adaptive polling: poll every FETCH_HAPROXY_STATUS_INTERVAL_MIN seconds while any
+    # server is down or recently changed status, and back off exponentially up to
+    # FETCH_HAPROXY_STATUS_INTERVAL_MAX seconds while everything is stable. Both default
+    # to FETCH_HAPROXY_STATUS_INTERVAL, which disables adaptive polling.
+    fetch_haproxy_status_interval_min: Optional[int] = None
+    fetch_haproxy_status_interval_max: Optional[int] = None
     healthy_backend_uptime: Optional[int] = None
     status_output_filename: str = "/dev/shm/haproxy-status.txt"
+    # Coalesce status changes within this many seconds into one write of the status file
+    status_output_debounce: float = 0.5
     signal_directory: str = "/var/haproxy-status"
     service_name: Optional[str] = None
     return_404_on_admin_down: bool = True
@@ -21,7 +29,103 @@ class Settings(BaseSettings):
     # more than FLAPPING_THRESHOLD times within FLAPPING_WINDOW seconds
     flapping_threshold: int = 3
     flapping_window: int = 300
+    # Stale-while-revalidate: when fetching status from haproxy fails, keep serving
+    # the last evaluated status for at most MAX_STATUS_STALENESS seconds (default four
+    # times FETCH_HAPROXY_STATUS_INTERVAL_MAX), while retrying
+    # the fetch every FETCH_HAPROXY_STATUS_RETRY_INTERVAL seconds
+    max_status_staleness: Optional[int] = None
+    fetch_haproxy_status_retry_interval: int = 2
+    # Deadlines (in seconds) for talking to haproxy. HAPROXY_TIMEOUT bounds the whole
+    # command, including sending the command and reading the response.
+    haproxy_connect_timeout: float = 1.0
+    haproxy_timeout: float = 5.0
+    # Circuit breaker: after HAPROXY_FAILURE_THRESHOLD consecutive failures, stop talking
+    # to haproxy for HAPROXY_BACKOFF seconds, doubling up to HAPROXY_BACKOFF_MAX seconds
+    # while it keeps failing
+    haproxy_failure_threshold: int = 3
+    haproxy_backoff: int = 5
+    haproxy_backoff_max: int = 60
+    # Checkpoint the state (server status and transitions) to this file after every
+    # poll, and load it at startup so that a restarted worker can answer correctly right
+    # away. The file is written by a background thread, debounced like the status file.
+    state_snapshot_filename: Optional[str] = None
+    # Refresh the status from haproxy in a background thread, to keep the status file
+    # up to date even when nobody requests /status
+    background_refresh: bool = True
+    # Number of status samples (one per poll) and status transitions kept in memory per
+    # server, for the /history endpoint. The buffers are allocated up front, at 9 bytes
+    # per sample and server. The default of 240 samples is an hour at the default poll
+    # interval. The transitions cover much longer. A HISTORY_SIZE of 0 disables the
+    # history.
+    history_size: int = 240
+    history_transitions_size: int = 256
+    # Maximum number of requests doing expensive work at the same time, per worker.
+    # Excess requests are rejected with a 503, except /ping and /status which are always
+    # answered (/status from the cached state when over the limit). 0 means no limit.
+    max_concurrent_requests: int = 8
+    # Record every raw 'show stat' response from haproxy to this (compressed) capture
+    # file, for replay with 'python -m haproxy_status.capture replay'. Recording stops
+    # when the file reaches CAPTURE_MAX_SIZE bytes.
+    capture_filename: Optional[str] = None
+    capture_max_size: int = 100 * 1024 * 1024
+    # Export server status changes, flapping and aggregate status changes as JSON lines
+    # to udp://HOST:PORT or unix:///PATH. At most EVENTS_QUEUE_SIZE events wait to be
+    # sent, more than that are dropped (and counted) instead of slowing down the polling.
+    events_target: Optional[str] = None
+    events_queue_size: int = 1000
+    # Answer haproxy agent checks (agent-check/agent-port) on this TCP port, with up,
+    # down, maint or drain based on the last evaluated status. With AGENT_WEIGHT, the
+    # reply includes the percentage of backends that are UP as the weight.
+    agent_port: Optional[int] = None
+    agent_host: str = "0.0.0.0"
+    agent_weight: bool = False
+    # Answer GET /ping and /status in a WSGI middleware in front of Flask, instead of
+    # going through the Flask request dispatching
+    fast_path: bool = False
+    # Which backends the aggregate status is based on. Comma separated shell style
+    # patterns matched on the haproxy pxname, or on the site name/group with a site: or
+    # group: prefix (see rules.py). Backends matching BACKEND_OPTIONAL are reported but
+    # don't make the status DOWN.
+    backend_include: Optional[str] = None
+    backend_exclude: Optional[str] = None
+    backend_optional: Optional[str] = None
+    # Serve the status of several services on /status/service/<name>, all from the same
+    # haproxy poll. Every service has its own include/exclude/optional backend rules
+    # (same syntax as BACKEND_INCLUDE etc.), and its own ADMIN_DOWN file named after the
+    # service in SIGNAL_DIRECTORY. Set as JSON, e.g.
+    # SERVICES='{"web": {"include": "site:www"}, "api": {"include": "site:api*"}}'
+    services: Dict[str, Dict[str, str]] = {}
+    # Forget servers (and sites) that haproxy hasn't reported for this many seconds, so
+    # that the state and history don't keep growing as backends come and go
+    forget_removed_after: int = 3600
+    # Enable /debug/memory, reporting the top allocation sites (using tracemalloc, which
+    # is started on the first request with DEBUG_MEMORY_FRAMES frames per allocation)
+    # and the number of live MyState and Site objects. While tracing, polls take several
+    # times longer and use more memory, so stop it with /debug/memory?stop=1 when done.
+    debug_memory: bool = False
+    debug_memory_frames: int = 1
+    # Parse the CSV of 'show stat' responses of at least PARSE_PARALLEL_MIN_LINES lines
+    # in a pool of PARSE_WORKERS processes (0 disables). The parsed rows are still built
+    # in the app's own process, so measure with benchmarks/parse.py on the actual
+    # hardware before enabling this.
+    parse_workers: int = 0
+    parse_parallel_min_lines: int = 20000
+
+    # Traffic-aware health: a backend that is UP is reported as DEGRADED (which counts as
+    # not UP) when at least DEGRADED_ERROR_RATE (0.0-1.0) of its requests since the
+    # previous poll failed with a 5xx, connection error or response error, or when more
+    # than DEGRADED_QUEUE requests are queued. The error rate is only judged with at
+    # least DEGRADED_MIN_REQUESTS requests since the previous poll. See traffic.py.
+    degraded_error_rate: Optional[float] = None
+    degraded_queue: Optional[int] = None
+    degraded_min_requests: int = 10
 
     def model_post_init(self, __context) -> None:
         if self.healthy_backend_uptime is None:
             self.healthy_backend_uptime = self.fetch_haproxy_status_interval * 2 + 2
+        if self.fetch_haproxy_status_interval_min is None:
+            self.fetch_haproxy_status_interval_min = self.fetch_haproxy_status_interval
+        if self.fetch_haproxy_status_interval_max is None:
+            self.fetch_haproxy_status_interval_max = self.fetch_haproxy_status_interval
+        if self.max_status_staleness is None:
+            self.max_status_staleness = self.fetch_haproxy_status_interval_max * 4
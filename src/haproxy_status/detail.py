@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Per-server details from the latest 'show stat' response, for /status/detail.
+
+With thousands of servers the full document is large, so it is never built in memory.
+The rows are selected lazily and encoded one at a time, and handed to the WSGI server
+in chunks of about CHUNK_SIZE bytes.
+"""
+
+import json
+from typing import Iterable, Iterator, List, Optional, Sequence, Set
+
+from haproxy_status.history import status_code
+from haproxy_status.rules import PatternSet, parse_patterns
+from haproxy_status.status import Site, SiteInfo
+
+# The fields returned when none are requested. Any other field from the haproxy CSV can
+# be requested too.
+DEFAULT_FIELDS = (
+    "pxname",
+    "svname",
+    "status",
+    "lastchg",
+    "addr",
+    "check_desc",
+    "last_chk",
+    "downtime",
+    "chkfail",
+    "chkdown",
+    "act",
+)
+DEFAULT_LIMIT = 1000
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_fields(value: Optional[str]) -> List[str]:
+    """
+    Parse a comma separated list of field names.
+
+    :raises ValueError: On field names that can't be haproxy CSV fields
+    """
+    if not value:
+        return list(DEFAULT_FIELDS)
+    res = [x.strip() for x in value.split(",") if x.strip()]
+    for this in res:
+        if not this.isidentifier() or this.startswith("_"):
+            raise ValueError("Bad field name: {!r}".format(this))
+    return res
+
+
+def select_rows(
+    sites: Iterable[Site],
+    backends: Optional[str] = None,
+    statuses: Optional[str] = None,
+) -> Iterator[SiteInfo]:
+    """
+    The server and BACKEND rows matching the filters, in haproxy order.
+
+    :param backends: Patterns matched on the pxname (see rules.py for the syntax)
+    :param statuses: Comma separated statuses. Only the first word of the status is
+                     compared, so UP also matches e.g. 'UP 1/3'.
+    """
+    match = PatternSet(parse_patterns(backends))
+    codes: Optional[Set[int]] = None
+    if statuses:
+        codes = {status_code(x.strip()) for x in statuses.split(",")}
+    for site in sites:
+        if not match.empty and not match.match(site.name):
+            continue
+        for row in site.servers + site.backend:
+            if codes is not None and status_code(row.status) not in codes:
+                continue
+            yield row
+
+
+def encode_detail(
+    rows: Iterator[SiteInfo],
+    fields: Sequence[str],
+    update_time: Optional[int],
+    offset: int = 0,
+    limit: int = DEFAULT_LIMIT,
+) -> Iterator[bytes]:
+    """
+    Encode one page of rows as a JSON document, in chunks.
+
+    The rows after the page are counted (but not encoded), for the total and the offset
+    of the next page.
+    """
+    dumps = json.JSONEncoder(separators=(",", ":")).encode
+    buf = [
+        '{{"update_time":{},"offset":{},"limit":{},"servers":['.format(
+            dumps(update_time), offset, limit
+        )
+    ]
+    size = 0
+    count = 0
+    for count, row in enumerate(rows, 1):
+        if count <= offset:
+            continue
+        if count > offset + limit:
+            # just count the rest
+            count += sum(1 for _ in rows)
+            break
+        values = {}
+        for field in fields:
+            value = getattr(row, field, None)
+            values[field] = value if isinstance(value, str) else None
+        data = dumps(values)
+        buf += [data if count == offset + 1 else "," + data]
+        size += len(data)
+        if size >= CHUNK_SIZE:
+            yield "".join(buf).encode("utf-8")
+            buf = []
+            size = 0
+    next_offset = offset + limit if count > offset + limit else None
+    buf += ['],"total":{},"next_offset":{}}}\n'.format(count, dumps(next_offset))]
+    yield "".join(buf).encode("utf-8")
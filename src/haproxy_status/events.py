@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Export state changes as structured events, to a local datagram socket.
+
+Events are JSON objects sent one per line (JSON lines), packed into as few datagrams
+as possible. The target is either udp://HOST:PORT or unix:///PATH (a SOCK_DGRAM unix
+socket), e.g. a log shipper listening on localhost.
+
+Emitting an event only appends it to a bounded queue. Encoding and sending is done by a
+background thread, and events that do not fit in the queue, or that the sink does not
+accept right away, are dropped and counted (events_dropped) rather than waited for.
+"""
+
+import json
+import logging
+import socket
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+from haproxy_status.util import Counters
+
+# Keep datagrams below the loopback MTU, and well below the unix socket default limits
+MAX_DATAGRAM_SIZE = 8192
+
+
+def parse_target(target: str) -> Tuple[int, Union[str, Tuple[str, int]]]:
+    """
+    Parse an event target into a socket family and address.
+
+    :return: (socket family, address)
+    """
+    if target.startswith("unix://"):
+        return socket.AF_UNIX, target[len("unix://") :]
+    if target.startswith("udp://"):
+        host, sep, port = target[len("udp://") :].rpartition(":")
+        if sep and port.isdigit():
+            return socket.AF_INET, (host.strip("[]") or "127.0.0.1", int(port))
+    raise ValueError(
+        "Bad event target {!r}, expected udp://HOST:PORT or unix:///PATH".format(target)
+    )
+
+
+def pack_datagrams(
+    lines: List[bytes], max_size: int = MAX_DATAGRAM_SIZE
+) -> List[bytes]:
+    """Join newline terminated lines into datagrams of at most max_size bytes."""
+    res = []
+    current: List[bytes] = []
+    size = 0
+    for line in lines:
+        if current and size + len(line) > max_size:
+            res += [b"".join(current)]
+            current, size = [], 0
+        current += [line]
+        size += len(line)
+    if current:
+        res += [b"".join(current)]
+    return res
+
+
+class EventExporter(object):
+    """
+    Send events to a datagram socket from a background thread.
+
+    :param target: udp://HOST:PORT or unix:///PATH
+    :param counters: Counters to count events_sent and events_dropped in
+    :param queue_size: Maximum number of events waiting to be sent
+    """
+
+    def __init__(
+        self,
+        target: str,
+        logger: logging.Logger,
+        counters: Counters,
+        queue_size: int = 1000,
+    ):
+        self.family, self.address = parse_target(target)
+        self.logger = logger
+        self.counters = counters
+        self.queue_size = queue_size
+        self._cond = threading.Condition()
+        self._pending: Deque[Dict[str, Any]] = deque()
+        self._busy = False
+        self._thread: Optional[threading.Thread] = None
+        self._sock: Optional[socket.socket] = None
+
+    def emit(self, event: str, ts: float, **fields: Any) -> None:
+        """Queue an event for sending. Never blocks on I/O."""
+        fields["event"] = event
+        fields["ts"] = ts
+        with self._cond:
+            if len(self._pending) >= self.queue_size:
+                self.counters.incr("events_dropped")
+                return
+            self._pending.append(fields)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="event-exporter", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for all queued events to be sent (or dropped).
+
+        :return: False if the timeout expired first
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._pending and not self._busy, timeout
+            )
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: bool(self._pending))
+                events = list(self._pending)
+                self._pending.clear()
+                self._busy = True
+            try:
+                self._send(events)
+            except Exception:
+                self.logger.exception("Failed exporting %d events", len(events))
+                self.counters.incr("events_dropped", len(events))
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _send(self, events: List[Dict[str, Any]]) -> None:
+        lines = [
+            json.dumps(x, separators=(",", ":")).encode("utf-8") + b"\n" for x in events
+        ]
+        datagrams = pack_datagrams(lines)
+        for num, data in enumerate(datagrams):
+            try:
+                if self._sock is None:
+                    self._sock = self._connect()
+                self._sock.send(data)
+            except OSError as exc:
+                # The sink is gone or not keeping up. Drop this and the rest of the
+                # batch rather than wait, and reconnect for the next batch.
+                dropped = sum(x.count(b"\n") for x in datagrams[num:])
+                self.counters.incr("events_dropped", dropped)
+                self.logger.debug("Dropped %d events: %s", dropped, exc)
+                self._close()
+                return
+            self.counters.incr("events_sent", data.count(b"\n"))
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(self.family, socket.SOCK_DGRAM)
+        try:
+            sock.connect(self.address)
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Answer /ping and /status without going through Flask.
+
+The load balancers request these two endpoints all the time. Going through Flask means
+a request context, ProxyFix, blueprint dispatch and jsonify for every request, just to
+return a few bytes. FastPath is a WSGI middleware that answers them directly, and passes
+everything else on to the Flask app.
+
+The responses are the same as the ones from the Flask views (see views.py).
+"""
+
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from werkzeug.exceptions import NotFound
+
+if TYPE_CHECKING:
+    from flask import Flask
+
+PING_BODY = b"pong\n"
+PING_HEADERS = [
+    ("Content-Type", "text/html; charset=utf-8"),
+    ("Content-Length", str(len(PING_BODY))),
+]
+JSON_CONTENT_TYPE = ("Content-Type", "application/json")
+
+
+class FastPath(object):
+    """
+    WSGI middleware answering GET /ping and GET /status.
+
+    The encoded /status response is kept, and reused for as long as get_status()
+    returns the same result.
+
+    :param app: The Flask app, with mystate and admission set up by init_app
+    :param wsgi_app: The WSGI app to pass all other requests on to
+    """
+
+    def __init__(self, app: "Flask", wsgi_app: Callable):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.mystate = app.mystate  # type: ignore[attr-defined]
+        self.admission = app.admission  # type: ignore[attr-defined]
+        # format the JSON the same way as jsonify() does
+        compact = getattr(app.json, "compact", None)
+        if (compact is None and app.debug) or compact is False:
+            self._dump_args: Dict[str, Any] = {"indent": 2}
+        else:
+            self._dump_args = {"separators": (",", ":")}
+        # (result from get_status, encoded body, headers)
+        self._last: Optional[Tuple[Dict[str, Any], bytes, List[Tuple[str, str]]]] = None
+
+    def __call__(
+        self, environ: Dict[str, Any], start_response: Callable
+    ) -> Iterable[bytes]:
+        method = environ["REQUEST_METHOD"]
+        path = environ.get("PATH_INFO")
+        if path == "/ping" and method in ("GET", "HEAD", "POST"):
+            start_response("200 OK", list(PING_HEADERS))
+            return [PING_BODY]
+        if path == "/status" and method in ("GET", "HEAD"):
+            return self.status(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+    def status(
+        self, environ: Dict[str, Any], start_response: Callable
+    ) -> Iterable[bytes]:
+        counters = self.mystate.counters
+        counters.incr("requests_in_flight")
+        try:
+            if self.admission.try_acquire():
+                try:
+                    self.mystate.refresh_hap_status()
+                finally:
+                    self.admission.release()
+            else:
+                # too busy to fetch status from haproxy, serve the cached status
+                counters.incr("status_served_from_cache")
+
+            res = self.mystate.get_status()
+        finally:
+            counters.incr("requests_in_flight", -1)
+
+        if (
+            res["status"] == "STATUS_ADMIN_DOWN"
+            and self.app.config["RETURN_404_ON_ADMIN_DOWN"]
+        ):
+            return NotFound()(environ, start_response)
+
+        last = self._last
+        if last is None or last[0] != res:
+            body = (self.app.json.dumps(res, **self._dump_args) + "\n").encode("utf-8")
+            headers = [JSON_CONTENT_TYPE, ("Content-Length", str(len(body)))]
+            # replaced as one tuple, other threads might be using the previous one
+            last = self._last = (res, body, headers)
+        _res, body, headers = last
+        start_response("200 OK", list(headers))
+        return [body]
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Bounded in-memory history of the status of backends and servers."""
+
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Status values are stored as small integers. Only the first word of the haproxy status
+# is kept, so e.g. 'UP 1/3' (going down) is recorded as UP and 'MAINT(via)' as MAINT.
+STATUS_NAMES = ["UNKNOWN", "UP", "DOWN", "NOLB", "MAINT", "DRAIN", "no check"]
+STATUS_CODES = {name: code for code, name in enumerate(STATUS_NAMES)}
+
+# Number of servers returned by /history, unless asked for more (up to the max)
+HISTORY_LIMIT = 100
+HISTORY_MAX_LIMIT = 1000
+
+# When downsampling, a bucket gets the worst status seen in it
+_SEVERITY = {
+    STATUS_CODES["no check"]: 0,
+    STATUS_CODES["UP"]: 1,
+    STATUS_CODES["NOLB"]: 2,
+    STATUS_CODES["DRAIN"]: 3,
+    STATUS_CODES["UNKNOWN"]: 4,
+    STATUS_CODES["MAINT"]: 5,
+    STATUS_CODES["DOWN"]: 6,
+}
+
+
+def status_code(status: str) -> int:
+    """Map a haproxy status string to the integer stored in the history."""
+    if status in STATUS_CODES:
+        return STATUS_CODES[status]
+    if status.startswith("no check"):
+        return STATUS_CODES["no check"]
+    for sep in (" ", "("):
+        status = status.split(sep, 1)[0]
+    return STATUS_CODES.get(status, STATUS_CODES["UNKNOWN"])
+
+
+class RingBuffer(object):
+    """
+    Fixed size buffer of (timestamp, status code) samples, overwriting the oldest sample
+    when full. Uses typed arrays, so the memory used is 9 bytes per sample.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._ts = array("q", [0]) * size
+        self._codes = array("b", [0]) * size
+        self._next = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, ts: int, code: int) -> None:
+        if not self.size:
+            return
+        self._ts[self._next] = ts
+        self._codes[self._next] = code
+        self._next = (self._next + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    @property
+    def last_code(self) -> Optional[int]:
+        if not self._count:
+            return None
+        return self._codes[self._next - 1]
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        """Iterate over the samples, oldest first."""
+        start = (self._next - self._count) % self.size if self.size else 0
+        for i in range(self._count):
+            idx = (start + i) % self.size
+            yield self._ts[idx], self._codes[idx]
+
+    def since(self, ts: int) -> Iterator[Tuple[int, int]]:
+        return ((_ts, code) for _ts, code in self if _ts >= ts)
+
+    def copy(self) -> "RingBuffer":
+        res = RingBuffer(0)
+        res.size = self.size
+        res._ts = array("q", self._ts)
+        res._codes = array("b", self._codes)
+        res._next = self._next
+        res._count = self._count
+        return res
+
+
+class ServerHistory(object):
+    """Status samples from every poll, and the most recent status transitions."""
+
+    def __init__(self, size: int, transitions_size: int):
+        self.samples = RingBuffer(size)
+        self.transitions = RingBuffer(transitions_size)
+
+    def record(self, ts: int, status: str) -> None:
+        code = status_code(status)
+        if code != self.samples.last_code:
+            self.transitions.append(ts, code)
+        self.samples.append(ts, code)
+
+    def copy(self) -> "ServerHistory":
+        """A copy that is safe to read while this history keeps being recorded to."""
+        res = ServerHistory(0, 0)
+        res.samples = self.samples.copy()
+        res.transitions = self.transitions.copy()
+        return res
+
+
+class History(object):
+    """
+    Status history for all servers (and BACKEND rows), keyed on site name and server name.
+
+    Not thread safe, MyState only records history from the thread publishing snapshots.
+    """
+
+    def __init__(self, size: int, transitions_size: int):
+        self.size = size
+        self.transitions_size = transitions_size
+        self._servers: Dict[str, Dict[str, ServerHistory]] = {}
+
+    def record(self, name: str, srv_name: str, ts: int, status: str) -> None:
+        if not self.size:
+            return
+        site = self._servers.setdefault(name, {})
+        if srv_name not in site:
+            site[srv_name] = ServerHistory(self.size, self.transitions_size)
+        site[srv_name].record(ts, status)
+
+    def forget(self, name: str, srv_name: str) -> None:
+        site = self._servers.get(name)
+        if site is None:
+            return
+        site.pop(srv_name, None)
+        if not site:
+            del self._servers[name]
+
+    def __len__(self) -> int:
+        """The number of servers with a history."""
+        return sum(len(x) for x in self._servers.values())
+
+    def get(self, name: str, srv_name: str) -> Optional[ServerHistory]:
+        return self._servers.get(name, {}).get(srv_name)
+
+    def sites(self) -> Dict[str, List[str]]:
+        return {name: list(servers.keys()) for name, servers in self._servers.items()}
+
+
+def downsample(samples: Iterator[Tuple[int, int]], step: int) -> List[Tuple[int, int]]:
+    """
+    Downsample status samples into buckets of `step' seconds.
+
+    Every bucket gets the worst status seen in it, so that short outages are not lost.
+
+    :return: List of (bucket start timestamp, status code)
+    """
+    res: List[Tuple[int, int]] = []
+    for ts, code in samples:
+        bucket = ts - ts % step
+        if res and res[-1][0] == bucket:
+            if _SEVERITY[code] > _SEVERITY[res[-1][1]]:
+                res[-1] = (bucket, code)
+        else:
+            res.append((bucket, code))
+    return res
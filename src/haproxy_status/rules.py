@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Rules deciding which haproxy backends the aggregate status is based on.
+
+Every rule is a list of shell style patterns (fnmatch), separated by commas or
+whitespace. A pattern is matched against the haproxy pxname, unless it is prefixed by
+site: or group: to match the site name or the group (pxname is ${site_name}__${group}):
+
+    BACKEND_EXCLUDE="*-test, group:failpage"
+    BACKEND_OPTIONAL="site:stats*"
+
+BACKEND_INCLUDE   only consider backends matching one of these (default: all)
+BACKEND_EXCLUDE   never consider backends matching one of these
+BACKEND_OPTIONAL  backends matching one of these are reported, but don't make the
+                  aggregate status DOWN
+
+The patterns are compiled once, and the classification of every pxname is cached, so
+evaluating the rules on every poll is a dict lookup per backend.
+"""
+
+import fnmatch
+import re
+from typing import Dict, Iterable, List, Optional, Pattern, Set, Tuple
+
+REQUIRED = "required"
+OPTIONAL = "optional"
+IGNORED = "ignored"
+
+FIELDS = ("pxname", "site", "group")
+
+
+def split_pxname(pxname: str) -> Tuple[str, Optional[str]]:
+    """Split a pxname into site name and group, the same way as Site does."""
+    parts = pxname.split("__")
+    return parts[0], parts[1] if len(parts) > 1 else None
+
+
+class PatternSet(object):
+    """
+    A compiled set of patterns.
+
+    Patterns without wildcards are looked up in a set, the rest are combined into one
+    regular expression per field.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.literals: Dict[str, Set[str]] = {x: set() for x in FIELDS}
+        self.regexps: Dict[str, Optional[Pattern[str]]] = {x: None for x in FIELDS}
+        globs: Dict[str, List[str]] = {x: [] for x in FIELDS}
+        self.empty = True
+        for pattern in patterns:
+            field, sep, value = pattern.partition(":")
+            if not sep or field not in ("site", "group"):
+                field, value = "pxname", pattern
+            if any(c in value for c in "*?["):
+                globs[field] += [fnmatch.translate(value)]
+            else:
+                self.literals[field].add(value)
+            self.empty = False
+        for field, this in globs.items():
+            if this:
+                self.regexps[field] = re.compile("|".join(this))
+
+    def match(self, pxname: str) -> bool:
+        site, group = split_pxname(pxname)
+        for field, value in (("pxname", pxname), ("site", site), ("group", group)):
+            if value is None:
+                continue
+            if value in self.literals[field]:
+                return True
+            regexp = self.regexps[field]
+            if regexp is not None and regexp.match(value):
+                return True
+        return False
+
+
+def parse_patterns(value: Optional[str]) -> List[str]:
+    """Split a comma and/or whitespace separated list of patterns."""
+    if not value:
+        return []
+    return [x for x in re.split(r"[,\s]+", value) if x]
+
+
+class BackendRules(object):
+    """
+    Classify backends as REQUIRED, OPTIONAL or IGNORED.
+
+    :param include: Patterns for the backends to consider, None or empty means all
+    :param exclude: Patterns for the backends to ignore
+    :param optional: Patterns for the backends that are not required to be UP
+    """
+
+    def __init__(
+        self,
+        include: Optional[str] = None,
+        exclude: Optional[str] = None,
+        optional: Optional[str] = None,
+    ):
+        self.include = PatternSet(parse_patterns(include))
+        self.exclude = PatternSet(parse_patterns(exclude))
+        self.optional = PatternSet(parse_patterns(optional))
+        self._cache: Dict[str, str] = {}
+
+    def classify(self, pxname: str) -> str:
+        res = self._cache.get(pxname)
+        if res is None:
+            if (
+                not self.include.empty and not self.include.match(pxname)
+            ) or self.exclude.match(pxname):
+                res = IGNORED
+            elif self.optional.match(pxname):
+                res = OPTIONAL
+            else:
+                res = REQUIRED
+            self._cache[pxname] = res
+        return res
+
+    def forget(self, pxname: str) -> None:
+        """Drop the cached classification of a backend that no longer exists."""
+        self._cache.pop(pxname, None)
+
+    @property
+    def cache_size(self) -> int:
+        return len(self._cache)
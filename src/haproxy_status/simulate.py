@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+Drive MyState with a synthetic fleet of servers on a virtual clock.
+
+Every server alternates between UP and DOWN with exponentially distributed time in
+each state. Flappy servers go down every minute or so, stable servers about once a
+day, so it is known which servers the flapping detection should flag. Since no real
+time passes between polls, hours of polling take seconds, which makes it possible to
+measure the evaluation cost per poll and to tune FLAPPING_WINDOW/FLAPPING_THRESHOLD:
+
+    python -m haproxy_status.simulate --polls 100000 --window 120,300 --threshold 2,3
+"""
+
+import logging
+import random
+import sys
+import time
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, cast
+
+from haproxy_status.status import Site, SiteInfo
+
+
+class FakeClock(object):
+    """A clock that only moves when told to. Pass an instance as MyState's clock."""
+
+    def __init__(self, now: float = 1_000_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class SimLine(NamedTuple):
+    """The subset of a haproxy 'show stat' line that MyState looks at."""
+
+    pxname: str
+    svname: str
+    status: str
+    lastchg: str
+    chkdown: str
+    chkfail: str = "0"
+    downtime: str = "0"
+    act: str = "1"
+    addr: str = ""
+    check_desc: str = ""
+    last_chk: str = ""
+
+
+class SimServer(object):
+    """
+    A server alternating between UP and DOWN.
+
+    :param mean_up: Mean time (seconds) spent UP before going DOWN
+    :param mean_down: Mean time (seconds) spent DOWN before coming back UP
+    :param flappy: Ground truth, whether the flapping detection ought to flag this server
+    """
+
+    def __init__(
+        self,
+        pxname: str,
+        svname: str,
+        mean_up: float,
+        mean_down: float,
+        flappy: bool,
+        now: float,
+        rng: random.Random,
+    ):
+        self.pxname = pxname
+        self.svname = svname
+        self.mean_up = mean_up
+        self.mean_down = mean_down
+        self.flappy = flappy
+        self._rng = rng
+        self.status = "UP"
+        self.chkdown = 0
+        self.last_change = now
+        self.next_change = now + rng.expovariate(1 / mean_up)
+
+    def advance(self, now: float) -> None:
+        """Apply all the status changes that happened up until now."""
+        while self.next_change <= now:
+            self.last_change = self.next_change
+            if self.status == "UP":
+                self.status = "DOWN"
+                self.chkdown += 1
+                mean = self.mean_down
+            else:
+                self.status = "UP"
+                mean = self.mean_up
+            self.next_change += self._rng.expovariate(1 / mean)
+
+    def line(self, now: float) -> SiteInfo:
+        return cast(
+            SiteInfo,
+            SimLine(
+                pxname=self.pxname,
+                svname=self.svname,
+                status=self.status,
+                lastchg=str(int(now - self.last_change)),
+                chkdown=str(self.chkdown),
+            ),
+        )
+
+
+class Fleet(object):
+    """
+    A number of backends with servers, some of which are flappy.
+
+    :param backends: Number of backends (haproxy pxnames)
+    :param servers: Servers per backend
+    :param flappy: Fraction of the servers that are flappy
+    """
+
+    def __init__(
+        self,
+        now: float,
+        backends: int = 10,
+        servers: int = 4,
+        flappy: float = 0.1,
+        seed: Optional[int] = None,
+        flappy_up: float = 60,
+        flappy_down: float = 10,
+        stable_up: float = 86400,
+        stable_down: float = 60,
+    ):
+        self._rng = random.Random(seed)
+        self.servers = servers
+        self.flappy = flappy
+        self._flappy_means = (flappy_up, flappy_down)
+        self._stable_means = (stable_up, stable_down)
+        self._next_backend = 0
+        self.sites: Dict[str, List[SimServer]] = {}
+        for _ in range(backends):
+            self._add_backend(now)
+
+    def _add_backend(self, now: float) -> None:
+        pxname = "site{}__default".format(self._next_backend)
+        self._next_backend += 1
+        self.sites[pxname] = []
+        for s in range(self.servers):
+            is_flappy = self._rng.random() < self.flappy
+            up, down = self._flappy_means if is_flappy else self._stable_means
+            self.sites[pxname].append(
+                SimServer(
+                    pxname, "server{}".format(s), up, down, is_flappy, now, self._rng
+                )
+            )
+
+    def churn(self, now: float) -> None:
+        """Replace the oldest backend with a new one, as when the haproxy config changes."""
+        del self.sites[next(iter(self.sites))]
+        self._add_backend(now)
+
+    def poll(self, now: float) -> List[Site]:
+        """Return what haproxy would report at this time."""
+        res = []
+        for pxname, servers in self.sites.items():
+            site = Site(pxname)
+            for this in servers:
+                this.advance(now)
+                site.add_parsed(this.line(now))
+            up = any(x.status == "UP" for x in servers)
+            site.add_parsed(
+                cast(
+                    SiteInfo,
+                    SimLine(
+                        pxname=pxname,
+                        svname="BACKEND",
+                        status="UP" if up else "DOWN",
+                        lastchg="0",
+                        chkdown="0",
+                    ),
+                )
+            )
+            res.append(site)
+        return res
+
+    def show_stat(self, now: float) -> str:
+        """Return what haproxy would respond to 'show stat' at this time."""
+        lines = ["# " + ",".join(SimLine._fields) + ","]
+        for site in self.poll(now):
+            for this in site.servers + site.backend:
+                lines += [",".join(cast(SimLine, this)) + ","]
+        return "\n".join(lines) + "\n"
+
+
+class SimulationStats(NamedTuple):
+    polls: int
+    register_time: float
+    evaluate_time: float
+    # Counted in server-polls (one server evaluated at one poll) after the warmup
+    true_positives: int
+    false_negatives: int
+    false_positives: int
+    true_negatives: int
+
+    @property
+    def true_positive_rate(self) -> float:
+        return self.true_positives / max(self.true_positives + self.false_negatives, 1)
+
+    @property
+    def false_positive_rate(self) -> float:
+        return self.false_positives / max(self.false_positives + self.true_negatives, 1)
+
+
+def simulate(
+    mystate,
+    clock: FakeClock,
+    fleet: Fleet,
+    polls: int,
+    interval: float,
+    warmup: int = 0,
+    churn_every: int = 0,
+) -> SimulationStats:
+    """
+    Poll the fleet every `interval' virtual seconds and feed the result to MyState.
+
+    :param mystate: MyState instance, created with clock as its clock
+    :param warmup: Number of polls to not score the flapping detection for, to give it
+                   a chance to see a full FLAPPING_WINDOW
+    :param churn_every: Replace a backend in the fleet every this many polls
+    """
+    register_time = evaluate_time = 0.0
+    tp = fn = fp = tn = 0
+    for i in range(polls):
+        clock.advance(interval)
+        now = clock()
+        if churn_every and i and i % churn_every == 0:
+            fleet.churn(now)
+        sites = fleet.poll(now)
+        t0 = time.perf_counter()
+        mystate.register_hap_status(sites, now=now)
+        t1 = time.perf_counter()
+        mystate.get_status(now=now)
+        t2 = time.perf_counter()
+        register_time += t1 - t0
+        evaluate_time += t2 - t1
+        if i < warmup:
+            continue
+        snapshot = mystate._hap_status
+        for pxname, servers in fleet.sites.items():
+            for this in servers:
+                flagged = mystate._is_flapping(snapshot[pxname][this.svname], int(now))
+                if this.flappy:
+                    tp += flagged
+                    fn += not flagged
+                else:
+                    fp += flagged
+                    tn += not flagged
+    return SimulationStats(
+        polls=polls,
+        register_time=register_time,
+        evaluate_time=evaluate_time,
+        true_positives=tp,
+        false_negatives=fn,
+        false_positives=fp,
+        true_negatives=tn,
+    )
+
+
+def make_config(overrides: Mapping[str, Any]) -> Dict[str, Any]:
+    """The default configuration, without any files or sockets of a running instance."""
+    from haproxy_status.config import Settings
+
+    config = {k.upper(): v for k, v in Settings().model_dump().items()}
+    config.update(
+        {
+            "STATUS_OUTPUT_FILENAME": None,
+            "STATE_SNAPSHOT_FILENAME": None,
+            "CAPTURE_FILENAME": None,
+            "EVENTS_TARGET": None,
+            "AGENT_PORT": None,
+        }
+    )
+    config.update(overrides)
+    return config
+
+
+def main() -> int:
+    import argparse
+
+    from haproxy_status.app import MyState
+
+    def int_list(value: str) -> List[int]:
+        return [int(x) for x in value.split(",")]
+
+    parser = argparse.ArgumentParser(
+        description="Simulate polling a synthetic haproxy fleet"
+    )
+    parser.add_argument("--backends", type=int, default=10)
+    parser.add_argument("--servers", type=int, default=4, help="servers per backend")
+    parser.add_argument(
+        "--flappy", type=float, default=0.1, help="fraction of flappy servers"
+    )
+    parser.add_argument("--polls", type=int, default=10000)
+    parser.add_argument("--interval", type=float, default=10, help="poll interval")
+    parser.add_argument(
+        "--window", type=int_list, default=None, help="FLAPPING_WINDOW(s) to try"
+    )
+    parser.add_argument(
+        "--threshold", type=int_list, default=None, help="FLAPPING_THRESHOLD(s) to try"
+    )
+    parser.add_argument(
+        "--churn", type=int, default=0, help="replace a backend every CHURN polls"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    logger = logging.getLogger("haproxy_status.simulate")
+    defaults = make_config({})
+    windows = args.window or [defaults["FLAPPING_WINDOW"]]
+    thresholds = args.threshold or [defaults["FLAPPING_THRESHOLD"]]
+
+    print(
+        "{:>7} {:>9} {:>7} {:>7} {:>12} {:>12}".format(
+            "window", "threshold", "TPR", "FPR", "register/ms", "evaluate/ms"
+        )
+    )
+    for window in windows:
+        for threshold in thresholds:
+            config = make_config(
+                {
+                    "FLAPPING_WINDOW": window,
+                    "FLAPPING_THRESHOLD": threshold,
+                    "FETCH_HAPROXY_STATUS_INTERVAL": args.interval,
+                }
+            )
+            clock = FakeClock()
+            # the same seed gives every combination the same fleet and events
+            fleet = Fleet(
+                clock(), args.backends, args.servers, args.flappy, seed=args.seed
+            )
+            stats = simulate(
+                MyState(config, logger, clock=clock),
+                clock,
+                fleet,
+                args.polls,
+                args.interval,
+                warmup=int(window // args.interval) + 1,
+                churn_every=args.churn,
+            )
+            polls = max(stats.polls, 1)
+            print(
+                "{:>7} {:>9} {:>7.3f} {:>7.3f} {:>12.3f} {:>12.3f}".format(
+                    window,
+                    threshold,
+                    stats.true_positive_rate,
+                    stats.false_positive_rate,
+                    stats.register_time / polls * 1000,
+                    stats.evaluate_time / polls * 1000,
+                )
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,14 +2,104 @@
 import csv
 import logging
 import socket
+import threading
+import time
 from dataclasses import dataclass
-from typing import Dict, List, NamedTuple, Optional, cast
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+    cast,
+)
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+    from haproxy_status.capture import CaptureWriter
 
 
 class HAProxyStatusError(Exception):
     pass
 
 
+class HAProxyTimeouts(NamedTuple):
+    """
+    Deadlines (in seconds) for talking to haproxy.
+
+    connect is the deadline for establishing the connection, and total is the deadline
+    for the whole command including sending the command and reading the response.
+    """
+
+    connect: float = 1.0
+    total: float = 5.0
+
+
+class CircuitBreaker(object):
+    """
+    Stop talking to an unhealthy haproxy for a while.
+
+    After `threshold' consecutive failures the breaker opens, and allow() returns False
+    for `backoff' seconds. After that, one trial call is allowed. If that call succeeds
+    the breaker closes again, and if it fails the breaker re-opens with the backoff
+    doubled (up to `backoff_max').
+
+    Not thread safe on its own, MyState only lets one thread at a time talk to haproxy.
+    """
+
+    def __init__(
+        self,
+        threshold: int,
+        backoff: float,
+        backoff_max: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.threshold = threshold
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self._clock = clock
+        self.failures = 0
+        self._current_backoff = backoff
+        self._open_until: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self._open_until is None:
+            return "closed"
+        if self._clock() < self._open_until:
+            return "open"
+        return "half-open"
+
+    def allow(self) -> bool:
+        return self.state != "open"
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._current_backoff = self.backoff
+        self._open_until = None
+
+    def record_failure(self) -> bool:
+        """
+        Record a failed call.
+
+        :return: True if the breaker was opened by this failure
+        """
+        self.failures += 1
+        if self._open_until is not None:
+            # the trial call in half-open state failed, back off some more
+            self._current_backoff = min(self._current_backoff * 2, self.backoff_max)
+        elif self.failures < self.threshold:
+            return False
+        self._open_until = self._clock() + self._current_backoff
+        return True
+
+
 @dataclass
 class SiteInfo(object):
     """
@@ -40,12 +130,21 @@ class Site(object):
     Wrapper object for parsed haproxy status data.
 
     name is haproxy pxname, which in särimner is ${site_name}__${group}
+
+    The backends are sorted into UP and not UP, and the shortest and longest time since
+    the last status change (lastchg) is tracked, as the lines are added. This makes the
+    backend properties below cheap to access any number of times.
     """
 
     def __init__(self, name: str):
         self._raw_fe: List[SiteInfo] = []
         self._raw_be: List[SiteInfo] = []
         self._raw_servers: List[SiteInfo] = []
+        self._be_up: List[SiteInfo] = []
+        self._be_down: List[SiteInfo] = []
+        # (min, max) lastchg of the backends that are UP, and that are not UP
+        self._uptime: Optional[Tuple[int, int]] = None
+        self._downtime: Optional[Tuple[int, int]] = None
         self.name = name
         name_parts = name.split("__")
         self.site_name = name_parts[0]
@@ -62,11 +161,21 @@ class Site(object):
         :type parsed: namedtuple
         """
         if parsed.svname == "FRONTEND":
-            self._raw_fe += [parsed]
+            self._raw_fe.append(parsed)
         elif parsed.svname == "BACKEND":
-            self._raw_be += [parsed]
+            self._raw_be.append(parsed)
+            try:
+                lastchg: Optional[int] = int(parsed.lastchg)
+            except ValueError:
+                lastchg = None
+            if parsed.status == "UP":
+                self._be_up.append(parsed)
+                self._uptime = _min_max(self._uptime, lastchg)
+            else:
+                self._be_down.append(parsed)
+                self._downtime = _min_max(self._downtime, lastchg)
         else:
-            self._raw_servers += [parsed]
+            self._raw_servers.append(parsed)
 
     @property
     def frontend(self) -> List[SiteInfo]:
@@ -85,40 +194,96 @@ class Site(object):
         """
         Return backends with status UP.
         """
-        return [x for x in self._raw_be if x.status == "UP"]
+        return self._be_up
 
     @property
     def backends_down(self) -> List[SiteInfo]:
         """
         Return backends that are not UP.
         """
-        return [x for x in self._raw_be if x.status != "UP"]
+        return self._be_down
 
     @property
     def backend_uptime_min(self) -> int:
         """Return the shortest backend uptime
         aka. how long all backends many seconds ago the last backend went down
         """
-        downtime = [int(x.lastchg) for x in self.backends_up]
-        return min(downtime)
+        if self._uptime is None:
+            raise ValueError("No backends UP in {}".format(self.name))
+        return self._uptime[0]
+
+    @property
+    def backend_uptime_max(self) -> int:
+        """Return the longest backend uptime"""
+        if self._uptime is None:
+            raise ValueError("No backends UP in {}".format(self.name))
+        return self._uptime[1]
 
     @property
     def backend_downtime_min(self) -> int:
         """Return the shortest backend downtime
         aka. how many seconds ago the last backend went down
         """
-        downtime = [int(x.lastchg) for x in self.backends_down]
-        return min(downtime)
+        if self._downtime is None:
+            raise ValueError("No backends down in {}".format(self.name))
+        return self._downtime[0]
 
+    @property
+    def backend_downtime_max(self) -> int:
+        """Return the longest backend downtime"""
+        if self._downtime is None:
+            raise ValueError("No backends down in {}".format(self.name))
+        return self._downtime[1]
+
+
+def _min_max(
+    current: Optional[Tuple[int, int]], value: Optional[int]
+) -> Optional[Tuple[int, int]]:
+    """Update a running (min, max) with value, if it is known."""
+    if value is None:
+        return current
+    if current is None:
+        return value, value
+    return min(current[0], value), max(current[1], value)
+
+
+def haproxy_execute(
+    cmd: str,
+    stats_url: str,
+    logger: logging.Logger,
+    timeouts: Optional[HAProxyTimeouts] = None,
+    recorder: Optional["CaptureWriter"] = None,
+) -> Optional[str]:
+    """
+    Execute a command on the haproxy stats socket (or fetch the stats from HTTP).
+
+    :param recorder: Record the response to a capture file, for replay later on
+    """
+    if timeouts is None:
+        timeouts = HAProxyTimeouts()
+    deadline = time.monotonic() + timeouts.total
 
-def haproxy_execute(cmd: str, stats_url: str, logger: logging.Logger) -> Optional[str]:
     if stats_url.startswith("http"):
         import requests
 
-        logger.debug("Fetching haproxy stats from {}".format(stats_url))
+        logger.debug("Fetching haproxy stats from %s", stats_url)
         try:
-            data = requests.get(stats_url).text
-        except requests.exceptions.ConnectionError as exc:
+            # the read timeout only applies to each read, so the total deadline is
+            # checked between the chunks of a slowly trickling response
+            with requests.get(
+                stats_url, timeout=(timeouts.connect, timeouts.total), stream=True
+            ) as response:
+                body = []
+                for chunk in response.iter_content(chunk_size=65536):
+                    if time.monotonic() > deadline:
+                        raise HAProxyStatusError(
+                            "Timeout fetching status from {} after {}s".format(
+                                stats_url, timeouts.total
+                            )
+                        )
+                    body += [chunk]
+                data = b"".join(body).decode(response.encoding or "utf-8")
+        except requests.RequestException as exc:
             raise HAProxyStatusError(
                 "Failed fetching status from {}: {}".format(stats_url, exc)
             )
@@ -126,43 +291,67 @@ def haproxy_execute(cmd: str, stats_url: str, logger: logging.Logger) -> Optiona
         socket_fn = stats_url
         if socket_fn.startswith("file://"):
             socket_fn = socket_fn[len("file://") :]
-        logger.debug(
-            'opening AF_UNIX socket {} for command "{}"'.format(socket_fn, cmd)
-        )
+        logger.debug('opening AF_UNIX socket %s for command "%s"', socket_fn, cmd)
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         try:
-            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            client.connect(socket_fn)
-            cmd = cmd + "\n"
-            client.send(cmd.encode("utf-8"))
-        except ConnectionRefusedError:
-            logger.info(
-                "haproxy refused the connection on socket {}, maybe it is not running?".format(
-                    socket_fn
+            try:
+                client.settimeout(timeouts.connect)
+                client.connect(socket_fn)
+                cmd = cmd + "\n"
+                client.settimeout(max(deadline - time.monotonic(), 0.001))
+                client.sendall(cmd.encode("utf-8"))
+            except ConnectionRefusedError:
+                logger.info(
+                    "haproxy refused the connection on socket %s, maybe it is not running?",
+                    socket_fn,
                 )
-            )
-            return None
-        except Exception as exc:
-            logger.error(
-                "Failed sending command {!r} to socket {}: {}".format(
-                    cmd, socket_fn, exc
+                return None
+            except socket.timeout:
+                logger.error("Timeout sending command %r to socket %s", cmd, socket_fn)
+                return None
+            except Exception as exc:
+                logger.error(
+                    "Failed sending command %r to socket %s: %s", cmd, socket_fn, exc
                 )
-            )
-            logger.exception(exc)
-            return None
-
-        data = ""
-        while True:
-            this = client.recv(1)
-            if not this:
-                break
-            data += this.decode("utf-8")
-
-    # logger.debug('haproxy result: {}'.format(data))
-    logger.debug("haproxy command {!r} result: {} bytes".format(cmd, len(data)))
+                logger.exception(exc)
+                return None
+
+            chunks = []
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise socket.timeout()
+                    client.settimeout(remaining)
+                    this = client.recv(65536)
+                    if not this:
+                        break
+                    chunks += [this]
+            except socket.timeout:
+                logger.error(
+                    "Timeout reading response to command %r from socket %s after %ss",
+                    cmd,
+                    socket_fn,
+                    timeouts.total,
+                )
+                return None
+            data = b"".join(chunks).decode("utf-8")
+        finally:
+            client.close()
+
+    logger.debug("haproxy command %r result: %d bytes", cmd, len(data))
+    if recorder is not None:
+        recorder.record(data)
     return data
 
 
-def get_status(stats_url: str, logger: logging.Logger) -> Optional[List[Site]]:
+def get_status(
+    stats_url: str,
+    logger: logging.Logger,
+    timeouts: Optional[HAProxyTimeouts] = None,
+    recorder: Optional["CaptureWriter"] = None,
+    pool: Optional["ParsePool"] = None,
+) -> Optional[List[Site]]:
     """
     haproxy 'show stat' returns _a lot_ of different metrics for each frontend and backend
     in the system. Parse the returned CSV data and return a Site instance per haproxy pxname (site name + group).
@@ -184,13 +373,19 @@ def get_status(stats_url: str, logger: logging.Logger) -> Optional[List[Site]]:
     Example haproxy stats URL: 'http://127.0.0.1:9000/haproxy_stats;csv'
 
     :param stats_url: Path to haproxy socket, or a HTTP(S) URL to fetch from.
+    :param timeouts: Deadlines for talking to haproxy.
+    :param recorder: Record the raw response from haproxy to a capture file.
+    :param pool: Parse large responses in this pool of worker processes.
     """
-    data = haproxy_execute("show stat", stats_url, logger)
-    logger.debug(f"haproxy show stat result: {data}")
+    data = haproxy_execute("show stat", stats_url, logger, timeouts, recorder)
+    # Log arguments are only formatted if the message is emitted, so this is free at INFO
+    logger.debug("haproxy show stat result: %s", data)
     if not data:
         return None
-    if not data.startswith("# "):
-        logger.error("Unknown status response from haproxy: {}".format(data))
+    return parse_status(data, logger, pool)
+
+
+def _split_lines(data: str) -> List[str]:
     lines = []  # type: List[str]
     for this in data.split("\n"):
         # remove extra comma at the end of all lines, and remove empty lines
@@ -198,16 +393,147 @@ def get_status(stats_url: str, logger: logging.Logger) -> Optional[List[Site]]:
             if this[-1:] == ",":
                 this = this[:-1]
             lines += [this]
-    if len(lines) < 2:
-        logger.warning(
-            "haproxy did not return status for any backends: {}".format(data)
-        )
-        return None
+    return lines
+
+
+def _parse_rows(lines: Iterable[str]) -> Iterator[List[str]]:
+    """
+    Parse CSV lines.
+
+    Values are only quoted by haproxy when they contain a comma or a quote, so most
+    lines can just be split - which is a lot faster than the csv module.
+    """
+    for line in lines:
+        if '"' in line or "\r" in line:
+            yield from csv.reader([line])
+        else:
+            yield line.split(",")
+
+
+# Separators for the rows and values of parsed chunks sent back by the ParsePool workers
+_RS = "\x1e"
+_FS = "\x1f"
+
+
+def _parse_chunk(data: str) -> Union[str, List[List[str]]]:
+    """
+    Parse CSV lines (without the legend) in a ParsePool worker process.
+
+    The rows are returned joined with _RS and _FS, since one string is a lot cheaper
+    to send back to the parent process than a list of lists of strings.
+    """
+    rows = _parse_rows(_split_lines(data))
+    if _RS in data or _FS in data:
+        return list(rows)
+    return _RS.join(_FS.join(values) for values in rows)
+
+
+def _unpack_chunk(chunk: Union[str, List[List[str]]]) -> List[List[str]]:
+    if not isinstance(chunk, str):
+        return chunk
+    if not chunk:
+        return []
+    return [x.split(_FS) for x in chunk.split(_RS)]
+
+
+def _split_chunks(data: str, count: int) -> List[str]:
+    """Split data into about count chunks of about the same size, at line boundaries."""
+    size = len(data) // count + 1
+    res = []
+    start = 0
+    while start < len(data):
+        end = data.find("\n", start + size)
+        if end == -1:
+            end = len(data)
+        res += [data[start:end]]
+        start = end + 1
+    return res
+
+
+class ParsePool(object):
+    """
+    Parse the CSV of large 'show stat' responses on several cores.
+
+    The response is split into one chunk per worker process at line boundaries. The
+    workers return the parsed rows as compact records (see _parse_chunk), and the
+    ParsedLine and Site objects are built from them in the calling process.
+
+    The worker processes are started (not forked, the app has threads) when the first
+    large response is parsed. multiprocessing and concurrent.futures are only imported
+    then too, as they add noticeably to the import time of this module.
+
+    :param workers: Number of worker processes
+    :param min_lines: Parse responses with fewer lines than this serially, since the
+                      overhead of sending the data to the workers and back is larger
+                      than the gain
+    """
+
+    def __init__(self, workers: int, min_lines: int):
+        self.workers = workers
+        self.min_lines = max(min_lines, 2)
+        self._executor: Optional["ProcessPoolExecutor"] = None
+        self._lock = threading.Lock()
+
+    def use_for(self, data: str) -> bool:
+        return data.count("\n") >= self.min_lines
+
+    def parse_rows(self, data: str) -> Iterator[List[str]]:
+        """Parse CSV lines without the legend, in haproxy order."""
+        with self._lock:
+            if self._executor is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            executor = self._executor
+        for chunk in executor.map(_parse_chunk, _split_chunks(data, self.workers)):
+            yield from _unpack_chunk(chunk)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def parse_status(
+    data: str, logger: logging.Logger, pool: Optional[ParsePool] = None
+) -> Optional[List[Site]]:
+    """
+    Parse the CSV output from haproxy 'show stat' into a Site instance per haproxy pxname.
+
+    :param pool: Parse large responses using this pool of worker processes
+    """
+    if not data.startswith("# "):
+        logger.error("Unknown status response from haproxy: %s", data)
+    rows: Optional[Iterable[List[str]]] = None
+    if pool is not None and pool.use_for(data):
+        legend, _sep, body = data.partition("\n")
+        if legend[-1:] == ",":
+            legend = legend[:-1]
+        try:
+            rows = list(pool.parse_rows(body))
+        except Exception as exc:
+            # already imported by the pool, if it got as far as starting the workers
+            from concurrent.futures.process import BrokenProcessPool
+
+            if not isinstance(exc, (OSError, BrokenProcessPool)):
+                raise
+            logger.warning("Parallel parsing failed, parsing serially: %s", exc)
+    if rows is None:
+        lines = _split_lines(data)
+        if len(lines) < 2:
+            logger.warning("haproxy did not return status for any backends: %s", data)
+            return None
+        legend = lines[0]
+        rows = _parse_rows(lines[1:])
     # The first line is the legend, e.g.
     # # pxname,svname,qcur,qmax,scur,smax,slim,stot,bin,bout,dreq,...,status,...
     fields = []
     unknown_index = 0
-    for field_name in lines[0][2:].split(","):
+    for field_name in legend[2:].split(","):
         if field_name == "-":
             # haproxy 2.4 suddenly has a field named '-' which isn't accepted by NamedTuple
             field_name = f"unknown{unknown_index}"
@@ -244,12 +570,12 @@ def get_status(stats_url: str, logger: logging.Logger) -> Optional[List[Site]]:
 
     # parse all the lines with real data
     res: Dict[str, Site] = {}
-    for values in csv.reader(lines[1:]):
+    for values in rows:
         try:
             _this = ParsedLine(*values)
             info = cast(SiteInfo, _this)
         except Exception as exc:
-            logger.warning("Bad CSV data: {!r}: {!s}".format(values, exc))
+            logger.warning("Bad CSV data: %r: %s", values, exc)
             continue
         # logger.debug('processing site {!r}'.format(this.pxname))
         site = res.get(info.pxname, Site(name=info.pxname))
@@ -0,0 +1,79 @@
+"""
+Tests for the haproxy agent-check responder.
+"""
+
+import logging
+import socket
+import unittest
+
+from haproxy_status.agent import AgentResponder, agent_reply
+from haproxy_status.app import MyState
+from haproxy_status.simulate import make_config
+from haproxy_status.tests.test_status import TEST_CONFIG, AppTests, make_site
+
+
+class AgentReplyTests(unittest.TestCase):
+    def test_replies(self):
+        self.assertEqual(agent_reply("STATUS_UP"), b"up\n")
+        self.assertEqual(agent_reply("STATUS_DOWN"), b"down\n")
+        self.assertEqual(agent_reply("STATUS_ADMIN_DOWN"), b"maint\n")
+        self.assertEqual(agent_reply("STATUS_UNKNOWN"), b"drain\n")
+        self.assertEqual(agent_reply("", 50), b"down 50%\n")
+
+
+class AgentWeightTests(unittest.TestCase):
+    def test_ignored_backends_not_weighted(self):
+        logger = logging.getLogger(__name__)
+        mystate = MyState(make_config({"BACKEND_EXCLUDE": "api__*"}), logger)
+        agent = AgentResponder(mystate, "127.0.0.1", 0, logger, weight=True)
+        mystate.register_hap_status(
+            [
+                make_site("www__default", lastchg="1000"),
+                make_site("api__default", backend_status="DOWN"),
+            ]
+        )
+        mystate.get_status()
+        self.assertEqual(agent.reply(), b"up 100%\n")
+
+
+class AgentResponderTests(AppTests):
+    def setUp(self, config=TEST_CONFIG):
+        config = dict(config)
+        config.update(
+            {"AGENT_PORT": 0, "AGENT_HOST": "127.0.0.1", "AGENT_WEIGHT": True}
+        )
+        super().setUp(config=config)
+        self.agent = self.app.agent
+        self.addCleanup(self.agent.stop, 5)
+
+    def _check(self):
+        with socket.create_connection(
+            ("127.0.0.1", self.agent.port), timeout=5
+        ) as sock:
+            return sock.recv(1024)
+
+    def test_no_data(self):
+        self.assertEqual(self._check(), b"drain 0%\n")
+        self.assertEqual(self.app.mystate.counters.get("agent_checks"), 1)
+
+    def test_follows_status(self):
+        mystate = self.app.mystate
+        mystate.register_hap_status(
+            [
+                make_site("www__default"),
+                make_site("api__default", backend_status="DOWN"),
+            ]
+        )
+        mystate.get_status()
+        self.assertEqual(self._check(), b"down 50%\n")
+
+        mystate.register_hap_status(
+            [make_site("www__default"), make_site("api__default")]
+        )
+        mystate.get_status()
+        self.assertEqual(self._check(), b"up 100%\n")
+
+    def test_reply_cached(self):
+        self.app.mystate.register_hap_status([make_site()])
+        self.app.mystate.get_status()
+        self.assertIs(self.agent.reply(), self.agent.reply())
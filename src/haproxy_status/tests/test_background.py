@@ -0,0 +1,82 @@
+"""
+Tests for the background threads.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+from haproxy_status.background import StatusFileWriter, StatusRefresher
+
+logger = logging.getLogger(__name__)
+
+
+class StatusFileWriterTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "status.txt")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_writes_file(self):
+        writer = StatusFileWriter(self.filename, logger, debounce=0)
+        writer.submit("STATUS_UP 1 backend UP\n")
+        self.assertTrue(writer.flush(5))
+        with open(self.filename) as fd:
+            self.assertEqual(fd.read(), "STATUS_UP 1 backend UP\n")
+
+    def test_rapid_changes_coalesced(self):
+        """Only the latest of changes submitted within the debounce time is written."""
+        writer = StatusFileWriter(self.filename, logger, debounce=0.2)
+        with patch("haproxy_status.background.atomic_write") as mock:
+            writer.submit("STATUS_DOWN\n")
+            writer.submit("STATUS_UP\n")
+            writer.submit("STATUS_DOWN\n")
+            self.assertTrue(writer.flush(5))
+        mock.assert_called_once_with(self.filename, b"STATUS_DOWN\n")
+
+    def test_write_error_logged(self):
+        writer = StatusFileWriter(
+            os.path.join(self.tmpdir.name, "missing", "status.txt"), logger, debounce=0
+        )
+        with self.assertLogs(logger, level="ERROR"):
+            writer.submit("STATUS_UP\n")
+            self.assertTrue(writer.flush(5))
+
+
+class StatusRefresherTests(unittest.TestCase):
+    def test_refreshes_periodically(self):
+        refreshed = threading.Event()
+        mystate = MagicMock()
+        mystate.get_status.side_effect = lambda: refreshed.set()
+
+        refresher = StatusRefresher(mystate, interval=0.01)
+        refresher.start()
+        self.assertTrue(refreshed.wait(5))
+        refresher.stop(5)
+
+        mystate.refresh_hap_status.assert_called()
+
+    def test_survives_exceptions(self):
+        calls = []
+        done = threading.Event()
+
+        def refresh():
+            calls.append(1)
+            if len(calls) >= 2:
+                done.set()
+            raise RuntimeError("haproxy exploded")
+
+        mystate = MagicMock()
+        mystate.logger = logger
+        mystate.refresh_hap_status.side_effect = refresh
+
+        refresher = StatusRefresher(mystate, interval=0.01)
+        with self.assertLogs(logger, level="ERROR"):
+            refresher.start()
+            self.assertTrue(done.wait(5))
+            refresher.stop(5)
@@ -0,0 +1,85 @@
+"""
+Tests for recording and replaying haproxy responses.
+"""
+
+import logging
+import os
+import tempfile
+import unittest
+
+import haproxy_status
+from haproxy_status.capture import CaptureWriter, read_capture, replay
+from haproxy_status.status import parse_status
+
+logger = logging.getLogger(__name__)
+
+SHOW_STAT_HEADER = (
+    "# pxname,svname,qcur,scur,status,act,chkfail,chkdown,lastchg,downtime,"
+    "last_chk,check_desc,addr,\n"
+)
+
+
+def show_stat(status="UP", lastchg=1000, chkdown=0):
+    return SHOW_STAT_HEADER + (
+        f"www__default,FRONTEND,,0,OPEN,,,,,,,,,\n"
+        f"www__default,server1,0,0,{status},1,0,{chkdown},{lastchg},0,,Layer4 check passed,10.0.0.1:443,\n"
+        f"www__default,BACKEND,0,0,{status},1,,{chkdown},{lastchg},0,,,,\n"
+    )
+
+
+class ParseStatusTests(unittest.TestCase):
+    def test_parse(self):
+        sites = parse_status(show_stat(), logger)
+        assert sites is not None
+        self.assertEqual(len(sites), 1)
+        self.assertEqual(sites[0].site_name, "www")
+        self.assertEqual(sites[0].group, "default")
+        self.assertEqual([x.svname for x in sites[0].servers], ["server1"])
+        self.assertEqual(sites[0].backend[0].status, "UP")
+
+
+class CaptureTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "capture.gz")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_roundtrip(self):
+        writer = CaptureWriter(self.filename, logger)
+        writer.record(show_stat(lastchg=10))
+        # a new writer (e.g. after a restart) appends to the same file
+        writer = CaptureWriter(self.filename, logger)
+        writer.record(show_stat(lastchg=25))
+
+        records = list(read_capture(self.filename))
+        self.assertEqual(
+            [r.data for r in records], [show_stat(lastchg=10), show_stat(lastchg=25)]
+        )
+        self.assertLessEqual(records[0].monotonic, records[1].monotonic)
+
+    def test_max_size(self):
+        writer = CaptureWriter(self.filename, logger, max_size=1)
+        writer.record(show_stat())
+        with self.assertLogs(logger, level="WARNING"):
+            writer.record(show_stat())
+        writer.record(show_stat())
+        self.assertEqual(writer.records, 1)
+        self.assertEqual(len(list(read_capture(self.filename))), 1)
+
+    def test_replay(self):
+        writer = CaptureWriter(self.filename, logger)
+        for lastchg in (1000, 1015):
+            writer.record(show_stat(lastchg=lastchg))
+        writer.record(show_stat(status="DOWN", lastchg=5, chkdown=1))
+        writer.record("")
+
+        app = haproxy_status.app.init_app(
+            "unittest_app",
+            {"BACKGROUND_REFRESH": False, "STATUS_OUTPUT_FILENAME": None},
+        )
+        stats = replay(self.filename, app.mystate, logger)
+        self.assertEqual(stats.polls, 4)
+        self.assertEqual(stats.status_changes, 2)
+        self.assertEqual(app.mystate.get_status()["status"], "STATUS_DOWN")
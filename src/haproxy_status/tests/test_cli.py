@@ -0,0 +1,158 @@
+"""
+Tests for the command line health check.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import haproxy_status
+from haproxy_status.cli import main
+from haproxy_status.status import Site
+
+
+class CliFileTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "status.txt")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _write(self, text):
+        with open(self.filename, "w") as fd:
+            fd.write(text)
+
+    def test_status_up(self):
+        self._write("STATUS_UP 2 backends UP\n")
+        self.assertEqual(main(["--file", self.filename, "--quiet"]), 0)
+
+    def test_status_down(self):
+        self._write("STATUS_DOWN 1/2 backends not UP: foo is DOWN (1m)\n")
+        self.assertEqual(main(["--file", self.filename, "--quiet"]), 1)
+
+    def test_missing_file(self):
+        self.assertEqual(main(["--file", self.filename, "--quiet"]), 1)
+
+    def test_filename_from_environment(self):
+        self._write("STATUS_UP 2 backends UP\n")
+        with patch.dict(os.environ, {"STATUS_OUTPUT_FILENAME": self.filename}):
+            self.assertEqual(main(["--quiet"]), 0)
+
+    def test_bad_arguments(self):
+        with patch("sys.stderr"):
+            self.assertEqual(main(["--nosuchoption"]), 1)
+
+
+class CliSocketTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        env = patch.dict(
+            os.environ, {"SIGNAL_DIRECTORY": self.tmpdir.name, "SERVICE_NAME": "www"}
+        )
+        env.start()
+        self.addCleanup(env.stop)
+
+    def _signal(self, name):
+        with open(os.path.join(self.tmpdir.name, name), "w"):
+            pass
+
+    def _sites(self, status):
+        site = Site("www__default")
+        site.add_parsed(
+            haproxy_status.status.SiteInfo(
+                pxname="www__default",
+                svname="BACKEND",
+                status=status,
+                lastchg="10",
+                act="1",
+                addr="",
+                check_desc="",
+                last_chk="",
+                chkfail="0",
+                chkdown="0",
+                downtime="0",
+            )
+        )
+        return [site]
+
+    def test_backends_up(self):
+        with patch("haproxy_status.status.get_status", return_value=self._sites("UP")):
+            self.assertEqual(main(["--socket", "/nonexistent", "--quiet"]), 0)
+
+    def test_backend_down(self):
+        with patch(
+            "haproxy_status.status.get_status", return_value=self._sites("DOWN")
+        ):
+            self.assertEqual(main(["--socket", "/nonexistent", "--quiet"]), 1)
+
+    def test_no_haproxy(self):
+        with patch("haproxy_status.status.get_status", return_value=None):
+            self.assertEqual(main(["--socket", "/nonexistent", "--quiet"]), 1)
+
+    def test_missing_socket_one_line(self):
+        """Only the status line, no logging of the connection error."""
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(haproxy_status.__file__))
+        res = subprocess.run(
+            [sys.executable, "-m", "haproxy_status.cli", "--socket", "/nonexistent"],
+            env=env,
+            capture_output=True,
+        )
+        self.assertEqual(res.returncode, 1)
+        self.assertEqual(res.stderr, b"")
+        self.assertEqual(
+            res.stdout, b"STATUS_UNKNOWN No backend data received from haproxy\n"
+        )
+
+    def test_admin_down(self):
+        for name in ("www", "common"):
+            with self.subTest(name=name):
+                self._signal(name)
+                with patch(
+                    "haproxy_status.status.get_status", return_value=self._sites("UP")
+                ):
+                    self.assertEqual(main(["--socket", "/nonexistent", "--quiet"]), 1)
+                os.unlink(os.path.join(self.tmpdir.name, name))
+
+    def test_other_service_admin_down(self):
+        self._signal("api")
+        with patch("haproxy_status.status.get_status", return_value=self._sites("UP")):
+            self.assertEqual(main(["--socket", "/nonexistent", "--quiet"]), 0)
+
+
+class CliImportTests(unittest.TestCase):
+    # milliseconds, for importing what the --socket check needs
+    IMPORT_BUDGET = 50
+
+    def test_no_heavy_imports(self):
+        """Importing the health check must not import Flask and friends."""
+        code = (
+            "import sys, haproxy_status.cli; "
+            "print(','.join(m for m in ('flask', 'werkzeug', 'yaml', 'pydantic', "
+            "'pydantic_settings', 'requests') if m in sys.modules))"
+        )
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(haproxy_status.__file__))
+        out = subprocess.check_output([sys.executable, "-c", code], env=env)
+        self.assertEqual(out.decode().strip(), "")
+
+    def test_socket_check_import_time(self):
+        """The --socket check imports haproxy_status.status, which has to stay cheap."""
+        code = (
+            "import time; t0 = time.perf_counter(); "
+            "import haproxy_status.cli, haproxy_status.status; "
+            "print(time.perf_counter() - t0)"
+        )
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(haproxy_status.__file__))
+        # the fastest of a few runs, to not fail on a busy machine
+        elapsed = min(
+            float(subprocess.check_output([sys.executable, "-c", code], env=env))
+            for _ in range(3)
+        )
+        self.assertLess(elapsed * 1000, self.IMPORT_BUDGET)
@@ -58,6 +58,22 @@ class SettingsDefaultsTests(unittest.TestCase):
         settings = Settings()
         self.assertEqual(settings.flapping_window, 300)
 
+    def test_fetch_haproxy_status_retry_interval_default(self):
+        settings = Settings()
+        self.assertEqual(settings.fetch_haproxy_status_retry_interval, 2)
+
+    def test_status_output_debounce_default(self):
+        settings = Settings()
+        self.assertEqual(settings.status_output_debounce, 0.5)
+
+    def test_history_size_default(self):
+        settings = Settings()
+        self.assertEqual(settings.history_size, 240)
+
+    def test_background_refresh_default(self):
+        settings = Settings()
+        self.assertTrue(settings.background_refresh)
+
 
 @patch.dict(os.environ, {}, clear=True)
 class SettingsEnvVarOverrideTests(unittest.TestCase):
@@ -92,6 +108,16 @@ class SettingsEnvVarOverrideTests(unittest.TestCase):
             settings = Settings()
             self.assertEqual(settings.service_name, "my-service")
 
+    def test_override_services(self):
+        """SERVICES is parsed from JSON."""
+        services = '{"web": {"include": "site:www"}, "api": {"exclude": "*-test"}}'
+        with patch.dict(os.environ, {"SERVICES": services}):
+            settings = Settings()
+            self.assertEqual(
+                settings.services,
+                {"web": {"include": "site:www"}, "api": {"exclude": "*-test"}},
+            )
+
     def test_override_fetch_interval(self):
         with patch.dict(os.environ, {"FETCH_HAPROXY_STATUS_INTERVAL": "30"}):
             settings = Settings()
@@ -129,6 +155,53 @@ class SettingsComputedHealthyBackendUptimeTests(unittest.TestCase):
             self.assertEqual(settings.healthy_backend_uptime, 50)
 
 
+@patch.dict(os.environ, {}, clear=True)
+class SettingsComputedMaxStatusStalenessTests(unittest.TestCase):
+    """Test that max_status_staleness is computed from fetch_haproxy_status_interval."""
+
+    def test_default_computed_value(self):
+        """Default: 15 * 4 = 60."""
+        settings = Settings()
+        self.assertEqual(settings.max_status_staleness, 60)
+
+    def test_computed_from_custom_fetch_interval(self):
+        with patch.dict(os.environ, {"FETCH_HAPROXY_STATUS_INTERVAL": "30"}):
+            settings = Settings()
+            self.assertEqual(settings.max_status_staleness, 120)
+
+    def test_explicit_override(self):
+        with patch.dict(os.environ, {"MAX_STATUS_STALENESS": "10"}):
+            settings = Settings()
+            self.assertEqual(settings.max_status_staleness, 10)
+
+    def test_computed_from_max_fetch_interval(self):
+        with patch.dict(os.environ, {"FETCH_HAPROXY_STATUS_INTERVAL_MAX": "120"}):
+            settings = Settings()
+            self.assertEqual(settings.max_status_staleness, 480)
+
+
+@patch.dict(os.environ, {}, clear=True)
+class SettingsComputedPollIntervalTests(unittest.TestCase):
+    """Test that the adaptive poll interval bounds default to the fixed interval."""
+
+    def test_default_computed_value(self):
+        settings = Settings()
+        self.assertEqual(settings.fetch_haproxy_status_interval_min, 15)
+        self.assertEqual(settings.fetch_haproxy_status_interval_max, 15)
+
+    def test_explicit_override(self):
+        with patch.dict(
+            os.environ,
+            {
+                "FETCH_HAPROXY_STATUS_INTERVAL_MIN": "5",
+                "FETCH_HAPROXY_STATUS_INTERVAL_MAX": "60",
+            },
+        ):
+            settings = Settings()
+            self.assertEqual(settings.fetch_haproxy_status_interval_min, 5)
+            self.assertEqual(settings.fetch_haproxy_status_interval_max, 60)
+
+
 @patch.dict(os.environ, {}, clear=True)
 class DeprecatedEnvVarTests(unittest.TestCase):
     """Test that haproxy_status_SETTINGS env var triggers a deprecation warning."""
@@ -141,6 +214,7 @@ class DeprecatedEnvVarTests(unittest.TestCase):
             with warnings.catch_warnings(record=True) as w:
                 warnings.simplefilter("always")
                 app = haproxy_status.app.init_app("test_deprecation")
+                self.addCleanup(app.status_refresher.stop)
                 deprecation_warnings = [
                     x for x in w if issubclass(x.category, DeprecationWarning)
                 ]
@@ -156,6 +230,7 @@ class DeprecatedEnvVarTests(unittest.TestCase):
         with warnings.catch_warnings(record=True) as w:
             warnings.simplefilter("always")
             app = haproxy_status.app.init_app("test_no_deprecation")
+            self.addCleanup(app.status_refresher.stop)
             deprecation_warnings = [
                 x for x in w if issubclass(x.category, DeprecationWarning)
             ]
@@ -171,6 +246,7 @@ class FlaskConfigIntegrationTests(unittest.TestCase):
         import haproxy_status
 
         app = haproxy_status.app.init_app("test_flask_config")
+        self.addCleanup(app.status_refresher.stop)
         self.assertEqual(app.config["LOG_LEVEL"], "INFO")
         self.assertEqual(app.config["STATS_URL"], "/var/run/haproxy-control/stats")
         self.assertEqual(app.config["LOG_DOWN_INTERVAL"], 180)
@@ -187,6 +263,7 @@ class FlaskConfigIntegrationTests(unittest.TestCase):
             import haproxy_status
 
             app = haproxy_status.app.init_app("test_flask_env")
+            self.addCleanup(app.status_refresher.stop)
             self.assertEqual(app.config["LOG_LEVEL"], "DEBUG")
             self.assertEqual(app.config["LOG_DOWN_INTERVAL"], 500)
 
@@ -197,4 +274,5 @@ class FlaskConfigIntegrationTests(unittest.TestCase):
         app = haproxy_status.app.init_app(
             "test_flask_override", config={"LOG_LEVEL": "WARNING"}
         )
+        self.addCleanup(app.status_refresher.stop)
         self.assertEqual(app.config["LOG_LEVEL"], "WARNING")
@@ -0,0 +1,112 @@
+"""
+Tests for the per-server detail view.
+"""
+
+import json
+import logging
+import unittest
+from unittest.mock import patch
+
+from werkzeug.exceptions import BadRequest
+
+from haproxy_status.detail import encode_detail, parse_fields, select_rows
+from haproxy_status.simulate import FakeClock, Fleet
+from haproxy_status.status import parse_status
+from haproxy_status.tests.test_status import AppTests, make_site
+
+logger = logging.getLogger(__name__)
+
+
+def _decode(chunks):
+    return json.loads(b"".join(chunks))
+
+
+class EncodeDetailTests(unittest.TestCase):
+    def setUp(self):
+        clock = FakeClock()
+        fleet = Fleet(clock(), backends=3, servers=3, flappy=0, seed=1)
+        clock.advance(100)
+        sites = parse_status(fleet.show_stat(clock()), logger)
+        assert sites is not None
+        self.sites = sites
+
+    def test_all_rows(self):
+        res = _decode(encode_detail(select_rows(self.sites), ["svname"], 1000))
+        self.assertEqual(res["update_time"], 1000)
+        # three servers and a BACKEND row per backend
+        self.assertEqual(res["total"], 12)
+        self.assertEqual(len(res["servers"]), 12)
+        self.assertEqual(res["servers"][3], {"svname": "BACKEND"})
+        self.assertIsNone(res["next_offset"])
+
+    def test_pages(self):
+        rows = select_rows(self.sites)
+        res = _decode(encode_detail(rows, ["pxname"], None, offset=5, limit=5))
+        self.assertEqual(len(res["servers"]), 5)
+        self.assertEqual((res["total"], res["next_offset"]), (12, 10))
+
+        res = _decode(encode_detail(select_rows(self.sites), ["pxname"], None, 10, 5))
+        self.assertEqual(len(res["servers"]), 2)
+        self.assertIsNone(res["next_offset"])
+
+    def test_projection(self):
+        rows = select_rows(self.sites)
+        res = _decode(encode_detail(rows, ["lastchg", "nosuchfield", "count"], None))
+        # unknown fields, and attributes that aren't CSV fields, are null
+        self.assertEqual(
+            res["servers"][0], {"lastchg": "100", "nosuchfield": None, "count": None}
+        )
+
+    def test_streamed_in_chunks(self):
+        with patch("haproxy_status.detail.CHUNK_SIZE", 100):
+            chunks = list(encode_detail(select_rows(self.sites), ["pxname"], None))
+        self.assertGreater(len(chunks), 3)
+        self.assertEqual(_decode(chunks)["total"], 12)
+
+    def test_filters(self):
+        rows = list(select_rows(self.sites, backends="site1__*, site:site2"))
+        self.assertEqual({x.pxname for x in rows}, {"site1__default", "site2__default"})
+        rows = list(select_rows(self.sites, statuses="UP"))
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(list(select_rows(self.sites, statuses="DOWN,MAINT")), [])
+
+    def test_parse_fields(self):
+        self.assertEqual(parse_fields("addr, status"), ["addr", "status"])
+        self.assertIn("check_desc", parse_fields(None))
+        for bad in ("__class__", "a-b"):
+            with self.assertRaises(ValueError):
+                parse_fields(bad)
+
+
+class DetailViewTests(AppTests):
+    def test_detail(self):
+        self.app.mystate.register_hap_status(
+            [
+                make_site(name="www__default"),
+                make_site(
+                    name="api__default",
+                    servers={"api1": {"status": "DOWN"}, "api2": {}},
+                    backend_status="UP",
+                ),
+            ]
+        )
+        response = self.client.get("/status/detail?status=DOWN&fields=pxname,svname")
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertEqual(
+            response.json["servers"], [{"pxname": "api__default", "svname": "api1"}]
+        )
+
+        response = self.client.get("/status/detail?backend=site:www&limit=1")
+        self.assertEqual(response.json["servers"][0]["addr"], "127.0.0.1:8080")
+        self.assertEqual(response.json["next_offset"], 1)
+
+    def test_no_data(self):
+        response = self.client.get("/status/detail")
+        self.assertEqual(response.json["servers"], [])
+        self.assertIsNone(response.json["update_time"])
+
+    def test_bad_request(self):
+        for query in ("fields=__dict__", "limit=0", "offset=-1"):
+            with self.assertRaises(BadRequest):
+                self.client.get("/status/detail?" + query)
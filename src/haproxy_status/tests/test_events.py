@@ -0,0 +1,122 @@
+"""
+Tests for exporting structured events.
+"""
+
+import json
+import logging
+import os
+import socket
+import tempfile
+import unittest
+from typing import Any, Dict, List
+
+from haproxy_status.app import MyState
+from haproxy_status.events import EventExporter, pack_datagrams, parse_target
+from haproxy_status.simulate import FakeClock, make_config
+from haproxy_status.tests.test_status import make_site
+from haproxy_status.util import Counters
+
+logger = logging.getLogger(__name__)
+
+
+class ParseTargetTests(unittest.TestCase):
+    def test_udp(self):
+        self.assertEqual(
+            parse_target("udp://127.0.0.1:8125"), (socket.AF_INET, ("127.0.0.1", 8125))
+        )
+
+    def test_unix(self):
+        self.assertEqual(
+            parse_target("unix:///run/events.sock"),
+            (socket.AF_UNIX, "/run/events.sock"),
+        )
+
+    def test_bad(self):
+        for target in ("tcp://127.0.0.1:1", "udp://127.0.0.1", "/run/events.sock"):
+            with self.assertRaises(ValueError):
+                parse_target(target)
+
+    def test_pack_datagrams(self):
+        lines = [b"a" * 4 + b"\n"] * 5
+        self.assertEqual(
+            pack_datagrams(lines, max_size=10), [lines[0] * 2, lines[0] * 2, lines[0]]
+        )
+
+
+class SinkTests(unittest.TestCase):
+    """Base TestCase for tests that need a UDP socket to send events to"""
+
+    def setUp(self):
+        self.sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sink.bind(("127.0.0.1", 0))
+        self.sink.settimeout(5)
+        self.target = "udp://127.0.0.1:{}".format(self.sink.getsockname()[1])
+        self.counters = Counters()
+
+    def tearDown(self):
+        self.sink.close()
+
+    def _received(self):
+        return [json.loads(x) for x in self.sink.recv(65536).splitlines()]
+
+
+class EventExporterTests(SinkTests):
+    def test_events_sent_as_json_lines(self):
+        exporter = EventExporter(self.target, logger, self.counters)
+        exporter.emit("status_changed", 1000.0, old="STATUS_UP", new="STATUS_DOWN")
+        exporter.emit("status_changed", 1001.0, old="STATUS_DOWN", new="STATUS_UP")
+        self.assertTrue(exporter.flush(5))
+        received = self._received()
+        while len(received) < 2:
+            received += self._received()
+        self.assertEqual(received[0]["event"], "status_changed")
+        self.assertEqual(received[0]["ts"], 1000.0)
+        self.assertEqual(received[1]["new"], "STATUS_UP")
+        self.assertEqual(self.counters.get("events_sent"), 2)
+
+    def test_full_queue_drops(self):
+        exporter = EventExporter(self.target, logger, self.counters, queue_size=0)
+        exporter.emit("status_changed", 1000.0)
+        self.assertEqual(self.counters.get("events_dropped"), 1)
+
+    def test_missing_sink_drops(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            target = "unix://" + os.path.join(tmpdir, "nobody-listening")
+            exporter = EventExporter(target, logger, self.counters)
+            exporter.emit("status_changed", 1000.0)
+            self.assertTrue(exporter.flush(5))
+        self.assertEqual(self.counters.get("events_dropped"), 1)
+        self.assertEqual(self.counters.get("events_sent"), 0)
+
+
+class MyStateEventTests(SinkTests):
+    def test_transitions_exported(self):
+        clock = FakeClock()
+        mystate = MyState(
+            make_config({"EVENTS_TARGET": self.target, "FLAPPING_THRESHOLD": 2}),
+            logger,
+            clock=clock,
+        )
+        mystate.register_hap_status([make_site(chkdown="0")])
+        mystate.get_status()
+        clock.advance(10)
+        mystate.register_hap_status([make_site(status="DOWN", chkdown="2")])
+        mystate.get_status()
+        assert mystate.events is not None
+        self.assertTrue(mystate.events.flush(5))
+
+        events: List[Dict[str, Any]] = []
+        while len(events) < 4:
+            events += self._received()
+        by_type = {x["event"]: x for x in events}
+        self.assertEqual(
+            sorted(by_type),
+            ["server_flapping", "server_status_changed", "status_changed"],
+        )
+        changed = by_type["server_status_changed"]
+        self.assertEqual(
+            (changed["site"], changed["server"], changed["old"], changed["new"]),
+            ("test_backend", "server1", "UP", "DOWN"),
+        )
+        self.assertEqual(changed["ts"], int(clock()))
+        self.assertEqual(by_type["server_flapping"]["transitions"], 2)
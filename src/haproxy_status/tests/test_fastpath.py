@@ -0,0 +1,57 @@
+"""
+Tests for answering /ping and /status without going through Flask.
+"""
+
+from unittest.mock import patch
+
+import haproxy_status
+from haproxy_status.fastpath import FastPath
+from haproxy_status.tests.test_status import TEST_CONFIG, AppTests, make_site
+
+
+class FastPathTests(AppTests):
+    def setUp(self, config=TEST_CONFIG):
+        config = dict(config)
+        config.update({"FAST_PATH": True, "STATUS_OUTPUT_FILENAME": None})
+        super().setUp(config=config)
+        # the same app without the fast path, to compare the responses with
+        config["FAST_PATH"] = False
+        self.flask_app = haproxy_status.app.init_app("unittest_flask_app", config)
+        for this in (self.app, self.flask_app):
+            this.mystate.register_hap_status([make_site()])
+
+    def test_installed(self):
+        self.assertIsInstance(self.app.wsgi_app, FastPath)
+        self.assertNotIsInstance(self.flask_app.wsgi_app, FastPath)
+
+    def test_same_responses_as_flask(self):
+        for method, path in [("get", "/ping"), ("post", "/ping"), ("get", "/status")]:
+            fast = getattr(self.client, method)(path)
+            slow = getattr(self.flask_app.test_client(), method)(path)
+            self.assertEqual(fast.status_code, slow.status_code)
+            self.assertEqual(fast.data, slow.data)
+            self.assertEqual(fast.headers["Content-Type"], slow.headers["Content-Type"])
+            self.assertEqual(
+                fast.headers["Content-Length"], slow.headers["Content-Length"]
+            )
+
+    def test_status(self):
+        # the ttl in the response changes as time passes
+        now = self.app.mystate.clock()
+        self.app.mystate.clock = lambda: now
+        response = self.client.get("/status")
+        self.assertEqual(response.json["status"], "STATUS_UP")
+        body = self.app.wsgi_app._last[1]
+        # served from the encoded response while the status is the same
+        self.assertEqual(self.client.get("/status").data, body)
+        self.assertIs(self.app.wsgi_app._last[1], body)
+
+    def test_admin_down_404(self):
+        with patch.object(self.app.mystate, "is_admin_down", return_value=True):
+            response = self.client.get("/status")
+        self.assertEqual(response.status_code, 404)
+
+    def test_other_endpoints_passed_on(self):
+        response = self.client.get("/counters")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("requests_admitted_in_flight", response.json)
@@ -0,0 +1,245 @@
+"""
+Tests for talking to haproxy.
+"""
+
+import http.server
+import importlib.util
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from haproxy_status.capture import CaptureWriter, read_capture
+from haproxy_status.status import (
+    CircuitBreaker,
+    HAProxyStatusError,
+    HAProxyTimeouts,
+    ParsePool,
+    _parse_chunk,
+    _split_chunks,
+    _unpack_chunk,
+    haproxy_execute,
+    parse_status,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class FakeClock(object):
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(
+            threshold=3, backoff=5, backoff_max=20, clock=self.clock
+        )
+
+    def test_opens_after_threshold(self):
+        self.assertFalse(self.breaker.record_failure())
+        self.assertFalse(self.breaker.record_failure())
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.record_failure())
+        self.assertEqual(self.breaker.state, "open")
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_after_backoff(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.clock.now += 5
+        self.assertEqual(self.breaker.state, "half-open")
+        self.assertTrue(self.breaker.allow())
+
+    def test_success_closes(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.clock.now += 5
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, "closed")
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_failed_trial_doubles_backoff(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        for expected in (10, 20, 20):
+            self.clock.now += 100
+            self.assertTrue(self.breaker.record_failure())
+            self.clock.now += expected - 0.1
+            self.assertFalse(self.breaker.allow())
+            self.clock.now += 0.1
+            self.assertTrue(self.breaker.allow())
+
+
+class HAProxyExecuteTests(unittest.TestCase):
+    """Test the AF_UNIX socket path of haproxy_execute against a fake haproxy."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.socket_fn = os.path.join(self.tmpdir.name, "stats")
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_fn)
+        self.server.listen(1)
+
+    def tearDown(self):
+        self.server.close()
+        self.tmpdir.cleanup()
+
+    def _serve(self, response: bytes, delay: float = 0):
+        def serve():
+            conn, _ = self.server.accept()
+            with conn:
+                conn.recv(1024)
+                time.sleep(delay)
+                try:
+                    conn.sendall(response)
+                except BrokenPipeError:
+                    # the client gave up waiting
+                    pass
+
+        t = threading.Thread(target=serve, daemon=True)
+        t.start()
+        return t
+
+    def test_reads_response(self):
+        self._serve(b"# pxname,svname\nfoo,BACKEND\n")
+        data = haproxy_execute("show stat", self.socket_fn, logger)
+        self.assertEqual(data, "# pxname,svname\nfoo,BACKEND\n")
+
+    def test_records_response(self):
+        self._serve(b"# pxname,svname\nfoo,BACKEND\n")
+        capture_fn = os.path.join(self.tmpdir.name, "capture.gz")
+        recorder = CaptureWriter(capture_fn, logger)
+        haproxy_execute("show stat", self.socket_fn, logger, recorder=recorder)
+        records = list(read_capture(capture_fn))
+        self.assertEqual([r.data for r in records], ["# pxname,svname\nfoo,BACKEND\n"])
+
+    def test_read_deadline(self):
+        """A wedged haproxy should not block for longer than the total deadline."""
+        self._serve(b"", delay=2)
+        t0 = time.monotonic()
+        data = haproxy_execute(
+            "show stat",
+            self.socket_fn,
+            logger,
+            HAProxyTimeouts(connect=0.1, total=0.2),
+        )
+        self.assertIsNone(data)
+        self.assertLess(time.monotonic() - t0, 1)
+
+    def test_missing_socket(self):
+        data = haproxy_execute("show stat", self.socket_fn + ".missing", logger)
+        self.assertIsNone(data)
+
+
+class TricklingHandler(http.server.BaseHTTPRequestHandler):
+    """Send a response one line at a time, with a delay before each line."""
+
+    lines = [b"# pxname,svname\n", b"foo,BACKEND\n"]
+    delay = 0.0
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.end_headers()
+        for line in self.lines:
+            time.sleep(self.delay)
+            try:
+                self.wfile.write(line)
+                self.wfile.flush()
+            except BrokenPipeError:
+                # the client gave up waiting
+                return
+
+    def log_message(self, format, *args):
+        pass
+
+
+@unittest.skipUnless(importlib.util.find_spec("requests"), "requests not installed")
+class HAProxyExecuteHTTPTests(unittest.TestCase):
+    """Test the HTTP path of haproxy_execute against a fake haproxy."""
+
+    def _serve(self, delay: float = 0):
+        handler = type("Handler", (TricklingHandler,), {"delay": delay})
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return "http://127.0.0.1:{}/stats;csv".format(server.server_port)
+
+    def test_reads_response(self):
+        data = haproxy_execute("show stat", self._serve(), logger)
+        self.assertEqual(data, "# pxname,svname\nfoo,BACKEND\n")
+
+    def test_total_deadline(self):
+        """A response trickling in slower than the total deadline is given up on."""
+        url = self._serve(delay=0.3)
+        t0 = time.monotonic()
+        with self.assertRaises(HAProxyStatusError):
+            haproxy_execute(
+                "show stat", url, logger, HAProxyTimeouts(connect=0.5, total=0.4)
+            )
+        self.assertLess(time.monotonic() - t0, 0.8)
+
+    def test_http_error_raised_as_status_error(self):
+        with self.assertRaises(HAProxyStatusError):
+            haproxy_execute("show stat", "http://127.0.0.1:1/stats;csv", logger)
+
+
+SHOW_STAT = (
+    "# pxname,svname,status,lastchg,check_desc,\n"
+    + "".join(
+        "www__default,server{},UP,{},Layer7 check passed,\n".format(i, i)
+        for i in range(20)
+    )
+    + 'www__default,server20,DOWN,5,"Layer7 wrong status, 503",\n'
+    + "www__default,BACKEND,UP,100,,\n"
+)
+
+
+class ParseStatusTests(unittest.TestCase):
+    def _rows(self, sites):
+        return [tuple(x) for site in sites for x in site.servers + site.backend]
+
+    def test_quoted_values(self):
+        sites = parse_status(SHOW_STAT, logger)
+        assert sites is not None
+        self.assertEqual(sites[0].servers[20].check_desc, "Layer7 wrong status, 503")
+        self.assertEqual(sites[0].backend[0].check_desc, "")
+
+    def test_split_chunks(self):
+        data = "".join("line{}\n".format(i) for i in range(10))
+        chunks = _split_chunks(data, 3)
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual("\n".join(chunks), data)
+
+    def test_unusual_characters_in_chunk(self):
+        data = "a,b\x1fc\nd,e\n"
+        self.assertEqual(
+            _unpack_chunk(_parse_chunk(data)), [["a", "b\x1fc"], ["d", "e"]]
+        )
+
+    def test_parallel_same_as_serial(self):
+        pool = ParsePool(2, min_lines=10)
+        self.addCleanup(pool.shutdown)
+        serial = parse_status(SHOW_STAT, logger)
+        parallel = parse_status(SHOW_STAT, logger, pool)
+        assert serial is not None and parallel is not None
+        self.assertEqual([x.name for x in parallel], ["www__default"])
+        self.assertEqual(self._rows(parallel), self._rows(serial))
+        self.assertEqual(len(parallel[0].servers), 21)
+
+    def test_small_response_parsed_serially(self):
+        pool = ParsePool(2, min_lines=1000)
+        sites = parse_status(SHOW_STAT, logger, pool)
+        assert sites is not None
+        self.assertEqual(len(sites[0].servers), 21)
+        self.assertIsNone(pool._executor)
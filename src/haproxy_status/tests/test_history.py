@@ -0,0 +1,97 @@
+"""
+Tests for the status history ring buffers.
+"""
+
+import unittest
+
+from haproxy_status.history import (
+    STATUS_CODES,
+    History,
+    RingBuffer,
+    downsample,
+    status_code,
+)
+
+UP = STATUS_CODES["UP"]
+DOWN = STATUS_CODES["DOWN"]
+MAINT = STATUS_CODES["MAINT"]
+
+
+class StatusCodeTests(unittest.TestCase):
+    def test_known_statuses(self):
+        self.assertEqual(status_code("UP"), UP)
+        self.assertEqual(status_code("DOWN"), DOWN)
+        self.assertEqual(status_code("no check"), STATUS_CODES["no check"])
+
+    def test_transitional_statuses(self):
+        self.assertEqual(status_code("UP 1/3"), UP)
+        self.assertEqual(status_code("DOWN 1/2"), DOWN)
+        self.assertEqual(status_code("MAINT(via)"), MAINT)
+
+    def test_unknown_status(self):
+        self.assertEqual(status_code("WHATEVER"), STATUS_CODES["UNKNOWN"])
+
+
+class RingBufferTests(unittest.TestCase):
+    def test_iterates_oldest_first(self):
+        buf = RingBuffer(5)
+        for ts in range(3):
+            buf.append(ts, UP)
+        self.assertEqual([ts for ts, _ in buf], [0, 1, 2])
+
+    def test_overwrites_oldest(self):
+        buf = RingBuffer(3)
+        for ts in range(10):
+            buf.append(ts, UP if ts % 2 else DOWN)
+        self.assertEqual(len(buf), 3)
+        self.assertEqual(list(buf), [(7, UP), (8, DOWN), (9, UP)])
+        self.assertEqual(buf.last_code, UP)
+
+    def test_since(self):
+        buf = RingBuffer(10)
+        for ts in range(10):
+            buf.append(ts, UP)
+        self.assertEqual([ts for ts, _ in buf.since(7)], [7, 8, 9])
+
+    def test_copy_is_independent(self):
+        buf = RingBuffer(3)
+        for ts in range(4):
+            buf.append(ts, UP)
+        copy = buf.copy()
+        buf.append(4, DOWN)
+        self.assertEqual(list(copy), [(1, UP), (2, UP), (3, UP)])
+        self.assertEqual(list(buf), [(2, UP), (3, UP), (4, DOWN)])
+
+    def test_zero_size(self):
+        buf = RingBuffer(0)
+        buf.append(1, UP)
+        self.assertEqual(list(buf), [])
+        self.assertIsNone(buf.last_code)
+
+
+class HistoryTests(unittest.TestCase):
+    def test_records_transitions(self):
+        history = History(size=100, transitions_size=10)
+        for ts, status in [
+            (0, "UP"),
+            (15, "UP"),
+            (30, "DOWN"),
+            (45, "DOWN"),
+            (60, "UP"),
+        ]:
+            history.record("site", "server1", ts, status)
+        hist = history.get("site", "server1")
+        assert hist is not None
+        self.assertEqual(len(hist.samples), 5)
+        self.assertEqual(list(hist.transitions), [(0, UP), (30, DOWN), (60, UP)])
+
+    def test_disabled(self):
+        history = History(size=0, transitions_size=10)
+        history.record("site", "server1", 0, "UP")
+        self.assertIsNone(history.get("site", "server1"))
+
+    def test_downsample_keeps_worst(self):
+        samples = [(0, UP), (15, DOWN), (30, UP), (60, UP), (75, MAINT), (120, UP)]
+        self.assertEqual(
+            downsample(iter(samples), 60), [(0, DOWN), (60, MAINT), (120, UP)]
+        )
@@ -0,0 +1,143 @@
+"""
+Tests for keeping the memory use of long running instances bounded.
+"""
+
+import logging
+import tracemalloc
+import unittest
+
+from werkzeug.exceptions import BadRequest, NotFound
+
+from haproxy_status.app import MyState, init_app
+from haproxy_status.simulate import FakeClock, Fleet, make_config, simulate
+from haproxy_status.tests.test_status import TEST_CONFIG, AppTests, make_site
+
+# weeks of polling would log far too much
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+
+class ForgetRemovedTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.config = make_config({"FORGET_REMOVED_AFTER": 600, "SERVICES": {"x": {}}})
+        self.mystate = MyState(self.config, logger, clock=self.clock)
+
+    def test_removed_site_forgotten(self):
+        self.mystate.register_hap_status([make_site(), make_site(name="old_backend")])
+        self.mystate.get_status()
+        self.mystate.get_service_status("x")
+        self.assertEqual(self.mystate.state_sizes()["rules_cache"], 4)
+
+        self.clock.advance(600)
+        self.mystate.register_hap_status([make_site()])
+        self.assertIn("old_backend", self.mystate._hap_status)
+
+        self.clock.advance(1)
+        self.mystate.register_hap_status([make_site()])
+        self.assertNotIn("old_backend", self.mystate._hap_status)
+        self.assertIsNone(self.mystate.history.get("old_backend", "server1"))
+        self.assertEqual(
+            self.mystate.state_sizes(),
+            {
+                "sites": 1,
+                "servers": 2,
+                "transitions": 0,
+                "history_servers": 2,
+                "rules_cache": 2,
+            },
+        )
+
+    def test_removed_server_forgotten(self):
+        self.mystate.register_hap_status(
+            [make_site(servers={"server1": {}, "server2": {}})]
+        )
+        self.clock.advance(601)
+        self.mystate.register_hap_status([make_site()])
+        self.assertEqual(
+            sorted(self.mystate._hap_status["test_backend"]), ["BACKEND", "server1"]
+        )
+
+    def test_site_not_in_empty_poll_kept(self):
+        """An empty response from haproxy doesn't make us forget everything at once."""
+        self.mystate.register_hap_status([make_site()])
+        self.clock.advance(10)
+        self.mystate.register_hap_status([])
+        self.assertEqual(self.mystate.get_status()["status"], "STATUS_UP")
+
+
+class SoakTests(unittest.TestCase):
+    def test_memory_bounded_with_churning_backends(self):
+        """Three weeks of polling every ten minutes, replacing a backend every hour."""
+        clock = FakeClock()
+        fleet = Fleet(clock(), backends=5, servers=2, flappy=0.2, seed=1)
+        config = make_config({"HISTORY_SIZE": 60, "FORGET_REMOVED_AFTER": 3600})
+        mystate = MyState(config, logger, clock=clock)
+
+        def run_week():
+            simulate(
+                mystate, clock, fleet, polls=7 * 24 * 6, interval=600, churn_every=6
+            )
+
+        run_week()
+        tracemalloc.start()
+        try:
+            run_week()
+            sizes = mystate.state_sizes()
+            before, _peak = tracemalloc.get_traced_memory()
+            run_week()
+            after, _peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        # the sites replaced during the last hour are not forgotten yet
+        self.assertLessEqual(sizes["sites"], 5 + 2)
+        self.assertLessEqual(sizes["history_servers"], (5 + 2) * 3)
+        self.assertLessEqual(sizes["rules_cache"], 5 + 2)
+        for key in ("sites", "servers", "history_servers", "rules_cache"):
+            self.assertEqual(mystate.state_sizes()[key], sizes[key])
+        self.assertLess(after - before, 16 * 1024)
+
+
+class DebugMemoryTests(AppTests):
+    def setUp(self, config=TEST_CONFIG):
+        config = dict(config)
+        config.update({"DEBUG_MEMORY": True, "STATUS_OUTPUT_FILENAME": None})
+        super().setUp(config=config)
+        self.addCleanup(tracemalloc.stop)
+
+    def test_disabled_by_default(self):
+        app = init_app("unittest_app", TEST_CONFIG)
+        with self.assertRaises(NotFound):
+            app.test_client().get("/debug/memory")
+
+    def test_report(self):
+        self.app.mystate.register_hap_status([make_site()])
+        # tracemalloc is started by the first request
+        response = self.client.get("/debug/memory")
+        self.assertEqual(response.json["growth"], [])
+        self.assertGreaterEqual(response.json["objects"]["MyState"], 1)
+        self.assertEqual(response.json["state"]["servers"], 2)
+
+        # the next report shows what has grown since the previous one
+        leak = [bytearray(1000) for _ in range(100)]
+        response = self.client.get("/debug/memory?limit=3")
+        self.assertEqual(len(response.json["top"]), 3)
+        self.assertTrue(
+            any(x["size_diff"] >= 100 * 1000 for x in response.json["growth"])
+        )
+        del leak
+
+    def test_stop(self):
+        self.client.get("/debug/memory")
+        self.assertTrue(tracemalloc.is_tracing())
+        response = self.client.get("/debug/memory?stop=1")
+        self.assertEqual(response.json, {"tracing": False})
+        self.assertFalse(tracemalloc.is_tracing())
+        # tracing starts over, without comparing to the report from before the stop
+        response = self.client.get("/debug/memory")
+        self.assertEqual(response.json["growth"], [])
+
+    def test_bad_key_type(self):
+        with self.assertRaises(BadRequest):
+            self.client.get("/debug/memory?key_type=bogus")
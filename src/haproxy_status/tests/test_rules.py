@@ -0,0 +1,97 @@
+"""
+Tests for the backend selection rules.
+"""
+
+import unittest
+
+from haproxy_status.rules import (
+    IGNORED,
+    OPTIONAL,
+    REQUIRED,
+    BackendRules,
+    PatternSet,
+    parse_patterns,
+)
+from haproxy_status.tests.test_status import TEST_CONFIG, AppTests, make_site
+
+
+class PatternTests(unittest.TestCase):
+    def test_parse_patterns(self):
+        self.assertEqual(parse_patterns(None), [])
+        self.assertEqual(parse_patterns(" a, b  c,,"), ["a", "b", "c"])
+
+    def test_match(self):
+        patterns = PatternSet(
+            ["www__default", "*-test__*", "site:stats", "group:fail*"]
+        )
+        self.assertTrue(patterns.match("www__default"))
+        self.assertFalse(patterns.match("www__new"))
+        self.assertTrue(patterns.match("api-test__default"))
+        self.assertTrue(patterns.match("stats__default"))
+        self.assertFalse(patterns.match("stats2__default"))
+        self.assertTrue(patterns.match("www__failpage"))
+        # no group in the pxname
+        self.assertFalse(patterns.match("failpage"))
+
+    def test_empty(self):
+        self.assertTrue(PatternSet([]).empty)
+        self.assertFalse(PatternSet([]).match("www__default"))
+
+
+class BackendRulesTests(unittest.TestCase):
+    def test_default_all_required(self):
+        self.assertEqual(BackendRules().classify("www__default"), REQUIRED)
+
+    def test_classify(self):
+        rules = BackendRules(
+            include="site:www site:api site:stats",
+            exclude="group:failpage",
+            optional="site:stats",
+        )
+        self.assertEqual(rules.classify("www__default"), REQUIRED)
+        self.assertEqual(rules.classify("stats__default"), OPTIONAL)
+        self.assertEqual(rules.classify("www__failpage"), IGNORED)
+        self.assertEqual(rules.classify("other__default"), IGNORED)
+
+    def test_cached(self):
+        rules = BackendRules(exclude="*-test")
+        self.assertEqual(rules.classify("www-test"), IGNORED)
+        self.assertEqual(rules._cache, {"www-test": IGNORED})
+
+
+class RulesStatusTests(AppTests):
+    def setUp(self, config=TEST_CONFIG):
+        config = dict(config)
+        config.update(
+            {
+                "BACKEND_EXCLUDE": "group:failpage",
+                "BACKEND_OPTIONAL": "site:stats",
+                "HEALTHY_BACKEND_UPTIME": 0,
+            }
+        )
+        super().setUp(config=config)
+
+    def test_ignored_and_optional_backends(self):
+        self.app.mystate.register_hap_status(
+            [
+                make_site("www__default"),
+                make_site("www__failpage", backend_status="DOWN"),
+                make_site("stats__default", backend_status="DOWN"),
+            ]
+        )
+        res = self.app.mystate.get_status()
+        self.assertEqual(res["status"], "STATUS_UP")
+        self.assertTrue(res["reason"].startswith("1 backend UP, optional backends"))
+        self.assertIn("stats__default is DOWN", res["reason"])
+        self.assertNotIn("failpage", res["reason"])
+
+    def test_required_backend_down(self):
+        self.app.mystate.register_hap_status(
+            [
+                make_site("www__default", backend_status="DOWN"),
+                make_site("stats__default"),
+            ]
+        )
+        res = self.app.mystate.get_status()
+        self.assertEqual(res["status"], "STATUS_DOWN")
+        self.assertTrue(res["reason"].startswith("1/2 backends not UP"))
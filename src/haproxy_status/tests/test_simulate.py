@@ -0,0 +1,88 @@
+"""
+Tests for running MyState on a virtual clock.
+"""
+
+import logging
+import os
+import unittest
+from unittest.mock import patch
+
+from haproxy_status.app import MyState
+from haproxy_status.simulate import FakeClock, Fleet, make_config, simulate
+from haproxy_status.status import parse_status
+from haproxy_status.tests.test_status import make_site
+
+logger = logging.getLogger(__name__)
+
+
+class FakeClockTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.config = make_config({"FLAPPING_WINDOW": 300, "FLAPPING_THRESHOLD": 2})
+        self.mystate = MyState(self.config, logger, clock=self.clock)
+
+    def test_flapping_expires_with_the_clock(self):
+        self.mystate.register_hap_status([make_site(chkdown="0")])
+        self.clock.advance(10)
+        self.mystate.register_hap_status([make_site(chkdown="2")])
+        self.assertTrue(self.mystate._is_server_flapping("test_backend", "server1"))
+        self.clock.advance(301)
+        self.assertFalse(self.mystate._is_server_flapping("test_backend", "server1"))
+
+    def test_status_goes_stale_with_the_clock(self):
+        self.mystate.register_hap_status([make_site()])
+        self.assertEqual(self.mystate.get_status()["status"], "STATUS_UP")
+        self.clock.advance(self.config["MAX_STATUS_STALENESS"] + 1)
+        self.assertEqual(self.mystate.get_status()["status"], "STATUS_UNKNOWN")
+
+    def test_fetch_due_follows_the_clock(self):
+        self.mystate.register_hap_status([make_site()])
+        self.assertFalse(self.mystate.should_fetch_hap_status())
+        self.clock.advance(self.mystate.poll_interval + 1)
+        self.assertTrue(self.mystate.should_fetch_hap_status())
+
+
+class SimulateTests(unittest.TestCase):
+    def test_flappy_servers_detected(self):
+        clock = FakeClock()
+        fleet = Fleet(clock(), backends=5, servers=4, flappy=0.25, seed=42)
+        config = make_config({"FLAPPING_WINDOW": 300, "FLAPPING_THRESHOLD": 2})
+        stats = simulate(
+            MyState(config, logger, clock=clock),
+            clock,
+            fleet,
+            polls=200,
+            interval=10,
+            warmup=31,
+        )
+        self.assertEqual(stats.polls, 200)
+        self.assertGreater(stats.true_positive_rate, 0.8)
+        self.assertLess(stats.false_positive_rate, 0.05)
+
+    def test_deterministic(self):
+        def run():
+            clock = FakeClock()
+            fleet = Fleet(clock(), backends=2, servers=2, flappy=0.5, seed=1)
+            stats = simulate(
+                MyState(make_config({}), logger, clock=clock), clock, fleet, 50, 10
+            )
+            return stats.true_positives, stats.false_positives
+
+        self.assertEqual(run(), run())
+
+    def test_show_stat_parses(self):
+        clock = FakeClock()
+        fleet = Fleet(clock(), backends=2, servers=3, seed=1)
+        clock.advance(100)
+        sites = parse_status(fleet.show_stat(clock()), logger)
+        assert sites is not None
+        self.assertEqual([x.name for x in sites], list(fleet.sites))
+        self.assertEqual(len(sites[0].servers), 3)
+        self.assertEqual(sites[0].servers[0].lastchg, "100")
+
+    def test_config_isolated_from_running_instance(self):
+        env = {"EVENTS_TARGET": "udp://127.0.0.1:5140", "AGENT_PORT": "5555"}
+        with patch.dict(os.environ, env):
+            config = make_config({})
+        self.assertIsNone(config["EVENTS_TARGET"])
+        self.assertIsNone(config["AGENT_PORT"])
@@ -37,14 +37,23 @@
 Test the API backend.
 """
 
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
 import time
 import unittest
 from dataclasses import dataclass
+from typing import cast
 from unittest.mock import patch
 
-from werkzeug.exceptions import NotFound
+from werkzeug.exceptions import BadRequest, NotFound
 
 import haproxy_status
+from haproxy_status.status import Site, SiteInfo
+from haproxy_status.util import SignalDirectory
 
 TEST_CONFIG = {
     "DEBUG": True,
@@ -53,12 +62,13 @@ TEST_CONFIG = {
     "PRESERVE_CONTEXT_ON_EXCEPTION": True,
     "TRAP_HTTP_EXCEPTIONS": True,
     "TRAP_BAD_REQUEST_ERRORS": True,
+    "BACKGROUND_REFRESH": False,
 }
 
 
 @dataclass
 class MockSiteInfo:
-    """Mock SiteInfo for testing. Mimics the fields accessed by _register_server_state."""
+    """Mock SiteInfo for testing. Mimics the fields accessed by register_hap_status."""
 
     pxname: str = "test_backend"
     svname: str = "server1"
@@ -73,6 +83,73 @@ class MockSiteInfo:
     last_chk: str = ""
 
 
+def make_site(name="test_backend", servers=None, backend_status="UP", **kwargs):
+    """Build a Site with the given servers (name -> MockSiteInfo kwargs) and a BACKEND row."""
+    site = Site(name)
+    for svname, srv_kwargs in (servers or {"server1": kwargs}).items():
+        site.add_parsed(
+            cast(SiteInfo, MockSiteInfo(pxname=name, svname=svname, **srv_kwargs))
+        )
+    site.add_parsed(
+        cast(
+            SiteInfo,
+            MockSiteInfo(
+                pxname=name,
+                svname="BACKEND",
+                status=backend_status,
+                lastchg=kwargs.get("lastchg", "100"),
+            ),
+        )
+    )
+    return site
+
+
+def register_rows(mystate, *rows, now=None):
+    """Register a poll where haproxy reported just these rows for test_backend."""
+    site = Site("test_backend")
+    for row in rows:
+        site.add_parsed(cast(SiteInfo, row))
+    mystate.register_hap_status([site], now=now)
+
+
+class SiteTests(unittest.TestCase):
+    """Tests for the backend aggregates kept by Site."""
+
+    def _site(self, *backends):
+        site = Site("www__default")
+        for status, lastchg in backends:
+            site.add_parsed(
+                cast(
+                    SiteInfo,
+                    MockSiteInfo(svname="BACKEND", status=status, lastchg=lastchg),
+                )
+            )
+        site.add_parsed(cast(SiteInfo, MockSiteInfo(svname="server1")))
+        return site
+
+    def test_aggregates(self):
+        site = self._site(("UP", "100"), ("DOWN", "30"), ("UP", "20"), ("MAINT", "60"))
+        self.assertEqual(len(site.backend), 4)
+        self.assertEqual(len(site.servers), 1)
+        self.assertEqual([x.lastchg for x in site.backends_up], ["100", "20"])
+        self.assertEqual([x.lastchg for x in site.backends_down], ["30", "60"])
+        self.assertEqual(site.backend_uptime_min, 20)
+        self.assertEqual(site.backend_uptime_max, 100)
+        self.assertEqual(site.backend_downtime_min, 30)
+        self.assertEqual(site.backend_downtime_max, 60)
+
+    def test_no_backends_down(self):
+        site = self._site(("UP", "100"))
+        self.assertEqual(site.backends_down, [])
+        with self.assertRaises(ValueError):
+            site.backend_downtime_min
+
+    def test_unknown_lastchg_ignored(self):
+        site = self._site(("UP", ""), ("UP", "5"))
+        self.assertEqual(len(site.backends_up), 2)
+        self.assertEqual(site.backend_uptime_min, 5)
+
+
 class AppTests(unittest.TestCase):
     """Base TestCase for those tests that need a full environment setup"""
 
@@ -101,14 +178,14 @@ class FlappingDetectionTests(AppTests):
         server = MockSiteInfo(
             svname=svname, status=status, lastchg=lastchg, chkdown=chkdown
         )
-        self.app.mystate._register_server_state("test_backend", server)
+        register_rows(self.app.mystate, server)
 
     def _register_backend(self, status="UP", lastchg="100", chkdown="0"):
         """Helper to register a BACKEND row."""
         server = MockSiteInfo(
             svname="BACKEND", status=status, lastchg=lastchg, chkdown=chkdown
         )
-        self.app.mystate._register_server_state("test_backend", server)
+        register_rows(self.app.mystate, server)
 
     def test_stable_server_not_flapping(self):
         """A server with stable chkdown and growing lastchg should not be flagged as flapping."""
@@ -198,7 +275,6 @@ class FlappingDetectionTests(AppTests):
         # Register server and backend
         self._register_server(lastchg="100", chkdown="0")
         self._register_backend(lastchg="100", chkdown="0")
-        self.app.mystate._update_time = int(time.time())
 
         # Trigger enough transitions to be flapping
         self._register_server(lastchg="5", chkdown="1")
@@ -213,7 +289,6 @@ class FlappingDetectionTests(AppTests):
         """get_status should report STATUS_UP when server is stable and UP."""
         self._register_server(lastchg="100", chkdown="0")
         self._register_backend(lastchg="100", chkdown="0")
-        self.app.mystate._update_time = int(time.time())
 
         status = self.app.mystate.get_status()
         self.assertEqual(status["status"], "STATUS_UP")
@@ -226,8 +301,651 @@ class FlappingDetectionTests(AppTests):
         # Cause BACKEND row to have lastchg regression (shouldn't trigger flapping)
         self._register_backend(lastchg="5", chkdown="0")
 
-        # BACKEND rows are skipped in _register_server_state for flapping detection
+        # BACKEND rows are skipped by the flapping detection
         self.assertNotIn(
             "transitions",
             self.app.mystate._hap_status["test_backend"].get("BACKEND", {}),
         )
+
+
+class RateLimitedLoggingTests(AppTests):
+    """Tests for not repeating the same log message every poll."""
+
+    def _register(self, now, **kwargs):
+        server = MockSiteInfo(svname="server1", **kwargs)
+        register_rows(self.app.mystate, server, now=now)
+
+    def _messages(self, now, **kwargs):
+        with self.assertLogs(self.app.logger, level="INFO") as cm:
+            # make sure there is at least one message, assertLogs fails otherwise
+            self.app.logger.info("marker")
+            self._register(now, **kwargs)
+        return [x for x in cm.output if "marker" not in x]
+
+    def test_still_down_logged_once_per_interval(self):
+        now = int(time.time())
+        interval = self.app.config["LOG_DOWN_INTERVAL"]
+        self._register(now, status="DOWN", lastchg="10")
+        # the first reminder, and then not again until LOG_DOWN_INTERVAL has passed
+        self.assertEqual(
+            len(self._messages(now + interval, status="DOWN", lastchg="20")), 1
+        )
+        self.assertEqual(
+            self._messages(now + interval + 10, status="DOWN", lastchg="30"), []
+        )
+        self.assertEqual(
+            len(self._messages(now + interval * 2, status="DOWN", lastchg="40")), 1
+        )
+
+    def test_flapping_warning_rate_limited(self):
+        now = int(time.time())
+        self._register(now, lastchg="100", chkdown="0")
+        self._register(now + 1, lastchg="0", chkdown="3")
+        # still flapping, but the new transition is the only thing worth logging
+        messages = self._messages(now + 2, lastchg="0", chkdown="4")
+        self.assertEqual(len(messages), 1)
+        self.assertIn("chkdown increased", messages[0])
+
+
+class StaleWhileRevalidateTests(AppTests):
+    """Tests for serving the last known status when fetching from haproxy fails."""
+
+    def _register_up_backend(self, age=0):
+        server = MockSiteInfo(svname="server1", status="UP", lastchg="100")
+        backend = MockSiteInfo(svname="BACKEND", status="UP", lastchg="100")
+        register_rows(self.app.mystate, server, backend, now=time.time() - age)
+
+    def test_fetch_failure_serves_last_status(self):
+        """A failed fetch should not change an UP status within the staleness limit."""
+        self._register_up_backend(age=20)
+        self.app.mystate.register_hap_fetch_failure()
+
+        status = self.app.mystate.get_status()
+        self.assertEqual(status["status"], "STATUS_UP")
+        self.assertEqual(status["stale"], 20)
+        self.assertEqual(status["ttl"], 40)
+
+    def test_fetch_failure_beyond_staleness_is_unknown(self):
+        """Once the last status is older than MAX_STATUS_STALENESS, report STATUS_UNKNOWN."""
+        self._register_up_backend(age=61)
+        self.app.mystate.register_hap_fetch_failure()
+
+        status = self.app.mystate.get_status()
+        self.assertEqual(status["status"], "STATUS_UNKNOWN")
+        self.assertIn("stale", status["reason"])
+        self.assertEqual(status["ttl"], 0)
+
+    def test_fetch_failure_without_data_not_stale(self):
+        """Never having had any data is not the same as having fresh data."""
+        self.app.mystate.register_hap_fetch_failure()
+
+        status = self.app.mystate.get_status()
+        self.assertEqual(status["status"], "STATUS_UNKNOWN")
+        self.assertNotIn("stale", status)
+        self.assertLessEqual(status["ttl"], self.app.mystate.poll_interval)
+
+    def test_fetch_failure_schedules_retry(self):
+        """A failed fetch should be retried after FETCH_HAPROXY_STATUS_RETRY_INTERVAL."""
+        self.app.mystate.register_hap_fetch_failure()
+        self.assertLessEqual(
+            self.app.mystate._next_fetch_hap_status,
+            time.time() + self.app.config["FETCH_HAPROXY_STATUS_RETRY_INTERVAL"],
+        )
+
+    def test_successful_fetch_clears_staleness(self):
+        self._register_up_backend(age=20)
+        self.app.mystate.register_hap_fetch_failure()
+        self.app.mystate.register_hap_status([])
+
+        status = self.app.mystate.get_status()
+        self.assertEqual(status["status"], "STATUS_UP")
+        self.assertNotIn("stale", status)
+
+    def test_status_view_serves_stale_status(self):
+        """The /status endpoint should not return FAIL when haproxy can't be reached."""
+        self._register_up_backend(age=5)
+        # the next poll is due
+        self.app.mystate._next_fetch_hap_status = 0
+        with patch("haproxy_status.app.get_status", return_value=None):
+            response = self.client.get("/status")
+        self.assertEqual(response.json["status"], "STATUS_UP")
+        self.assertEqual(response.json["stale"], 5)
+
+
+class SnapshotStateTests(AppTests):
+    """Tests for the copy-on-write state snapshots in MyState."""
+
+    def _site(self, status="UP", lastchg="100", chkdown="0"):
+        return make_site(
+            status=status, lastchg=lastchg, chkdown=chkdown, backend_status=status
+        )
+
+    def test_register_publishes_new_snapshot(self):
+        """A published snapshot should never be modified by later polls."""
+        self.app.mystate.register_hap_status([self._site()])
+        old = self.app.mystate._snapshot
+
+        self.app.mystate.register_hap_status([self._site(status="DOWN", chkdown="1")])
+        new = self.app.mystate._snapshot
+
+        self.assertIsNot(old, new)
+        self.assertEqual(old.servers["test_backend"]["server1"]["status"], "UP")
+        self.assertEqual(old.servers["test_backend"]["server1"]["transitions"], [])
+        self.assertEqual(new.servers["test_backend"]["server1"]["status"], "DOWN")
+        self.assertEqual(len(new.servers["test_backend"]["server1"]["transitions"]), 1)
+
+    def test_concurrent_should_fetch_only_once(self):
+        """Only one of many concurrent callers should be told to fetch."""
+        barrier = threading.Barrier(20)
+        results = []
+
+        def worker():
+            barrier.wait()
+            results.append(self.app.mystate.should_fetch_hap_status())
+
+        threads = [threading.Thread(target=worker) for _ in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results.count(True), 1)
+
+    def test_concurrent_readers_during_writes(self):
+        """Readers should always see a complete state while a writer publishes snapshots."""
+        self.app.mystate.register_hap_status([self._site()])
+        self.app.mystate._update_time = int(time.time())
+        stop = threading.Event()
+        errors = []
+
+        def reader():
+            while not stop.is_set():
+                try:
+                    res = self.app.mystate.get_status()
+                    if res["status"] not in ("STATUS_UP", "STATUS_DOWN"):
+                        errors.append(res)
+                except Exception as exc:
+                    errors.append(exc)
+
+        threads = [threading.Thread(target=reader) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for i in range(200):
+            self.app.mystate.register_hap_status([self._site(lastchg=str(100 + i))])
+        stop.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+
+
+class FetchCoalescingTests(AppTests):
+    """Tests for coalescing concurrent fetches from haproxy into one."""
+
+    def test_concurrent_refresh_fetches_once(self):
+        """Callers arriving while a fetch is in flight should not fetch again."""
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow_get_status(stats_url, *args):
+            calls.append(stats_url)
+            started.set()
+            release.wait(5)
+            return [make_site()]
+
+        with patch("haproxy_status.app.get_status", side_effect=slow_get_status):
+            leader = threading.Thread(target=self.app.mystate.refresh_hap_status)
+            leader.start()
+            started.wait(5)
+            # no previous snapshot, so followers wait for the leader's result
+            followers = [
+                threading.Thread(target=self.app.mystate.refresh_hap_status)
+                for _ in range(5)
+            ]
+            for t in followers:
+                t.start()
+            time.sleep(0.1)
+            # force the fetch deadline, followers should still not fetch
+            self.app.mystate._next_fetch_hap_status = 0
+            release.set()
+            for t in [leader] + followers:
+                t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.app.mystate.counters.get("fetches"), 1)
+        self.assertEqual(self.app.mystate.counters.get("fetches_coalesced"), 5)
+        self.assertIn("test_backend", self.app.mystate._hap_status)
+
+    def test_coalesced_caller_served_previous_snapshot(self):
+        """With a previous snapshot available, followers should not wait for the fetch."""
+        self.app.mystate.register_hap_status([make_site()])
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_get_status(stats_url, *args):
+            started.set()
+            release.wait(5)
+            return [make_site()]
+
+        with patch("haproxy_status.app.get_status", side_effect=slow_get_status):
+            self.app.mystate._next_fetch_hap_status = 0
+            leader = threading.Thread(target=self.app.mystate.refresh_hap_status)
+            leader.start()
+            started.wait(5)
+            t0 = time.monotonic()
+            self.app.mystate.refresh_hap_status()
+            elapsed = time.monotonic() - t0
+            release.set()
+            leader.join()
+
+        self.assertLess(elapsed, 1)
+        self.assertEqual(self.app.mystate.counters.get("fetches_coalesced"), 1)
+
+    def test_counters_endpoint(self):
+        with patch("haproxy_status.app.get_status", return_value=None):
+            self.client.get("/status")
+        response = self.client.get("/counters")
+        self.assertEqual(response.json["fetches"], 1)
+        self.assertEqual(response.json["fetch_failures"], 1)
+
+
+class CircuitBreakerStateTests(AppTests):
+    def test_breaker_stops_fetching(self):
+        """After repeated failures, haproxy should be left alone for a while."""
+        with patch("haproxy_status.app.get_status", return_value=None) as mock:
+            for _ in range(5):
+                self.app.mystate._next_fetch_hap_status = 0
+                self.app.mystate.refresh_hap_status()
+        threshold = self.app.config["HAPROXY_FAILURE_THRESHOLD"]
+        self.assertEqual(mock.call_count, threshold)
+        self.assertEqual(self.app.mystate.counters.get("circuit_breaker_opened"), 1)
+        self.assertEqual(
+            self.app.mystate.counters.get("fetches_short_circuited"), 5 - threshold
+        )
+
+
+class AdaptivePollIntervalTests(AppTests):
+    """Tests for adapting the poll interval to the stability of the backends."""
+
+    def setUp(self, config=TEST_CONFIG):
+        config = dict(config)
+        config.update(
+            {
+                "FETCH_HAPROXY_STATUS_INTERVAL_MIN": 5,
+                "FETCH_HAPROXY_STATUS_INTERVAL_MAX": 60,
+            }
+        )
+        super().setUp(config=config)
+
+    def test_backs_off_while_stable(self):
+        intervals = []
+        for _ in range(5):
+            self.app.mystate.register_hap_status([make_site(lastchg="1000")])
+            intervals.append(self.app.mystate.poll_interval)
+        self.assertEqual(intervals, [30, 60, 60, 60, 60])
+
+    def test_fast_polling_while_down(self):
+        self.app.mystate.register_hap_status([make_site(lastchg="1000")])
+        self.app.mystate.register_hap_status(
+            [make_site(lastchg="2000", status="DOWN", backend_status="DOWN")]
+        )
+        self.assertEqual(self.app.mystate.poll_interval, 5)
+
+    def test_backs_off_with_excluded_backend_down(self):
+        config = dict(self.app.config, BACKEND_EXCLUDE="api__*")
+        mystate = haproxy_status.app.MyState(config, self.app.logger)
+        intervals = []
+        for _ in range(3):
+            mystate.register_hap_status(
+                [
+                    make_site("www__default", lastchg="1000"),
+                    make_site(
+                        "api__default",
+                        lastchg="5",
+                        status="DOWN",
+                        backend_status="DOWN",
+                    ),
+                ]
+            )
+            intervals.append(mystate.poll_interval)
+        self.assertEqual(intervals, [30, 60, 60])
+
+    def test_fast_polling_after_recent_change(self):
+        self.app.mystate.register_hap_status([make_site(lastchg="10")])
+        self.assertEqual(self.app.mystate.poll_interval, 5)
+
+    def test_next_fetch_follows_new_interval(self):
+        self.app.mystate.register_hap_status([make_site(lastchg="1000")])
+        self.assertGreater(self.app.mystate._next_fetch_hap_status, time.time() + 29)
+        self.app.mystate.register_hap_status(
+            [make_site(lastchg="2000", status="DOWN", backend_status="DOWN")]
+        )
+        self.assertLess(self.app.mystate._next_fetch_hap_status, time.time() + 6)
+
+    def test_interval_reflected_in_ttl(self):
+        self.app.mystate.register_hap_status([make_site(lastchg="1000")])
+        status = self.app.mystate.get_status()
+        self.assertIn(status["ttl"], (29, 30))
+
+
+class StateSnapshotFileTests(AppTests):
+    """Tests for checkpointing the state to a file, and loading it at startup."""
+
+    def setUp(self, config=TEST_CONFIG):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.snapshot_fn = os.path.join(self.tmpdir.name, "state.json")
+        config = dict(config)
+        config["STATE_SNAPSHOT_FILENAME"] = self.snapshot_fn
+        config["STATUS_OUTPUT_DEBOUNCE"] = 0
+        self.config = config
+        super().setUp(config=config)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _poll(self, mystate, **kwargs):
+        """Register a poll, and wait for the snapshot to be written."""
+        mystate.register_hap_status([make_site(**kwargs)])
+        self.assertTrue(mystate.snapshot_writer.flush(5))
+
+    def test_poll_writes_snapshot(self):
+        self.assertFalse(os.path.exists(self.snapshot_fn))
+        self._poll(self.app.mystate, lastchg="1000")
+        self.assertTrue(os.path.exists(self.snapshot_fn))
+        # no temporary files left behind
+        self.assertEqual(os.listdir(self.tmpdir.name), ["state.json"])
+
+    def test_restarted_app_serves_status(self):
+        """A new app should answer from the snapshot before polling haproxy."""
+        self._poll(self.app.mystate, lastchg="1000")
+        self.app.mystate.get_status()
+
+        app = haproxy_status.app.init_app("unittest_app", self.config)
+        status = app.mystate.get_status()
+        self.assertEqual(status["status"], "STATUS_UP")
+        self.assertEqual(app.mystate._last_status, "STATUS_UP")
+
+    def test_restarted_app_rewrites_status_file(self):
+        """The status file is on tmpfs, and gone after a restart of the container."""
+        status_fn = os.path.join(self.tmpdir.name, "status.txt")
+        config = dict(self.config)
+        config["STATUS_OUTPUT_FILENAME"] = status_fn
+        app = haproxy_status.app.init_app("unittest_app", config)
+        self._poll(app.mystate, lastchg="1000")
+        self.assertEqual(app.mystate.get_status()["status"], "STATUS_UP")
+        self._poll(app.mystate, lastchg="1010")
+        self.assertTrue(app.mystate.status_writer.flush(5))
+        os.unlink(status_fn)
+
+        with patch("haproxy_status.app.get_status", return_value=None):
+            app = haproxy_status.app.init_app("unittest_app", config)
+            self.assertEqual(app.mystate.get_status()["status"], "STATUS_UP")
+        self.assertTrue(app.mystate.status_writer.flush(5))
+        with open(status_fn) as fd:
+            self.assertEqual(fd.read(), "STATUS_UP 1 backend UP\n")
+
+    def test_poll_does_not_write_snapshot(self):
+        """Serializing and writing the snapshot is left to the writer thread."""
+        with patch("haproxy_status.app.atomic_write") as atomic_write:
+            with patch.object(self.app.mystate.snapshot_writer, "submit") as submit:
+                self.app.mystate.register_hap_status([make_site()])
+        atomic_write.assert_not_called()
+        submit.assert_called_once_with(self.app.mystate._snapshot)
+
+    def test_restarted_app_keeps_flapping_history(self):
+        self._poll(self.app.mystate, lastchg="100", chkdown="0")
+        self._poll(self.app.mystate, lastchg="5", chkdown="3")
+
+        app = haproxy_status.app.init_app("unittest_app", self.config)
+        self.assertTrue(app.mystate._is_server_flapping("test_backend", "server1"))
+
+    def test_bad_snapshot_ignored(self):
+        with open(self.snapshot_fn, "w") as fd:
+            fd.write("not json")
+        app = haproxy_status.app.init_app("unittest_app", self.config)
+        self.assertIsNone(app.mystate._update_time)
+        self.assertFalse(app.mystate.load_snapshot(self.snapshot_fn))
+
+    def test_incomplete_snapshot_ignored(self):
+        """A truncated or hand edited snapshot must not stop the app from starting."""
+        for data in [
+            {"version": 1, "update_time": 1},
+            {
+                "version": 1,
+                "update_time": "1",
+                "fetch_failed_since": None,
+                "servers": {},
+            },
+            {"version": 1, "update_time": 1, "fetch_failed_since": None, "servers": []},
+            {
+                "version": 1,
+                "update_time": 1,
+                "fetch_failed_since": None,
+                "servers": {"www": {"server1": "UP"}},
+            },
+        ]:
+            with self.subTest(data=data):
+                with open(self.snapshot_fn, "w") as fd:
+                    json.dump(data, fd)
+                app = haproxy_status.app.init_app("unittest_app", self.config)
+                self.assertIsNone(app.mystate._update_time)
+                self.assertEqual(app.mystate._hap_status, {})
+
+
+class StatusOutputFileTests(AppTests):
+    """Tests for exporting the status to STATUS_OUTPUT_FILENAME."""
+
+    def setUp(self, config=TEST_CONFIG):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.status_fn = os.path.join(self.tmpdir.name, "status.txt")
+        config = dict(config)
+        config["STATUS_OUTPUT_FILENAME"] = self.status_fn
+        config["STATUS_OUTPUT_DEBOUNCE"] = 0
+        super().setUp(config=config)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _read_status_file(self):
+        self.assertTrue(self.app.mystate.status_writer.flush(5))
+        with open(self.status_fn) as fd:
+            return fd.read()
+
+    def test_initial_status_written(self):
+        self.assertEqual(
+            self._read_status_file(),
+            "STATUS_UNKNOWN No backend data received from haproxy\n",
+        )
+
+    def test_status_change_written(self):
+        self.app.mystate.register_hap_status([make_site(lastchg="1000")])
+        self.app.mystate.get_status()
+        self.assertEqual(self._read_status_file(), "STATUS_UP 1 backend UP\n")
+
+
+class HistoryEndpointTests(AppTests):
+    def test_history(self):
+        self.app.mystate.register_hap_status([make_site(lastchg="1000")])
+        self.app.mystate.register_hap_status(
+            [make_site(lastchg="1", status="DOWN", backend_status="DOWN")]
+        )
+        response = self.client.get("/history?backend=test_backend&server=BACKEND")
+        backend = response.json["test_backend"]["BACKEND"]
+        self.assertEqual([s for _, s in backend["samples"]], ["UP", "DOWN"])
+        self.assertEqual([s for _, s in backend["transitions"]], ["UP", "DOWN"])
+        self.assertNotIn("server1", response.json["test_backend"])
+
+    def test_history_downsampled(self):
+        self.app.mystate.register_hap_status([make_site(lastchg="1000")])
+        self.app.mystate.register_hap_status(
+            [make_site(lastchg="1", status="DOWN", backend_status="DOWN")]
+        )
+        response = self.client.get("/history?step=3600")
+        samples = response.json["test_backend"]["server1"]["samples"]
+        self.assertEqual(len(samples), 1)
+        self.assertEqual(samples[0][1], "DOWN")
+
+    def test_history_paged(self):
+        servers = {"server{}".format(i): {"lastchg": "1000"} for i in range(5)}
+        self.app.mystate.register_hap_status([make_site(servers=servers)])
+        response = self.client.get("/history?offset=2&limit=2")
+        self.assertEqual(sorted(response.json["test_backend"]), ["server2", "server3"])
+        # five servers and the BACKEND row
+        self.assertEqual(response.headers["X-Total-Count"], "6")
+        self.assertEqual(response.headers["X-Next-Offset"], "4")
+
+        response = self.client.get("/history?offset=4&limit=2")
+        self.assertEqual(sorted(response.json["test_backend"]), ["BACKEND", "server4"])
+        self.assertNotIn("X-Next-Offset", response.headers)
+
+    def test_history_limit_bounded(self):
+        with self.assertRaises(BadRequest):
+            self.client.get("/history?limit=100000")
+
+
+class AdmissionControlTests(AppTests):
+    """Tests for shedding load when too many requests are in flight."""
+
+    def setUp(self, config=TEST_CONFIG):
+        config = dict(config)
+        config["MAX_CONCURRENT_REQUESTS"] = 1
+        super().setUp(config=config)
+        # occupy the only slot, as if a slow request was in progress
+        self.assertTrue(self.app.admission.try_acquire())
+        self.assertFalse(self.app.admission.try_acquire())
+
+    def test_expensive_request_rejected(self):
+        response = self.client.get("/history")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(self.app.mystate.counters.get("requests_rejected"), 1)
+
+    def test_ping_always_answered(self):
+        response = self.client.get("/ping")
+        self.assertEqual(response.status_code, 200)
+
+    def test_status_served_from_cache(self):
+        with patch("haproxy_status.app.get_status") as mock:
+            response = self.client.get("/status")
+        self.assertEqual(response.status_code, 200)
+        mock.assert_not_called()
+        self.assertEqual(self.app.mystate.counters.get("status_served_from_cache"), 1)
+
+    def test_admitted_after_release(self):
+        self.app.admission.release()
+        response = self.client.get("/counters")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["requests_admitted_in_flight"], 1)
+        self.assertEqual(response.json["requests_in_flight"], 1)
+        self.assertEqual(self.app.admission.in_flight, 0)
+
+
+class SignalDirectoryTests(unittest.TestCase):
+    def test_names(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            signals = SignalDirectory(tmpdir)
+            self.assertFalse(signals.exists("common"))
+            open(os.path.join(tmpdir, "common"), "w").close()
+            self.assertTrue(signals.exists("common"))
+            os.unlink(os.path.join(tmpdir, "common"))
+            self.assertFalse(signals.exists("common"))
+
+    def test_cached(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            signals = SignalDirectory(tmpdir)
+            # pretend the last change was long ago
+            os.utime(tmpdir, (1000, 1000))
+            signals.names()
+            with patch("os.scandir") as mock:
+                signals.names()
+            mock.assert_not_called()
+
+    def test_missing_directory(self):
+        signals = SignalDirectory("/nonexistent/haproxy-status")
+        self.assertEqual(signals.names(), frozenset())
+
+
+class ServiceStatusTests(AppTests):
+    """Tests for serving the status of several services from one poll."""
+
+    def setUp(self, config=TEST_CONFIG):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        config = dict(config)
+        config.update(
+            {
+                "SIGNAL_DIRECTORY": self.tmpdir.name,
+                "SERVICES": {
+                    "web": {"include": "site:www"},
+                    "api": {"include": "api*"},
+                },
+                "HEALTHY_BACKEND_UPTIME": 0,
+            }
+        )
+        super().setUp(config=config)
+        self.app.mystate.register_hap_status(
+            [
+                make_site("www__default"),
+                make_site("api__default", backend_status="DOWN"),
+            ]
+        )
+        # don't try to fetch from haproxy
+        self.app.mystate._next_fetch_hap_status = time.time() + 3600
+
+    def test_services(self):
+        response = self.client.get("/status/service/web")
+        self.assertEqual(response.json["status"], "STATUS_UP")
+        self.assertEqual(response.json["reason"], "1 backend UP")
+        response = self.client.get("/status/service/api")
+        self.assertEqual(response.json["status"], "STATUS_DOWN")
+        # the node as a whole
+        self.assertEqual(self.client.get("/status").json["status"], "STATUS_DOWN")
+
+    def test_unknown_service(self):
+        with self.assertRaises(NotFound):
+            self.client.get("/status/service/nosuchservice")
+
+    def test_admin_down_per_service(self):
+        open(os.path.join(self.tmpdir.name, "web"), "w").close()
+        with self.assertRaises(NotFound):
+            self.client.get("/status/service/web")
+        res = self.app.mystate.get_service_status("web")
+        self.assertEqual(res["status"], "STATUS_ADMIN_DOWN")
+        self.assertEqual(
+            self.app.mystate.get_service_status("api")["status"], "STATUS_DOWN"
+        )
+
+    def test_common_admin_down(self):
+        open(os.path.join(self.tmpdir.name, "common"), "w").close()
+        for name in ("web", "api"):
+            res = self.app.mystate.get_service_status(name)
+            self.assertEqual(res["status"], "STATUS_ADMIN_DOWN")
+
+
+class LazyImportTests(unittest.TestCase):
+    def _imported(self, module, candidates):
+        """The candidates that are in sys.modules after importing module."""
+        code = "import sys, {}; print(','.join(m for m in {!r} if m in sys.modules))"
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(haproxy_status.__file__))
+        out = subprocess.check_output(
+            [sys.executable, "-c", code.format(module, candidates)], env=env
+        )
+        return out.decode().strip()
+
+    def test_app_imports_lazily(self):
+        """yaml, requests and tracemalloc should only be imported when needed."""
+        self.assertEqual(
+            self._imported("haproxy_status.app", ("yaml", "requests", "tracemalloc")),
+            "",
+        )
+
+    def test_status_imports_lazily(self):
+        """The process pool modules should only be imported when parsing in parallel."""
+        self.assertEqual(
+            self._imported(
+                "haproxy_status.status", ("multiprocessing", "concurrent.futures")
+            ),
+            "",
+        )
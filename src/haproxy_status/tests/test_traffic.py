@@ -0,0 +1,99 @@
+"""
+Tests for traffic-aware health.
+"""
+
+import logging
+import unittest
+
+from haproxy_status.app import MyState
+from haproxy_status.simulate import FakeClock, make_config
+from haproxy_status.status import parse_status
+from haproxy_status.traffic import BackendTraffic, TrafficTracker
+
+logger = logging.getLogger(__name__)
+
+
+def show_stat(*backends):
+    """
+    A 'show stat' response with one server and a BACKEND row per backend.
+
+    :param backends: (pxname, req_tot, hrsp_5xx, econ, qcur) for every backend
+    """
+    lines = [
+        "# pxname,svname,status,lastchg,chkdown,req_tot,hrsp_5xx,econ,eresp,qcur,rtime,"
+    ]
+    for pxname, req_tot, hrsp_5xx, econ, qcur in backends:
+        for svname in ("server1", "BACKEND"):
+            lines += [
+                "{},{},UP,1000,0,{},{},{},0,{},12,".format(
+                    pxname, svname, req_tot, hrsp_5xx, econ, qcur
+                )
+            ]
+    sites = parse_status("\n".join(lines) + "\n", logger)
+    assert sites is not None
+    return sites
+
+
+class TrafficTrackerTests(unittest.TestCase):
+    def test_deltas(self):
+        tracker = TrafficTracker()
+        first = tracker.update(show_stat(("www", 100, 5, 0, 0)))
+        # nothing to compare the first poll with
+        self.assertEqual(first["www"], BackendTraffic(0, 0, 0, 12))
+        res = tracker.update(show_stat(("www", 300, 55, 0, 2)))
+        self.assertEqual(res["www"], BackendTraffic(200, 50, 2, 12))
+        self.assertEqual(res["www"].error_rate, 0.25)
+
+    def test_new_backend_and_restart(self):
+        tracker = TrafficTracker()
+        tracker.update(show_stat(("www", 1000, 10, 0, 0)))
+        res = tracker.update(show_stat(("www", 40, 4, 0, 0), ("api", 50, 0, 0, 0)))
+        # www's counters went backwards, haproxy was restarted
+        self.assertEqual((res["www"].requests, res["www"].errors), (40, 4))
+        self.assertEqual(res["api"].requests, 0)
+
+    def test_tcp_backend_errors(self):
+        """TCP backends have no request counter, only errors."""
+        traffic = BackendTraffic(requests=0, errors=20, qcur=0, rtime=0)
+        self.assertEqual(traffic.error_rate, 1.0)
+
+    def test_degraded(self):
+        tracker = TrafficTracker(error_rate=0.5, queue=10, min_requests=10)
+        traffic = {
+            "ok": BackendTraffic(100, 10, 0, 0),
+            "failing": BackendTraffic(100, 60, 0, 0),
+            "too_few": BackendTraffic(4, 4, 0, 0),
+            "queued": BackendTraffic(100, 0, 11, 0),
+        }
+        self.assertEqual(
+            tracker.degraded(traffic),
+            {"failing": "60% of 100 requests failed", "queued": "11 requests queued"},
+        )
+
+
+class DegradedStatusTests(unittest.TestCase):
+    def _mystate(self, **overrides):
+        config = make_config(dict(HEALTHY_BACKEND_UPTIME=0, **overrides))
+        clock = FakeClock()
+        return MyState(config, logger, clock=clock), clock
+
+    def test_degraded_backend_not_up(self):
+        mystate, clock = self._mystate(DEGRADED_ERROR_RATE=0.2)
+        mystate.register_hap_status(show_stat(("www", 100, 0, 0, 0)))
+        clock.advance(10)
+        mystate.register_hap_status(show_stat(("www", 200, 50, 0, 0)))
+        res = mystate.get_status()
+        self.assertEqual(res["status"], "STATUS_DOWN")
+        self.assertIn("www is DEGRADED (50% of 100 requests failed)", res["reason"])
+
+        clock.advance(10)
+        mystate.register_hap_status(show_stat(("www", 300, 50, 0, 0)))
+        self.assertEqual(mystate.get_status()["status"], "STATUS_UP")
+
+    def test_disabled_by_default(self):
+        mystate, clock = self._mystate()
+        self.assertIsNone(mystate.traffic)
+        mystate.register_hap_status(show_stat(("www", 100, 0, 0, 0)))
+        clock.advance(10)
+        mystate.register_hap_status(show_stat(("www", 200, 100, 0, 0)))
+        self.assertEqual(mystate.get_status()["status"], "STATUS_UP")
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Traffic-aware health, based on the counters in 'show stat'.
+
+A backend can be UP according to its health checks while failing most of the real
+requests. The counters of every row (server and BACKEND) are kept from one poll to the
+next in one typed array per field, and the rates since the previous poll are computed
+field by field over the whole arrays - one pass per field instead of one per server.
+
+A backend is degraded when, since the previous poll, the share of its requests that
+failed (5xx responses, connection errors or response errors) is at least
+DEGRADED_ERROR_RATE, or when more than DEGRADED_QUEUE requests are waiting in its
+queue. The error rate is only judged once the backend has seen DEGRADED_MIN_REQUESTS
+requests since the previous poll, so that one failed request out of two doesn't count.
+"""
+
+from array import array
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from haproxy_status.status import Site, SiteInfo
+
+# cumulative counters, used as deltas since the previous poll
+COUNTERS = ("req_tot", "hrsp_5xx", "econ", "eresp")
+# instantaneous values, used as they are
+GAUGES = ("qcur", "rtime")
+
+
+class BackendTraffic(NamedTuple):
+    """The traffic of one backend since the previous poll."""
+
+    requests: float
+    errors: float
+    qcur: float
+    rtime: float
+
+    @property
+    def error_rate(self) -> float:
+        if not self.errors:
+            return 0.0
+        # TCP backends have no request counter, only connection and response errors
+        return self.errors / max(self.requests, self.errors)
+
+
+def _number(value: Optional[str]) -> float:
+    try:
+        return float(value) if value else 0.0
+    except ValueError:
+        return 0.0
+
+
+def _column(rows: Sequence[SiteInfo], field: str) -> "array[float]":
+    """The values of one field of all the rows, as an array of floats."""
+    values = [getattr(row, field, None) for row in rows]
+    try:
+        return array("d", [float(x) if x else 0.0 for x in values])
+    except ValueError:
+        # something that isn't a number in there, take the slow path
+        return array("d", [_number(x) for x in values])
+
+
+class TrafficTracker(object):
+    """
+    Keep the counters from the previous poll, and compute what happened since.
+
+    Not thread safe, MyState only updates it from the thread publishing snapshots.
+
+    :param error_rate: Degraded when at least this share of the requests failed
+    :param queue: Degraded when more than this many requests are queued
+    :param min_requests: Number of requests needed to judge the error rate
+    """
+
+    def __init__(
+        self,
+        error_rate: Optional[float] = None,
+        queue: Optional[int] = None,
+        min_requests: int = 10,
+    ):
+        self.error_rate = error_rate
+        self.queue = queue
+        self.min_requests = min_requests
+        # (pxname, svname) -> position in the arrays
+        self._index: Dict[Tuple[str, str], int] = {}
+        self._values: Dict[str, "array[float]"] = {}
+
+    def update(self, sites: Sequence[Site]) -> Dict[str, BackendTraffic]:
+        """
+        Register the counters from a poll.
+
+        :return: The traffic since the previous poll, for every backend (BACKEND row)
+        """
+        keys: List[Tuple[str, str]] = []
+        rows: List[SiteInfo] = []
+        for site in sites:
+            for row in site.servers + site.backend:
+                keys += [(site.name, row.svname)]
+                rows += [row]
+
+        values = {field: _column(rows, field) for field in COUNTERS + GAUGES}
+        # position of every row in the previous poll's arrays, or -1 for new rows
+        previous = [self._index.get(key, -1) for key in keys]
+        deltas: Dict[str, "array[float]"] = {}
+        for field in COUNTERS:
+            old = self._values.get(field, array("d"))
+            deltas[field] = array(
+                "d",
+                [
+                    # a counter going backwards means haproxy was restarted
+                    0.0 if i < 0 else (new - old[i] if new >= old[i] else new)
+                    for new, i in zip(values[field], previous)
+                ],
+            )
+        errors = [
+            a + b + c
+            for a, b, c in zip(deltas["hrsp_5xx"], deltas["econ"], deltas["eresp"])
+        ]
+
+        self._index = {key: i for i, key in enumerate(keys)}
+        self._values = values
+
+        res = {}
+        for i, (name, svname) in enumerate(keys):
+            if svname == "BACKEND":
+                res[name] = BackendTraffic(
+                    requests=deltas["req_tot"][i],
+                    errors=errors[i],
+                    qcur=values["qcur"][i],
+                    rtime=values["rtime"][i],
+                )
+        return res
+
+    def degraded(self, traffic: Dict[str, BackendTraffic]) -> Dict[str, str]:
+        """
+        :return: Why backends are degraded, keyed on pxname
+        """
+        res = {}
+        for name, this in traffic.items():
+            if (
+                self.error_rate is not None
+                and max(this.requests, this.errors) >= self.min_requests
+                and this.error_rate >= self.error_rate
+            ):
+                res[name] = "{:.0%} of {} requests failed".format(
+                    this.error_rate, int(max(this.requests, this.errors))
+                )
+            elif self.queue is not None and this.qcur > self.queue:
+                res[name] = "{} requests queued".format(int(this.qcur))
+        return res
@@ -1,3 +1,10 @@
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, FrozenSet, Optional
+
+
 def time_to_str(value):
     """
     Format number of seconds to short readable string.
@@ -17,3 +24,115 @@ def time_to_str(value):
         return "{!s}h".format(int(value / 3600))
     days = int(value / 86400)
     return "{!s}d{!s}h".format(days, int((value % 86400) / 3600))
+
+
+class Counters(object):
+    """
+    Named counters for instrumentation, safe to update from multiple threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, int] = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+
+    def get(self, name: str) -> int:
+        return self._values.get(name, 0)
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._values)
+
+
+class AdmissionControl(object):
+    """
+    Limit the number of requests doing expensive work concurrently.
+
+    Requests over the limit are not queued, try_acquire() just returns False right away
+    so that the caller can reject the request (or skip the expensive work).
+    A limit of 0 means no limit.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.limit and self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+
+class SignalDirectory(object):
+    """
+    The names of the files in a directory, for cheap checks of whether a file exists.
+
+    The directory is only scanned again when its modification time changes, so a check
+    normally costs one stat() of the directory. A missing directory is empty.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime: Optional[int] = None
+        self._names: FrozenSet[str] = frozenset()
+
+    def exists(self, name: str) -> bool:
+        return name in self.names()
+
+    def names(self) -> FrozenSet[str]:
+        try:
+            mtime: Optional[int] = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime is None or mtime != self._mtime:
+            with self._lock:
+                if mtime is None or mtime != self._mtime:
+                    self._names = self._scan()
+                    # Filesystems with coarse timestamps might not change the mtime
+                    # for another change within the same tick, so keep scanning
+                    # until the last change is a bit older.
+                    if mtime is not None and time.time_ns() - mtime < 2_000_000_000:
+                        mtime = None
+                    self._mtime = mtime
+        return self._names
+
+    def _scan(self) -> FrozenSet[str]:
+        try:
+            with os.scandir(self.path) as it:
+                return frozenset(x.name for x in it)
+        except OSError:
+            return frozenset()
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """
+    Write data to a file so that readers see either the old or the new contents, but
+    never a partially written file.
+
+    The data is written to a temporary file in the same directory, which is then renamed
+    over the destination.
+    """
+    dirname, basename = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".{}.".format(basename), dir=dirname)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -1,26 +1,95 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
-from flask import Blueprint, abort, current_app, jsonify
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    current_app,
+    g,
+    jsonify,
+    request,
+    stream_with_context,
+)
 
-from haproxy_status.status import get_status
+from haproxy_status.detail import (
+    DEFAULT_LIMIT,
+    encode_detail,
+    parse_fields,
+    select_rows,
+)
+from haproxy_status.history import HISTORY_LIMIT, HISTORY_MAX_LIMIT
 
 __author__ = "ft"
 
 haproxy_status_views = Blueprint("haproxy_status", __name__, url_prefix="")
 
+# Endpoints always answered regardless of load, since the load balancers depend on them
+PRIORITY_ENDPOINTS = (
+    "haproxy_status.ping",
+    "haproxy_status.status",
+    "haproxy_status.service_status",
+)
+
+
+@haproxy_status_views.before_request
+def admission_control():
+    """Shed load by rejecting requests for expensive endpoints when busy."""
+    current_app.mystate.counters.incr("requests_in_flight")  # type: ignore[attr-defined]
+    g.admitted = False
+    if request.endpoint in PRIORITY_ENDPOINTS:
+        return None
+    if not current_app.admission.try_acquire():  # type: ignore[attr-defined]
+        current_app.mystate.counters.incr("requests_rejected")  # type: ignore[attr-defined]
+        response = jsonify({"status": "BUSY"})
+        response.status_code = 503
+        response.headers["Retry-After"] = "1"
+        return response
+    g.admitted = True
+    return None
+
+
+@haproxy_status_views.teardown_request
+def admission_release(exc):
+    current_app.mystate.counters.incr("requests_in_flight", -1)  # type: ignore[attr-defined]
+    if g.pop("admitted", False):
+        current_app.admission.release()  # type: ignore[attr-defined]
+
+
+def _refresh() -> None:
+    if current_app.admission.try_acquire():  # type: ignore[attr-defined]
+        try:
+            current_app.mystate.refresh_hap_status()  # type: ignore[attr-defined]
+        finally:
+            current_app.admission.release()  # type: ignore[attr-defined]
+    else:
+        # too busy to fetch status from haproxy, serve the cached status
+        current_app.mystate.counters.incr("status_served_from_cache")  # type: ignore[attr-defined]
+
 
 @haproxy_status_views.route("/status", methods=["GET"])
 def status():
-    if current_app.mystate.should_fetch_hap_status():  # type: ignore[attr-defined]
-        hap_status = get_status(current_app.config["STATS_URL"], current_app.logger)
-        if hap_status is None:
-            return jsonify({"status": "FAIL"})
+    _refresh()
+    res = current_app.mystate.get_status()  # type: ignore[attr-defined]
+    current_app.logger.debug("Response: %s", res)
 
-        current_app.mystate.register_hap_status(hap_status)  # type: ignore[attr-defined]
+    if (
+        res["status"] == "STATUS_ADMIN_DOWN"
+        and current_app.config["RETURN_404_ON_ADMIN_DOWN"]
+    ):
+        abort(404)
 
-    res = current_app.mystate.get_status()  # type: ignore[attr-defined]
-    current_app.logger.debug("Response: {}".format(res))
+    return jsonify(res)
+
+
+@haproxy_status_views.route("/status/service/<name>", methods=["GET"])
+def service_status(name):
+    """Status of one of the SERVICES, see MyState.get_service_status()."""
+    _refresh()
+    res = current_app.mystate.get_service_status(name)  # type: ignore[attr-defined]
+    if res is None:
+        abort(404)
+    current_app.logger.debug("Response for service %s: %s", name, res)
 
     if (
         res["status"] == "STATUS_ADMIN_DOWN"
@@ -31,6 +100,111 @@ def status():
     return jsonify(res)
 
 
+@haproxy_status_views.route("/status/detail", methods=["GET"])
+def status_detail():
+    """
+    Per-server data from the latest poll of haproxy, as a streamed JSON document.
+
+    Query parameters (all optional):
+
+      fields:  comma separated haproxy CSV fields to return (default: see detail.py)
+      backend: only these backends, patterns as in BACKEND_INCLUDE
+      status:  comma separated statuses, e.g. DOWN,MAINT
+      offset:  number of matching servers to skip
+      limit:   maximum number of servers to return (default 1000)
+    """
+    try:
+        fields = parse_fields(request.args.get("fields"))
+    except ValueError:
+        abort(400)
+    offset = request.args.get("offset", 0, type=int)
+    limit = request.args.get("limit", DEFAULT_LIMIT, type=int)
+    if offset < 0 or limit < 1:
+        abort(400)
+    snapshot = current_app.mystate._snapshot  # type: ignore[attr-defined]
+    rows = select_rows(
+        snapshot.sites,
+        backends=request.args.get("backend"),
+        statuses=request.args.get("status"),
+    )
+    body = encode_detail(rows, fields, snapshot.update_time, offset, limit)
+    return Response(stream_with_context(body), mimetype="application/json")
+
+
 @haproxy_status_views.route("/ping", methods=["GET", "POST"])
 def ping():
     return "pong\n"
+
+
+@haproxy_status_views.route("/counters", methods=["GET"])
+def counters():
+    res = current_app.mystate.counters.as_dict()  # type: ignore[attr-defined]
+    # number of requests currently doing expensive work, including this one
+    res["requests_admitted_in_flight"] = current_app.admission.in_flight  # type: ignore[attr-defined]
+    return jsonify(res)
+
+
+@haproxy_status_views.route("/history", methods=["GET"])
+def history():
+    """
+    Status history of backends and servers.
+
+    Query parameters (all optional):
+
+      backend: haproxy pxname
+      server:  haproxy svname (use BACKEND for the backend itself)
+      since:   only return samples from the last this many seconds
+      step:    downsample samples into buckets of this many seconds
+      offset:  number of matching servers to skip
+      limit:   maximum number of servers to return (default 100, at most 1000)
+
+    The total number of matching servers is returned in the X-Total-Count header, and
+    the offset of the next page (if there is one) in the X-Next-Offset header.
+    """
+    offset = request.args.get("offset", 0, type=int)
+    limit = request.args.get("limit", HISTORY_LIMIT, type=int)
+    if offset < 0 or not 1 <= limit <= HISTORY_MAX_LIMIT:
+        abort(400)
+    res, total = current_app.mystate.get_history(  # type: ignore[attr-defined]
+        name=request.args.get("backend"),
+        srv_name=request.args.get("server"),
+        since=request.args.get("since", type=int),
+        step=request.args.get("step", type=int),
+        offset=offset,
+        limit=limit,
+    )
+    response = jsonify(res)
+    response.headers["X-Total-Count"] = str(total)
+    if total > offset + limit:
+        response.headers["X-Next-Offset"] = str(offset + limit)
+    return response
+
+
+@haproxy_status_views.route("/debug/memory", methods=["GET"])
+def debug_memory():
+    """
+    Memory diagnostics, only available with DEBUG_MEMORY.
+
+    The first request starts tracing memory allocations, which makes everything else
+    several times slower until it is stopped with stop=1.
+
+    Query parameters (all optional):
+
+      limit:    number of allocation sites to report (default 10)
+      key_type: group allocations by lineno, filename or traceback (default lineno)
+      stop:     stop tracing (1), instead of reporting
+    """
+    memory = getattr(current_app, "memory", None)
+    if memory is None:
+        abort(404)
+    if request.args.get("stop", 0, type=int):
+        memory.stop()
+        return jsonify({"tracing": False})
+    key_type = request.args.get("key_type", "lineno")
+    if key_type not in ("lineno", "filename", "traceback"):
+        abort(400)
+    res = memory.report(
+        limit=request.args.get("limit", 10, type=int), key_type=key_type
+    )
+    res["state"] = current_app.mystate.state_sizes()  # type: ignore[attr-defined]
+    return jsonify(res)